@@ -48,18 +48,16 @@ def load_file(input_file):
                 entries = None
                 break
             try:
-                net = ipaddress.ip_network(prefix)
+                netrange, num_bits = asmap.parse_prefix(prefix)
             except ValueError:
                 txt_error = f"invalid network '{prefix}'"
                 entries = None
                 break
-            entries.append((asmap.net_to_prefix(net), int(asn[2:])))
+            entries.append((netrange, num_bits, int(asn[2:])))
     if entries is not None and bin_asmap is not None and len(contents) > 0:
         sys.exit(f"Input file '{input_file.name}' is ambiguous.")
     if entries is not None:
-        state = asmap.ASMap()
-        state.update_multi(entries)
-        return state
+        return asmap.ASMap.from_packed_entries(entries)
     if bin_asmap is not None:
         return bin_asmap
     sys.exit(f"Input file '{input_file.name}' is neither a valid binary asmap file nor valid text input ({txt_error}).")
@@ -7,9 +7,13 @@ This module provides the ASNEntry and ASMap classes.
 """
 
 import copy
+import gc
+import hashlib
 import ipaddress
 import random
 import unittest
+from array import array
+from bisect import bisect_left, bisect_right
 from collections.abc import Callable, Iterable
 from enum import Enum
 from functools import total_ordering
@@ -47,12 +51,91 @@ def prefix_to_net(prefix: list[bool]) -> Union[ipaddress.IPv4Network,ipaddress.I
     # Return IPv6 range otherwise.
     return ipaddress.IPv6Network((netrange, num_bits), True)
 
+def parse_prefix(text: str) -> tuple[int, int]:
+    """
+    Parse an IPv4 or IPv6 network in CIDR notation into a packed prefix
+    (netrange, num_bits), the integer form of the prefix net_to_prefix returns.
+
+    IPv4 ranges are remapped to their IPv4-mapped IPv6 range (::ffff:0:0/96).
+    Raises ValueError for invalid networks, including ones with host bits set.
+    """
+    addr, _, num_bits_str = text.partition('/')
+    octets = addr.split('.')
+    # Fast path for the common IPv4 notation; anything else is left to ipaddress.
+    if (len(octets) == 4 and num_bits_str.isascii() and num_bits_str.isdigit() and len(num_bits_str) <= 2 and
+            all(o.isascii() and o.isdigit() and len(o) <= 3 and (o == '0' or o[0] != '0') for o in octets)):
+        netrange = 0
+        for octet in octets:
+            val = int(octet)
+            if val > 255:
+                raise ValueError(f"invalid network '{text}'")
+            netrange = (netrange << 8) | val
+        num_bits = int(num_bits_str)
+        if num_bits > 32 or netrange & ((1 << (32 - num_bits)) - 1):
+            raise ValueError(f"invalid network '{text}'")
+        return 0xffff00000000 + netrange, num_bits + 96
+    net = ipaddress.ip_network(text)
+    num_bits = net.prefixlen
+    netrange = int(net.network_address)
+    if isinstance(net, ipaddress.IPv4Network):
+        num_bits += 96
+        netrange += 0xffff00000000
+    return netrange, num_bits
+
+def ip_to_int(ip: Union[ipaddress.IPv4Address,ipaddress.IPv6Address]) -> int:
+    """
+    Convert an IPv4 or IPv6 address to an integer in the 128-bit address space
+    used by ASMap.lookup_many.
+
+    IPv4 addresses are remapped to their IPv4-mapped IPv6 address (::ffff:0:0/96).
+    """
+    if isinstance(ip, ipaddress.IPv4Address):
+        return 0xffff00000000 + int(ip)
+    return int(ip)
+
 # Shortcut for (prefix, ASN) entries.
 ASNEntry = tuple[list[bool], int]
 
 # Shortcut for (prefix, old ASN, new ASN) entries.
 ASNDiff = tuple[list[bool], int, int]
 
+# Shortcut for (netrange, num_bits, ASN) entries, with packed prefixes (see parse_prefix).
+PackedASNEntry = tuple[int, int, int]
+
+class _BitWriter:
+    """
+    A writer for bit streams as used by the binary asmap format, where the bits
+    of each byte are stored starting with the least significant one.
+
+    It supports append and extend like a list of bits, so it can be passed to
+    _VarLenCoder.encode.
+    """
+
+    def __init__(self) -> None:
+        self._data = bytearray()
+        self._byte = 0
+        self._nbits = 0
+
+    def append(self, bit: int) -> None:
+        """Append a single bit."""
+        self._byte |= bit << self._nbits
+        self._nbits += 1
+        if self._nbits == 8:
+            self._data.append(self._byte)
+            self._byte = 0
+            self._nbits = 0
+
+    def extend(self, bits: Iterable[int]) -> None:
+        """Append multiple bits."""
+        for bit in bits:
+            self.append(bit)
+
+    def to_bytes(self) -> bytes:
+        """Return the bits written so far, padding the last byte with 0 bits."""
+        if self._nbits:
+            return bytes(self._data) + bytes([self._byte])
+        return bytes(self._data)
+
 class _VarLenCoder:
     """
     A class representing a custom variable-length binary encoder/decoder for
@@ -81,13 +164,16 @@ class _VarLenCoder:
         self._minval = minval
         self._clsbits = clsbits
         self._maxval = minval + sum(1 << b for b in clsbits) - 1
+        # First value and encoded size of each class, for encode_size.
+        self._class_starts = [minval + sum(1 << b for b in clsbits[:k]) for k in range(len(clsbits))]
+        self._class_sizes = [min(k + 1, len(clsbits) - 1) + bits for k, bits in enumerate(clsbits)]
 
     def can_encode(self, val: int) -> bool:
         """Check whether value val is in the range this coder supports."""
         return self._minval <= val <= self._maxval
 
-    def encode(self, val: int, ret: list[int]) -> None:
-        """Append encoding of val onto integer list ret."""
+    def encode(self, val: int, ret: Union[list[int], _BitWriter]) -> None:
+        """Append encoding of val onto integer list or _BitWriter ret."""
 
         assert self._minval <= val <= self._maxval
         val -= self._minval
@@ -109,35 +195,30 @@ class _VarLenCoder:
     def encode_size(self, val: int) -> int:
         """Compute how many bits are needed to encode val."""
         assert self._minval <= val <= self._maxval
-        val -= self._minval
-        ret = 0
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            if val >> bits:
-                val -= 1 << bits
-                ret += 1
-            else:
-                ret += k + 1 < len(self._clsbits)
-                break
-        return ret + bits
+        return self._class_sizes[bisect_right(self._class_starts, val) - 1]
 
-    def decode(self, stream, bitpos) -> tuple[int,int]:
-        """Decode a number starting at bitpos in stream, returning value and new bitpos."""
+    def decode(self, stream: bytes, bitpos: int) -> tuple[int,int]:
+        """
+        Decode a number starting at bitpos in stream, returning value and new bitpos.
+
+        The bits of stream are read directly from its bytes, least significant bit
+        first. Reading past the end of stream raises IndexError.
+        """
         val = self._minval
         bits = 0
         for k, bits in enumerate(self._clsbits):
             bit = 0
             if k + 1 < len(self._clsbits):
-                bit = stream[bitpos]
+                bit = (stream[bitpos >> 3] >> (bitpos & 7)) & 1
                 bitpos += 1
             if not bit:
                 break
             val += 1 << bits
-        for i in range(bits):
-            bit = stream[bitpos]
+        pos = 0
+        for _ in range(bits):
+            pos = (pos << 1) | ((stream[bitpos >> 3] >> (bitpos & 7)) & 1)
             bitpos += 1
-            val += bit << (bits - 1 - i)
-        return val, bitpos
+        return val + pos, bitpos
 
 # Variable-length encoders used in the binary asmap format.
 _CODER_INS = _VarLenCoder(0, [0, 0, 1])
@@ -173,6 +254,9 @@ class _Instruction(Enum):
     # before the top level is reached (see make_default below).
     END = 4
 
+# Encoded size of each instruction, used for computing _BinNode sizes.
+_INS_SIZES = {ins: _CODER_INS.encode_size(ins.value) for ins in _Instruction if ins != _Instruction.END}
+
 class _BinNode:
     """A class representing a (node of) the parsed binary asmap format."""
 
@@ -200,20 +284,20 @@ class _BinNode:
         if ins == _Instruction.RETURN:
             assert isinstance(arg1, int)
             assert arg2 is None
-            self.size = _CODER_INS.encode_size(ins.value) + _CODER_ASN.encode_size(arg1)
+            self.size = _INS_SIZES[ins] + _CODER_ASN.encode_size(arg1)
         elif ins == _Instruction.JUMP:
             assert isinstance(arg1, _BinNode)
             assert isinstance(arg2, _BinNode)
-            self.size = (_CODER_INS.encode_size(ins.value) + _CODER_JUMP.encode_size(arg1.size) +
+            self.size = (_INS_SIZES[ins] + _CODER_JUMP.encode_size(arg1.size) +
                          arg1.size + arg2.size)
         elif ins == _Instruction.DEFAULT:
             assert isinstance(arg1, int)
             assert isinstance(arg2, _BinNode)
-            self.size = _CODER_INS.encode_size(ins.value) + _CODER_ASN.encode_size(arg1) + arg2.size
+            self.size = _INS_SIZES[ins] + _CODER_ASN.encode_size(arg1) + arg2.size
         elif ins == _Instruction.MATCH:
             assert isinstance(arg1, int)
             assert isinstance(arg2, _BinNode)
-            self.size = (_CODER_INS.encode_size(ins.value) + _CODER_MATCH.encode_size(arg1)
+            self.size = (_INS_SIZES[ins] + _CODER_MATCH.encode_size(arg1)
                          + arg2.size)
         elif ins == _Instruction.END:
             assert arg1 is None
@@ -266,6 +350,74 @@ class _BinNode:
             return sub
         return _BinNode(_Instruction.DEFAULT, val, sub)
 
+class _CompiledLookup:
+    """
+    A flattened multibit trie for fast lookups of full addresses.
+
+    The binary trie of an ASMap object is compiled into tables of 2^stride
+    entries, all stored in one flat array. Every table consumes the next
+    stride bits of an address. An entry is either (asn << 1) | 1 for a leaf,
+    with asn 0 for an unassigned range, or (offset << 1) for the table at
+    offset that consumes the following bits.
+    """
+
+    def __init__(self, trie: list, stride: int):
+        assert 32 % stride == 0
+        self._stride = stride
+        self._table = array('I')
+        self._root = self._compile(trie)
+        # The entry reached after the 96 bits of the IPv4-mapped prefix (::ffff:0:0/96),
+        # so that IPv4 lookups can start there.
+        self._ipv4_root = self._root
+        mask = (1 << stride) - 1
+        for shift in range(96 - stride, -1, -stride):
+            if self._ipv4_root & 1:
+                break
+            self._ipv4_root = self._table[(self._ipv4_root >> 1) + ((0xffff >> shift) & mask)]
+
+    def _compile(self, node: list) -> int:
+        """Compile the subtrie node, which starts at a table boundary, and return its entry."""
+        if len(node) == 1:
+            return (node[0] << 1) | 1
+        offset = len(self._table)
+        self._table.extend(array('I', [0]) * (1 << self._stride))
+        # Internal nodes at the next table boundary, with the index of their entry
+        pending: list[tuple[int, list]] = []
+
+        def fill(node: list, index: int, span: int) -> None:
+            if len(node) == 1:
+                self._table[index:index + span] = array('I', [(node[0] << 1) | 1]) * span
+            elif span == 1:
+                pending.append((index, node))
+            else:
+                fill(node[0], index, span >> 1)
+                fill(node[1], index + (span >> 1), span >> 1)
+        fill(node, offset, 1 << self._stride)
+        for index, child in pending:
+            self._table[index] = self._compile(child)
+        return offset << 1
+
+    def lookup_many(self, ips: Iterable[int]) -> list[int]:
+        """Look up addresses given as integers (see ip_to_int). Returns their ASNs, or 0 if unassigned."""
+        table = self._table
+        stride = self._stride
+        mask = (1 << stride) - 1
+        root = self._root
+        ipv4_root = self._ipv4_root
+        ret = []
+        for ip in ips:
+            if ip >> 32 == 0xffff:
+                entry = ipv4_root
+                shift = 32 - stride
+            else:
+                entry = root
+                shift = 128 - stride
+            while not entry & 1:
+                entry = table[(entry >> 1) + ((ip >> shift) & mask)]
+                shift -= stride
+            ret.append(entry >> 1)
+        return ret
+
 @total_ordering
 class ASMap:
     """
@@ -280,11 +432,20 @@ class ASMap:
     - [int] means a subnet mapped entirely to the specified ASN.
     - [node,node] means a subnet whose lower half and upper half have different
     -             mappings, represented by new trie nodes.
+
+    For lookups of many addresses, the trie is compiled into a flat multibit
+    trie on first use of lookup_many (see _CompiledLookup).
     """
 
+    # Number of address bits consumed per table of the compiled lookup trie. Larger
+    # strides need fewer steps per lookup, but much more memory for sparse tables.
+    LOOKUP_STRIDE = 4
+
     def update(self, prefix: list[bool], asn: int) -> None:
         """Update this ASMap object to map prefix to the specified asn."""
         assert asn == 0 or _CODER_ASN.can_encode(asn)
+        self._compiled = None
+        self._hashes = None
 
         def recurse(node: list, offset: int) -> None:
             if offset == len(prefix):
@@ -307,6 +468,106 @@ class ASMap:
                 node.append(oldasn)
         recurse(self._trie, 0)
 
+    @staticmethod
+    def from_packed_entries(entries: Iterable[PackedASNEntry]) -> "ASMap":
+        """
+        Construct an ASMap object from (netrange, num_bits, asn) entries with the
+        same result as update_multi: longer prefixes take precedence, and of
+        multiple entries for the same prefix the last one is used.
+
+        Instead of inserting the entries one by one, they are sorted by network
+        address once and the trie is built in a single pass over them. Along the
+        way, every node gets a hash of its subtree (see _subtree_hashes), which
+        diff() uses to skip identical subtrees.
+        """
+        sorted_entries = sorted(entries, key=lambda entry: (entry[0], entry[1]))
+        starts = [entry[0] for entry in sorted_entries]
+        # {id(node): hash of its subtree}, and the hashes of leaves by ASN.
+        hashes: dict[int, bytes] = {}
+        leaf_hashes: dict[int, bytes] = {}
+
+        def leaf(asn: int) -> list:
+            node = [asn]
+            if asn not in leaf_hashes:
+                leaf_hashes[asn] = hashlib.blake2b(b'L' + asn.to_bytes(4, 'little'), digest_size=16).digest()
+            hashes[id(node)] = leaf_hashes[asn]
+            return node
+
+        def branch(left: list, right: list) -> list:
+            node = [left, right]
+            hashes[id(node)] = hashlib.blake2b(b'N' + hashes[id(left)] + hashes[id(right)], digest_size=16).digest()
+            return node
+
+        def build(netrange: int, depth: int, lo: int, hi: int, asn: int) -> list:
+            """Build the node for netrange/depth from sorted_entries[lo:hi], which lie within it."""
+            # Entries for exactly this prefix sort first, and override the inherited ASN.
+            while lo < hi and sorted_entries[lo][1] == depth:
+                asn = sorted_entries[lo][2]
+                assert asn == 0 or _CODER_ASN.can_encode(asn)
+                lo += 1
+            if lo == hi:
+                return leaf(asn)
+            if hi - lo == 1:
+                # A single more specific entry: build the path down to it bottom-up.
+                entry_netrange, entry_bits, entry_asn = sorted_entries[lo]
+                assert entry_asn == 0 or _CODER_ASN.can_encode(entry_asn)
+                if entry_asn == asn:
+                    return leaf(asn)
+                node = leaf(entry_asn)
+                for bit_depth in range(entry_bits - 1, depth - 1, -1):
+                    if (entry_netrange >> (127 - bit_depth)) & 1:
+                        node = branch(leaf(asn), node)
+                    else:
+                        node = branch(node, leaf(asn))
+                return node
+            upper = netrange | (1 << (127 - depth))
+            mid = bisect_left(starts, upper, lo, hi)
+            left = build(netrange, depth + 1, lo, mid, asn)
+            right = build(upper, depth + 1, mid, hi, asn)
+            if len(left) == 1 and left == right:
+                del hashes[id(right)]
+                return left
+            return branch(left, right)
+
+        # The trie has no reference cycles, but its millions of lists would trigger
+        # repeated full garbage collection passes while it is being built.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            trie = build(0, 0, 0, len(sorted_entries), 0)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        ret = ASMap()
+        #pylint: disable=protected-access
+        ret._trie = trie
+        ret._hashes = hashes
+        return ret
+
+    def _subtree_hashes(self) -> dict[int, bytes]:
+        """
+        Return {id(node): hash of its subtree} for the nodes of the trie. Objects
+        built by from_packed_entries have them already; for all others they are
+        computed in one bottom-up pass, and kept until the trie is modified.
+        """
+        if self._hashes is None:
+            hashes: dict[int, bytes] = {}
+            leaf_hashes: dict[int, bytes] = {}
+
+            def recurse(node: list) -> bytes:
+                if len(node) == 1:
+                    asn = node[0]
+                    if asn not in leaf_hashes:
+                        leaf_hashes[asn] = hashlib.blake2b(b'L' + asn.to_bytes(4, 'little'), digest_size=16).digest()
+                    node_hash = leaf_hashes[asn]
+                else:
+                    node_hash = hashlib.blake2b(b'N' + recurse(node[0]) + recurse(node[1]), digest_size=16).digest()
+                hashes[id(node)] = node_hash
+                return node_hash
+            recurse(self._trie)
+            self._hashes = hashes
+        return self._hashes
+
     def update_multi(self, entries: list[tuple[list[bool], int]]) -> None:
         """Apply multiple update operations, where longer prefixes take precedence."""
         entries.sort(key=lambda entry: len(entry[0]))
@@ -331,10 +592,14 @@ class ASMap:
                     node.append(asn)
         recurse(trie)
         self._trie = trie
+        self._compiled = None
+        self._hashes = None
 
     def __init__(self, entries: Optional[Iterable[ASNEntry]] = None) -> None:
         """Construct an ASMap object from an optional list of entries."""
         self._trie = [0]
+        self._compiled: Optional[_CompiledLookup] = None
+        self._hashes: Optional[dict[int, bytes]] = None
         if entries is not None:
             def entry_key(entry):
                 """Sort function that places shorter prefixes first."""
@@ -354,6 +619,18 @@ class ASMap:
             return node[0]
         return None
 
+    def lookup_many(self, ips: Iterable[int]) -> list[int]:
+        """
+        Look up many full addresses, given as integers (see ip_to_int).
+
+        Returns the list of their ASNs, with 0 for unassigned addresses. This
+        is much faster than calling lookup for each address, as the trie is
+        compiled into a flat lookup structure once.
+        """
+        if self._compiled is None:
+            self._compiled = _CompiledLookup(self._trie, self.LOOKUP_STRIDE)
+        return self._compiled.lookup_many(ips)
+
     def _to_entries_flat(self, fill: bool = False) -> list[ASNEntry]:
         """Convert an ASMap object to a list of non-overlapping (prefix, asn) objects."""
         prefix : list[bool] = []
@@ -473,14 +750,9 @@ class ASMap:
 
     def _to_binnode(self, fill: bool = False) -> _BinNode:
         """Convert a trie to a _BinNode object."""
-        def recurse(node: list) -> tuple[dict[Optional[int], _BinNode], bool]:
-            if len(node) == 1 and node[0] == 0:
-                return {(None if fill else 0): _BinNode.make_end()}, True
-            if len(node) == 1:
-                return {None: _BinNode.make_leaf(node[0]), node[0]: _BinNode.make_end()}, False
+        def combine(left: dict[Optional[int], _BinNode], lhole: bool,
+                    right: dict[Optional[int], _BinNode], rhole: bool) -> tuple[dict[Optional[int], _BinNode], bool]:
             ret: dict[Optional[int], _BinNode] = {}
-            left, lhole = recurse(node[0])
-            right, rhole = recurse(node[1])
             hole = (lhole or rhole) and not fill
 
             def candidate(ctx: Optional[int], arg1, arg2, func: Callable):
@@ -504,20 +776,69 @@ class ASMap:
             if hole:
                 ret = {ctx:enc for ctx, enc in ret.items() if ctx is None or ctx == 0}
             return ret, hole
-        res, _ = recurse(self._trie)
+
+        # Post-order traversal with an explicit stack: a node is pushed once to
+        # visit its children, and once more to combine their results, which are
+        # kept on the results stack.
+        stack: list[tuple[list, bool]] = [(self._trie, False)]
+        results: list[tuple[dict[Optional[int], _BinNode], bool]] = []
+        while stack:
+            node, children_done = stack.pop()
+            if len(node) == 1 and node[0] == 0:
+                results.append(({(None if fill else 0): _BinNode.make_end()}, True))
+            elif len(node) == 1:
+                results.append(({None: _BinNode.make_leaf(node[0]), node[0]: _BinNode.make_end()}, False))
+            elif not children_done:
+                stack.append((node, True))
+                stack.append((node[1], False))
+                stack.append((node[0], False))
+            else:
+                right, rhole = results.pop()
+                left, lhole = results.pop()
+                results.append(combine(left, lhole, right, rhole))
+        res, _ = results.pop()
         return res[0] if 0 in res else res[None]
 
     @staticmethod
     def _from_binnode(binnode: _BinNode) -> "ASMap":
-        """Construct an ASMap object from a _BinNode. Internal use only."""
-        def recurse(node: _BinNode, default: int) -> list:
+        """
+        Construct an ASMap object from a _BinNode. Internal use only. Raises
+        ValueError if the program inspects more than 128 bits.
+        """
+        ret = ASMap()
+        if binnode.ins == _Instruction.END:
+            return ret
+        # Post-order traversal with an explicit stack, as DEFAULT instructions can
+        # be nested arbitrarily deep without consuming any bits. Each entry is
+        # (node, default ASN, number of bits inspected before it, children done),
+        # and the tries of completed subprograms are kept on the results stack.
+        stack: list[tuple[_BinNode, int, int, bool]] = [(binnode, 0, 0, False)]
+        results: list[list] = []
+        while stack:
+            node, default, depth, children_done = stack.pop()
             if node.ins == _Instruction.RETURN:
-                return [node.arg1]
-            if node.ins == _Instruction.JUMP:
-                return [recurse(node.arg1, default), recurse(node.arg2, default)]
-            if node.ins == _Instruction.MATCH:
+                results.append([node.arg1])
+            elif node.ins == _Instruction.DEFAULT:
+                stack.append((node.arg2, node.arg1, depth, False))
+            elif not children_done:
+                stack.append((node, default, depth, True))
+                if node.ins == _Instruction.JUMP:
+                    depth += 1
+                    stack.append((node.arg2, default, depth, False))
+                    stack.append((node.arg1, default, depth, False))
+                else:
+                    assert node.ins == _Instruction.MATCH
+                    depth += node.arg1.bit_length() - 1
+                    stack.append((node.arg2, default, depth, False))
+                if depth > 128:
+                    raise ValueError("Program inspects more than 128 bits")
+            elif node.ins == _Instruction.JUMP:
+                right = results.pop()
+                left = results.pop()
+                results.append([left, right])
+            else:
                 val = node.arg1
-                sub = recurse(node.arg2, default)
+                sub = results.pop()
                 while val >= 2:
                     bit = val & 1
                     val >>= 1
@@ -525,13 +846,9 @@ class ASMap:
                         sub = [[default], sub]
                     else:
                         sub = [sub, [default]]
-                return sub
-            assert node.ins == _Instruction.DEFAULT
-            return recurse(node.arg2, node.arg1)
-        ret = ASMap()
-        if binnode.ins != _Instruction.END:
-            #pylint: disable=protected-access
-            ret._set_trie(recurse(binnode, 0))
+                results.append(sub)
+        #pylint: disable=protected-access
+        ret._set_trie(results.pop())
         return ret
 
     def to_binary(self, fill: bool = False) -> bytes:
@@ -545,85 +862,94 @@ class ASMap:
         Returns:
             A bytes object with the encoding of this ASMap object.
         """
-        bits: list[int] = []
-
-        def recurse(node: _BinNode) -> None:
-            _CODER_INS.encode(node.ins.value, bits)
+        writer = _BitWriter()
+        binnode = self._to_binnode(fill)
+        # Pre-order traversal with an explicit stack.
+        stack = [] if binnode.ins == _Instruction.END else [binnode]
+        while stack:
+            node = stack.pop()
+            _CODER_INS.encode(node.ins.value, writer)
             if node.ins == _Instruction.RETURN:
-                _CODER_ASN.encode(node.arg1, bits)
+                _CODER_ASN.encode(node.arg1, writer)
             elif node.ins == _Instruction.JUMP:
-                _CODER_JUMP.encode(node.arg1.size, bits)
-                recurse(node.arg1)
-                recurse(node.arg2)
+                _CODER_JUMP.encode(node.arg1.size, writer)
+                stack.append(node.arg2)
+                stack.append(node.arg1)
             elif node.ins == _Instruction.DEFAULT:
-                _CODER_ASN.encode(node.arg1, bits)
-                recurse(node.arg2)
+                _CODER_ASN.encode(node.arg1, writer)
+                stack.append(node.arg2)
             else:
                 assert node.ins == _Instruction.MATCH
-                _CODER_MATCH.encode(node.arg1, bits)
-                recurse(node.arg2)
+                _CODER_MATCH.encode(node.arg1, writer)
+                stack.append(node.arg2)
+        return writer.to_bytes()
 
-        binnode = self._to_binnode(fill)
-        if binnode.ins != _Instruction.END:
-            recurse(binnode)
-
-        val = 0
-        nbits = 0
-        ret = []
-        for bit in bits:
-            val += (bit << nbits)
-            nbits += 1
-            if nbits == 8:
-                ret.append(val)
-                val = 0
-                nbits = 0
-        if nbits:
-            ret.append(val)
-        return bytes(ret)
+    @staticmethod
+    def _decode_binnode(bindata: bytes) -> tuple[_BinNode, int]:
+        """
+        Decode the program in bindata into a _BinNode, returning it with the
+        bit position after it. Raises ValueError or IndexError if it is invalid.
+        """
+        # Instructions with subprograms that are not fully decoded yet, as
+        # [instruction, argument, decoded subprograms]. For JUMP instructions
+        # the argument is the bit position the second subprogram starts at.
+        stack: list[list] = []
+        bitpos = 0
+        while True:
+            insval, bitpos = _CODER_INS.decode(bindata, bitpos)
+            ins = _Instruction(insval)
+            if ins == _Instruction.RETURN:
+                asn, bitpos = _CODER_ASN.decode(bindata, bitpos)
+                node = _BinNode(ins, asn)
+            else:
+                if ins == _Instruction.JUMP:
+                    jump, bitpos = _CODER_JUMP.decode(bindata, bitpos)
+                    stack.append([ins, bitpos + jump, []])
+                elif ins == _Instruction.MATCH:
+                    match, bitpos = _CODER_MATCH.decode(bindata, bitpos)
+                    stack.append([ins, match, []])
+                else:
+                    assert ins == _Instruction.DEFAULT
+                    asn, bitpos = _CODER_ASN.decode(bindata, bitpos)
+                    stack.append([ins, asn, []])
+                continue
+            # A subprogram was completed; attach it to the instructions it completes.
+            while stack:
+                ins, arg, subs = stack[-1]
+                subs.append(node)
+                if ins == _Instruction.JUMP:
+                    if len(subs) == 1:
+                        if bitpos != arg:
+                            raise ValueError("Inconsistent jump")
+                        break
+                    node = _BinNode(ins, subs[0], subs[1])
+                else:
+                    node = _BinNode(ins, arg, node)
+                stack.pop()
+            else:
+                return node, bitpos
 
     @staticmethod
     def from_binary(bindata: bytes) -> Optional["ASMap"]:
         """Decode an ASMap object from the provided binary encoding."""
-
-        bits: list[int] = []
-        for byte in bindata:
-            bits.extend((byte >> i) & 1 for i in range(8))
-
-        def recurse(bitpos: int) -> tuple[_BinNode, int]:
-            insval, bitpos = _CODER_INS.decode(bits, bitpos)
-            ins = _Instruction(insval)
-            if ins == _Instruction.RETURN:
-                asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-                return _BinNode(ins, asn), bitpos
-            if ins == _Instruction.JUMP:
-                jump, bitpos = _CODER_JUMP.decode(bits, bitpos)
-                left, bitpos1 = recurse(bitpos)
-                if bitpos1 != bitpos + jump:
-                    raise ValueError("Inconsistent jump")
-                right, bitpos = recurse(bitpos1)
-                return _BinNode(ins, left, right), bitpos
-            if ins == _Instruction.MATCH:
-                match, bitpos = _CODER_MATCH.decode(bits, bitpos)
-                sub, bitpos = recurse(bitpos)
-                return _BinNode(ins, match, sub), bitpos
-            assert ins == _Instruction.DEFAULT
-            asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-            sub, bitpos = recurse(bitpos)
-            return _BinNode(ins, asn, sub), bitpos
-
-        if len(bits) == 0:
+        bindata = bytes(bindata)
+        if len(bindata) == 0:
             binnode = _BinNode(_Instruction.END)
         else:
             try:
-                binnode, bitpos = recurse(0)
+                binnode, bitpos = ASMap._decode_binnode(bindata)
             except (ValueError, IndexError):
                 return None
-            if bitpos < len(bits) - 7:
+            if bitpos < len(bindata) * 8 - 7:
                 return None
-            if not all(bit == 0 for bit in bits[bitpos:]):
+            # The padding bits of the last byte must be 0.
+            if bitpos < len(bindata) * 8 and bindata[-1] >> (bitpos & 7):
                 return None
 
-        return ASMap._from_binnode(binnode)
+        try:
+            return ASMap._from_binnode(binnode)
+        except ValueError:
+            return None
 
     def __lt__(self, other: "ASMap") -> bool:
         return self._trie < other._trie
@@ -650,11 +976,20 @@ class ASMap:
         return recurse(self._trie, req._trie)
 
     def diff(self, other: "ASMap") -> list[ASNDiff]:
-        """Compute the diff from self to other."""
+        """
+        Compute the diff from self to other. Structurally identical subtrees are
+        skipped by comparing their hashes (see _subtree_hashes).
+        """
         prefix: list[bool] = []
         ret: list[ASNDiff] = []
+        assert isinstance(other, ASMap)
+        #pylint: disable=protected-access
+        old_hashes = self._subtree_hashes()
+        new_hashes = other._subtree_hashes()
 
         def recurse(old_node: list, new_node: list):
+            if old_hashes[id(old_node)] == new_hashes[id(new_node)]:
+                return
             if len(old_node) == 1 and len(new_node) == 1:
                 if old_node[0] != new_node[0]:
                     ret.append((list(prefix), old_node[0], new_node[0]))
@@ -668,8 +1003,6 @@ class ASMap:
                 prefix[-1] = True
                 recurse(old_right, new_right)
                 prefix.pop()
-        assert isinstance(other, ASMap)
-        #pylint: disable=protected-access
         recurse(self._trie, other._trie)
         return ret
 
@@ -712,6 +1045,98 @@ class TestASMap(unittest.TestCase):
                 net2 = prefix_to_net(prefix)
                 self.assertEqual(net, net2)
 
+    def test_bit_stream(self) -> None:
+        """Test that values roundtrip through _BitWriter and _VarLenCoder.decode."""
+        for coder in (_CODER_INS, _CODER_ASN, _CODER_MATCH, _CODER_JUMP):
+            # pylint: disable=protected-access
+            values = [random.randint(coder._minval, coder._maxval) for _ in range(100)]
+            writer = _BitWriter()
+            for val in values:
+                coder.encode(val, writer)
+            stream = writer.to_bytes()
+            bitpos = 0
+            for val in values:
+                decoded, bitpos = coder.decode(stream, bitpos)
+                self.assertEqual(decoded, val)
+            self.assertEqual(len(stream), (bitpos + 7) // 8)
+            with self.assertRaises(IndexError):
+                coder.decode(stream, len(stream) * 8)
+        # Maps with many full-length prefixes roundtrip as well.
+        entries = [(net_to_prefix(ipaddress.IPv6Network((random.getrandbits(128), 128))), random.randrange(1, 1000))
+                   for _ in range(200)]
+        asmap = ASMap(entries)
+        self.assertEqual(ASMap.from_binary(asmap.to_binary()), asmap)
+        # Deeply nested DEFAULT instructions do not consume bits, and decode fine.
+        writer = _BitWriter()
+        for _ in range(5000):
+            _CODER_INS.encode(_Instruction.DEFAULT.value, writer)
+            _CODER_ASN.encode(1, writer)
+        _CODER_INS.encode(_Instruction.RETURN.value, writer)
+        _CODER_ASN.encode(2, writer)
+        asmap = ASMap.from_binary(writer.to_bytes())
+        assert asmap is not None
+        self.assertEqual(asmap.lookup([False] * 128), 2)
+        # Programs inspecting more than 128 bits are rejected.
+        for num_matches, valid in ((128, True), (129, False)):
+            writer = _BitWriter()
+            for _ in range(num_matches):
+                _CODER_INS.encode(_Instruction.MATCH.value, writer)
+                _CODER_MATCH.encode(2, writer)
+            _CODER_INS.encode(_Instruction.RETURN.value, writer)
+            _CODER_ASN.encode(2, writer)
+            self.assertEqual(ASMap.from_binary(writer.to_bytes()) is not None, valid)
+
+    def test_lookup_many(self) -> None:
+        """Test that lookup_many agrees with lookup, also after updates."""
+        self.assertEqual(ip_to_int(ipaddress.IPv4Address("1.2.3.4")), int(ipaddress.IPv6Address("::ffff:1.2.3.4")))
+        for leaves in range(1, 20):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=1000, unassigned_prob=0.3)
+            # Add entries within the IPv4-mapped range, where lookups take a shortcut.
+            for _ in range(10):
+                prefix_len = random.randrange(33)
+                net_bits = (random.getrandbits(32) >> (32 - prefix_len)) << (32 - prefix_len)
+                asmap.update(net_to_prefix(ipaddress.IPv4Network((net_bits, prefix_len))), random.randrange(1000))
+            ips = [random.getrandbits(128) for _ in range(50)]
+            ips += [0xffff00000000 + random.getrandbits(32) for _ in range(50)]
+            expected = [asmap.lookup([((ip >> (127 - i)) & 1) != 0 for i in range(128)]) for ip in ips]
+            self.assertEqual(asmap.lookup_many(ips), expected)
+            # Updates invalidate the compiled lookup structure.
+            asmap.update([], 5)
+            self.assertEqual(asmap.lookup_many(ips), [5] * len(ips))
+
+    def test_packed_entries(self) -> None:
+        """Test parse_prefix and from_packed_entries against net_to_prefix and update_multi."""
+        for text in ["0.0.0.0/0", "1.2.3.0/24", "255.255.255.255/32", "10.0.0.0", "::/0", "2001:db8::/32", "::ffff:1.2.0.0/112"]:
+            net = ipaddress.ip_network(text)
+            netrange, num_bits = parse_prefix(text)
+            self.assertEqual([((netrange >> (127 - i)) & 1) != 0 for i in range(num_bits)], net_to_prefix(net))
+        for text in ["1.2.3.4/24", "1.2.3.0/33", "1.2.3.256/32", "01.2.3.0/24", "1.2.3/24", "2001:db8::1/32", "foo"]:
+            with self.assertRaises(ValueError):
+                parse_prefix(text)
+        for _ in range(50):
+            entries = []
+            for _ in range(random.randrange(100)):
+                if random.randrange(2):
+                    num_bits = random.randrange(33)
+                    net = ipaddress.IPv4Network(((random.getrandbits(32) >> (32 - num_bits)) << (32 - num_bits), num_bits))
+                else:
+                    num_bits = random.randrange(129)
+                    net = ipaddress.IPv6Network(((random.getrandbits(128) >> (128 - num_bits)) << (128 - num_bits), num_bits))
+                # Repeat some prefixes, the last entry of a prefix counts.
+                if entries and random.randrange(5) == 0:
+                    net = random.choice(entries)[0]
+                entries.append((net, random.randrange(1000)))
+            expected = ASMap()
+            expected.update_multi([(net_to_prefix(net), asn) for net, asn in entries])
+            asmap = ASMap.from_packed_entries([(*parse_prefix(str(net)), asn) for net, asn in entries])
+            self.assertEqual(asmap, expected)
+            self.assertEqual(asmap.to_entries(), expected.to_entries())
+            # Diffs skipping identical subtrees by hash agree with full ones.
+            other_entries = entries[:random.randrange(len(entries) + 1)] + entries[:random.randrange(len(entries) + 1)]
+            other = ASMap.from_packed_entries([(*parse_prefix(str(net)), asn) for net, asn in other_entries])
+            self.assertEqual(asmap.diff(other), expected.diff(ASMap(other.to_entries())))
+            self.assertEqual(asmap.diff(asmap), [])
+
     def test_asmap_roundtrips(self) -> None:
         """Test case that verifies random ASMap objects roundtrip to/from entries/binary."""
         # Iterate over the number of leaves the random test ASMap objects have.
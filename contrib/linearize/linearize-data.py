@@ -14,9 +14,12 @@ import os.path
 import sys
 import hashlib
 import datetime
+import json
+import mmap
 import time
 import glob
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 settings = {}
 
@@ -86,6 +89,50 @@ def read_xor_key(blocks_path):
     except FileNotFoundError:
         return bytes([0] * NUM_XOR_BYTES)
 
+def xor_bytes(data, key, offset):
+    """De-obfuscate data read at position offset of a block file with the
+    repeating key. The whole buffer is XORed at once as one big integer."""
+    if not any(key):
+        return bytes(data)
+    shift = offset % len(key)
+    rotated = key[shift:] + key[:shift]
+    keystream = (rotated * (len(data) // len(key) + 1))[:len(data)]
+    xored = int.from_bytes(data, 'little') ^ int.from_bytes(keystream, 'little')
+    return xored.to_bytes(len(data), 'little')
+
+def find_magic(data, start, magic, key):
+    """Return the position of the next network magic at or after start in the
+    obfuscated data of a block file, or None. Normally the next block starts
+    right at start. Otherwise, the magic is searched for once for each
+    alignment with the key, each search ending at the nearest match so far."""
+    if data[start:start + len(magic)] == xor_bytes(magic, key, start):
+        return start
+    if not any(key):
+        pos = data.find(magic, start)
+        return pos if pos != -1 else None
+    best = None
+    for phase in range(len(key)):
+        pattern = xor_bytes(magic, key, phase)
+        end = len(data) if best is None else best - 1 + len(magic)
+        pos = data.find(pattern, start, end)
+        while pos != -1 and pos % len(key) != phase:
+            pos = data.find(pattern, pos + 1, end)
+        if pos != -1:
+            best = pos
+    return best
+
+# Maximum number of memory-mapped input files kept open for out-of-order fetches
+MAX_OPEN_MAPS = 16
+
+# Extent index: one file per input file, starting with the size and
+# modification time of the input file it was created from, followed by one
+# record per block: header hash (in display byte order), offset of the block
+# record (network magic) in the input file and block size including header.
+INDEX_HEADER = struct.Struct("<QQ")
+INDEX_RECORD = struct.Struct("<32sQI")
+# Write the progress of an indexed copy every this many blocks
+CHECKPOINT_INTERVAL = 1000
+
 # Block header and extent on disk
 BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
 
@@ -98,7 +145,10 @@ class BlockDataCopier:
         # Get first occurring block file id - for pruned nodes this
         # will not necessarily be 0
         self.inFn = getFirstBlockFileId(self.settings['input'])
-        self.inF = None
+        self.inMap = None
+        self.inPos = 0
+        # Memory maps of the input files, least recently used first
+        self.maps = OrderedDict()
         self.outFn = 0
         self.outsz = 0
         self.outF = None
@@ -124,12 +174,28 @@ class BlockDataCopier:
         self.outOfOrderData = {}
         self.outOfOrderSize = 0 # running total size for items in outOfOrderData
 
-    def read_xored(self, f, size):
-        offset = f.tell()
-        data = bytearray(f.read(size))
-        for i in range(len(data)):
-            data[i] ^= self.xor_key[(i + offset) % len(self.xor_key)]
-        return bytes(data)
+    def read_xored(self, size):
+        """Read and de-obfuscate size bytes at the current position of the input file."""
+        data = xor_bytes(self.inMap[self.inPos:self.inPos + size], self.xor_key, self.inPos)
+        self.inPos += len(data)
+        return data
+
+    def getMap(self, fn):
+        """Return a read-only memory map of input file fn, or None if it does not exist or is empty."""
+        if fn in self.maps:
+            self.maps.move_to_end(fn)
+            return self.maps[fn]
+        try:
+            with open(self.inFileName(fn), "rb") as f:
+                self.maps[fn] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # ValueError: cannot map an empty file
+            return None
+        if len(self.maps) > MAX_OPEN_MAPS:
+            # Never close the file currently being scanned
+            oldest = next(f for f in self.maps if self.maps[f] is not self.inMap)
+            self.maps.pop(oldest).close()
+        return self.maps[fn]
 
     def writeBlock(self, inhdr, blk_hdr, rawblock):
         blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
@@ -181,9 +247,8 @@ class BlockDataCopier:
 
     def fetchBlock(self, extent):
         '''Fetch block contents from disk given extents'''
-        with open(self.inFileName(extent.fn), "rb") as f:
-            f.seek(extent.offset)
-            return self.read_xored(f, extent.size)
+        data = self.getMap(extent.fn)[extent.offset:extent.offset + extent.size]
+        return xor_bytes(data, self.xor_key, extent.offset)
 
     def copyOneBlock(self):
         '''Find the next block to be written in the input, and copy it to the output.'''
@@ -199,34 +264,33 @@ class BlockDataCopier:
 
     def run(self):
         while self.blkCountOut < len(self.blkindex):
-            if not self.inF:
+            if not self.inMap:
                 fname = self.inFileName(self.inFn)
                 print("Input file " + fname)
-                try:
-                    self.inF = open(fname, "rb")
-                except IOError:
+                if not os.path.exists(fname):
                     print("Premature end of block data")
                     return
-
-            inhdr = self.read_xored(self.inF, 8)
-            if (not inhdr or (inhdr[0] == "\0")):
-                self.inF.close()
-                self.inF = None
+                self.inMap = self.getMap(self.inFn)
+                self.inPos = 0
+                if not self.inMap:
+                    self.inFn = self.inFn + 1
+                    continue
+
+            # Skip to the next block, e.g. over the zeroed space preallocated
+            # at the end of the file
+            magicPos = find_magic(self.inMap, self.inPos, self.settings['netmagic'], self.xor_key)
+            if magicPos is None or magicPos + 8 > len(self.inMap):
+                self.inMap = None
                 self.inFn = self.inFn + 1
                 continue
+            self.inPos = magicPos
 
-            inMagic = inhdr[:4]
-            if (inMagic != self.settings['netmagic']):
-                # Seek backwards 7 bytes (skipping the first byte in the previous search)
-                # and continue searching from the new position if the magic bytes are not
-                # found.
-                self.inF.seek(-7, os.SEEK_CUR)
-                continue
+            inhdr = self.read_xored(8)
             inLenLE = inhdr[4:]
             su = struct.unpack("<I", inLenLE)
             inLen = su[0] - 80 # length without header
-            blk_hdr = self.read_xored(self.inF, 80)
-            inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, blk_hdr, inLen)
+            blk_hdr = self.read_xored(80)
+            inExtent = BlockExtent(self.inFn, self.inPos, inhdr, blk_hdr, inLen)
 
             self.hash_str = calc_hash_str(blk_hdr)
             if self.hash_str not in blkmap:
@@ -234,7 +298,7 @@ class BlockDataCopier:
                 # may encounter blocks it doesn't know about. Treat as debug output.
                 if settings['debug_output'] == 'true':
                     print("Skipping unknown block " + self.hash_str)
-                self.inF.seek(inLen, os.SEEK_CUR)
+                self.inPos += inLen
                 continue
 
             blkHeight = self.blkmap[self.hash_str]
@@ -242,7 +306,7 @@ class BlockDataCopier:
 
             if self.blkCountOut == blkHeight:
                 # If in-order block, just copy
-                rawblock = self.read_xored(self.inF, inLen)
+                rawblock = self.read_xored(inLen)
                 self.writeBlock(inhdr, blk_hdr, rawblock)
 
                 # See if we can catch up to prior out-of-order blocks
@@ -255,11 +319,171 @@ class BlockDataCopier:
                     # If there is space in the cache, read the data
                     # Reading the data in file sequence instead of seeking and fetching it later is preferred,
                     # but we don't want to fill up memory
-                    self.outOfOrderData[blkHeight] = self.read_xored(self.inF, inLen)
+                    self.outOfOrderData[blkHeight] = self.read_xored(inLen)
                     self.outOfOrderSize += inLen
                 else: # If no space in cache, seek forward
-                    self.inF.seek(inLen, os.SEEK_CUR)
+                    self.inPos += inLen
+
+        print("Done (%i blocks written)" % (self.blkCountOut))
+
+def scan_block_file(fname, netmagic, xor_key):
+    """Return the extents of all blocks in a block file as (hash, offset, size)
+    tuples, where size includes the 80-byte header. Runs in a worker process."""
+    extents = []
+    with open(fname, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return extents
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = 0
+            while True:
+                pos = find_magic(data, pos, netmagic, xor_key)
+                if pos is None or pos + 88 > len(data):
+                    return extents
+                inhdr = xor_bytes(data[pos:pos + 8], xor_key, pos)
+                size = struct.unpack("<I", inhdr[4:])[0]
+                blk_hdr = xor_bytes(data[pos + 8:pos + 88], xor_key, pos + 8)
+                extents.append((bytes.fromhex(calc_hash_str(blk_hdr)), pos, size))
+                pos += 8 + size
+
+def write_atomic(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+class IndexedBlockDataCopier(BlockDataCopier):
+    """Copy blocks in two passes, used when `extent_index` is set.
+
+    The first pass scans the input files in parallel and writes the extents of
+    all blocks found to the index directory. Files that did not change since
+    they were indexed are not scanned again. The second pass copies the
+    blocks in height order, reading each one straight from its input file.
+    The progress of the copy is checkpointed, so an interrupted run continues
+    after the last checkpoint."""
 
+    def __init__(self, settings, blkindex, blkmap):
+        super().__init__(settings, blkindex, blkmap)
+        self.indexDir = settings['extent_index']
+        self.checkpointFile = os.path.join(self.indexDir, "progress.json")
+
+    def indexFileName(self, fn):
+        return os.path.join(self.indexDir, "blk%05d.idx" % fn)
+
+    def readIndex(self, fn, st):
+        """Return the extents of input file fn from its index file, or None if
+        there is none or the input file changed since."""
+        try:
+            with open(self.indexFileName(fn), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < INDEX_HEADER.size or INDEX_HEADER.unpack_from(data) != (st.st_size, st.st_mtime_ns):
+            return None
+        return list(INDEX_RECORD.iter_unpack(data[INDEX_HEADER.size:]))
+
+    def buildIndex(self):
+        """Scan the input files that are not indexed yet and return {hash: (fn, offset, size)} of all blocks."""
+        os.makedirs(self.indexDir, exist_ok=True)
+        files = {}
+        fn = self.inFn
+        while os.path.exists(self.inFileName(fn)):
+            files[fn] = os.stat(self.inFileName(fn))
+            fn += 1
+        extents = {fn: self.readIndex(fn, st) for fn, st in files.items()}
+        toScan = [fn for fn in files if extents[fn] is None]
+        print("Indexing %i of %i input files" % (len(toScan), len(files)))
+        with ProcessPoolExecutor(max_workers=self.settings['scan_workers']) as pool:
+            results = pool.map(scan_block_file, [self.inFileName(fn) for fn in toScan],
+                               [self.settings['netmagic']] * len(toScan), [self.xor_key] * len(toScan))
+            for fn, fileExtents in zip(toScan, results):
+                write_atomic(self.indexFileName(fn),
+                             INDEX_HEADER.pack(files[fn].st_size, files[fn].st_mtime_ns) +
+                             b"".join(INDEX_RECORD.pack(*extent) for extent in fileExtents))
+                extents[fn] = fileExtents
+                if self.settings['debug_output'] == 'true':
+                    print("Indexed %s: %i blocks" % (self.inFileName(fn), len(fileExtents)))
+        index = {}
+        for fn in sorted(extents):
+            for blockHash, offset, size in extents[fn]:
+                index.setdefault(blockHash.hex(), (fn, offset, size))
+        return index
+
+    def checkpointKey(self):
+        """Settings a checkpoint is only valid for."""
+        return {
+            "hashes": hashlib.sha256("".join(self.blkindex).encode()).hexdigest(),
+            "output": self.settings.get('output'),
+            "output_file": self.settings.get('output_file'),
+            "max_out_sz": self.maxOutSz,
+            "split_timestamp": self.timestampSplit,
+        }
+
+    def writeCheckpoint(self):
+        # The output must be on disk before the checkpoint that refers to it
+        self.outF.flush()
+        os.fsync(self.outF.fileno())
+        write_atomic(self.checkpointFile, json.dumps({
+            "key": self.checkpointKey(),
+            "blkCountOut": self.blkCountOut,
+            "outFn": self.outFn,
+            "outsz": self.outsz,
+            "lastDate": self.lastDate.isoformat(),
+            "highTS": self.highTS,
+        }).encode())
+
+    def resume(self):
+        """Continue after the last checkpoint of a previous run with the same settings, if any."""
+        try:
+            with open(self.checkpointFile, encoding="utf8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return
+        if checkpoint.get("key") != self.checkpointKey():
+            print("Ignoring progress of a previous run with different settings")
+            return
+        if self.fileOutput:
+            outFname = self.settings['output_file']
+        else:
+            outFname = os.path.join(self.settings['output'], "blk%05d.dat" % checkpoint["outFn"])
+        if checkpoint["outsz"]:
+            try:
+                size = os.path.getsize(outFname)
+            except OSError:
+                size = None
+            if size is None or size < checkpoint["outsz"]:
+                print("Ignoring progress of a previous run, as its output file %s is missing or incomplete" % outFname)
+                return
+        self.blkCountOut = checkpoint["blkCountOut"]
+        self.outFn = checkpoint["outFn"]
+        self.outsz = checkpoint["outsz"]
+        self.lastDate = datetime.datetime.fromisoformat(checkpoint["lastDate"])
+        self.highTS = checkpoint["highTS"]
+        print("Resuming after block %i" % self.blkCountOut)
+        if self.outsz:
+            # Reopen the output file, dropping anything written after the checkpoint
+            self.outFname = outFname
+            self.outF = open(self.outFname, "r+b")
+            self.outF.truncate(self.outsz)
+            self.outF.seek(self.outsz)
+
+    def run(self):
+        index = self.buildIndex()
+        self.resume()
+        while self.blkCountOut < len(self.blkindex):
+            self.hash_str = self.blkindex[self.blkCountOut]
+            if self.hash_str not in index:
+                print("Block %s at height %i not found in the input files" % (self.hash_str, self.blkCountOut))
+                break
+            fn, offset, size = index[self.hash_str]
+            data = xor_bytes(self.getMap(fn)[offset:offset + 8 + size], self.xor_key, offset)
+            self.blkCountIn += 1
+            self.writeBlock(data[:8], data[8:88], data[88:])
+            if self.blkCountOut % CHECKPOINT_INTERVAL == 0:
+                self.writeCheckpoint()
+        if self.outF:
+            self.writeCheckpoint()
+            self.outF.close()
+            if self.setFileTime:
+                os.utime(self.outFname, (int(time.time()), self.highTS))
         print("Done (%i blocks written)" % (self.blkCountOut))
 
 if __name__ == '__main__':
@@ -304,6 +528,8 @@ if __name__ == '__main__':
         settings['out_of_order_cache_sz'] = 100 * 1000 * 1000
     if 'debug_output' not in settings:
         settings['debug_output'] = 'false'
+    if 'scan_workers' not in settings:
+        settings['scan_workers'] = os.cpu_count() or 1
 
     settings['max_out_sz'] = int(settings['max_out_sz'])
     settings['split_timestamp'] = int(settings['split_timestamp'])
@@ -311,6 +537,7 @@ if __name__ == '__main__':
     settings['netmagic'] = bytes.fromhex(settings['netmagic'])
     settings['out_of_order_cache_sz'] = int(settings['out_of_order_cache_sz'])
     settings['debug_output'] = settings['debug_output'].lower()
+    settings['scan_workers'] = int(settings['scan_workers'])
 
     if 'output_file' not in settings and 'output' not in settings:
         print("Missing output file / directory")
@@ -322,5 +549,7 @@ if __name__ == '__main__':
     # Block hash map won't be byte-reversed. Neither should the genesis hash.
     if settings['genesis'] not in blkmap:
         print("Genesis block not found in hashlist")
+    elif 'extent_index' in settings:
+        IndexedBlockDataCopier(settings, blkindex, blkmap).run()
     else:
         BlockDataCopier(settings, blkindex, blkmap).run()
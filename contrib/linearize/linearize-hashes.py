@@ -7,16 +7,23 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
+from concurrent.futures import ThreadPoolExecutor
 from http.client import HTTPConnection
+import hashlib
 import json
 import re
 import base64
 import sys
 import os
 import os.path
+import threading
 
 settings = {}
 
+# Maximum number of headers returned by one /rest/headers request, see MAX_REST_HEADERS_RESULTS
+MAX_REST_HEADERS = 2000
+BLOCK_HEADER_SIZE = 80
+
 class BitcoinRPC:
     def __init__(self, host, port, username, password):
         authpair = "%s:%s" % (username, password)
@@ -58,33 +65,116 @@ class BitcoinRPC:
     def response_is_error(resp_obj):
         return 'error' in resp_obj and resp_obj['error'] is not None
 
-def get_block_hashes(settings, max_blocks_per_call=10000):
-    rpc = BitcoinRPC(settings['host'], settings['port'],
-             settings['rpcuser'], settings['rpcpassword'])
+class BitcoinREST:
+    def __init__(self, host, port):
+        self.conn = HTTPConnection(host, port=port, timeout=30)
 
-    height = settings['min_height']
-    while height < settings['max_height']+1:
-        num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+    def get(self, path):
+        """Return the body of a successful GET request, or None after printing the error."""
+        try:
+            self.conn.request('GET', path)
+        except ConnectionRefusedError:
+            print('REST connection refused. Check the settings and that the server runs with -rest.',
+                  file=sys.stderr)
+            return None
+        resp = self.conn.getresponse()
+        body = resp.read()
+        if resp.status != 200:
+            print('REST: error %d for %s: %s' % (resp.status, path, body.decode('utf-8', errors='replace').strip()),
+                  file=sys.stderr)
+            return None
+        return body
+
+def hash_headers(raw_headers):
+    """Return the block hashes (in display byte order) of concatenated raw block headers."""
+    return [hashlib.sha256(hashlib.sha256(raw_headers[i:i + BLOCK_HEADER_SIZE]).digest()).digest()[::-1].hex()
+            for i in range(0, len(raw_headers), BLOCK_HEADER_SIZE)]
+
+class HashFetcher:
+    """Fetch the block hashes of a height range over one persistent connection
+    per worker thread, so that several requests are in flight at once."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.local = threading.local()
+
+    def connection(self):
+        if not hasattr(self.local, 'conn'):
+            if self.settings['rest'] == 'true':
+                self.local.conn = BitcoinREST(self.settings['host'], self.settings['port'])
+            else:
+                self.local.conn = BitcoinRPC(self.settings['host'], self.settings['port'],
+                                             self.settings['rpcuser'], self.settings['rpcpassword'])
+        return self.local.conn
+
+    def fetch_rpc(self, height, num_blocks):
+        rpc = self.connection()
         batch = []
         for x in range(num_blocks):
             batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
 
         reply = rpc.execute(batch)
         if reply is None:
-            print('Cannot continue. Program will halt.')
             return None
 
+        hashes = []
         for x,resp_obj in enumerate(reply):
             if rpc.response_is_error(resp_obj):
                 print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-                sys.exit(1)
+                return None
             assert resp_obj['id'] == x  # assume replies are in-sequence
-            if settings['rev_hash_bytes'] == 'true':
-                resp_obj['result'] = bytes.fromhex(resp_obj['result'])[::-1].hex()
-            print(resp_obj['result'])
+            hashes.append(resp_obj['result'])
+        return hashes
+
+    def fetch_rest(self, height, num_blocks):
+        """Look up the hash at height and compute the following ones from the raw headers."""
+        rest = self.connection()
+        first_hash = rest.get('/rest/blockhashbyheight/%d.hex' % height)
+        if first_hash is None:
+            return None
+        raw_headers = rest.get('/rest/headers/%s.bin?count=%d' % (first_hash.decode().strip(), num_blocks))
+        if raw_headers is None:
+            return None
+        if len(raw_headers) != num_blocks * BLOCK_HEADER_SIZE:
+            print('REST: expected %d headers from height %d, got %d' % (num_blocks, height, len(raw_headers) // BLOCK_HEADER_SIZE),
+                  file=sys.stderr)
+            return None
+        return hash_headers(raw_headers)
+
+    def fetch(self, height_and_count):
+        height, num_blocks = height_and_count
+        if self.settings['rest'] == 'true':
+            return self.fetch_rest(height, num_blocks)
+        return self.fetch_rpc(height, num_blocks)
 
+def get_block_hashes(settings, max_blocks_per_call=10000):
+    """Print the block hashes of the configured height range. Return whether
+    all of them could be fetched."""
+    if settings['rest'] == 'true':
+        max_blocks_per_call = min(max_blocks_per_call, MAX_REST_HEADERS)
+    ranges = []
+    height = settings['min_height']
+    while height < settings['max_height']+1:
+        num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+        ranges.append((height, num_blocks))
         height += num_blocks
 
+    fetcher = HashFetcher(settings)
+    out = sys.stdout
+    with ThreadPoolExecutor(max_workers=settings['connections']) as pool:
+        # map() returns the results in order, while up to `connections`
+        # requests are in flight
+        for hashes in pool.map(fetcher.fetch, ranges):
+            if hashes is None:
+                print('Cannot continue. Program will halt.', file=sys.stderr)
+                pool.shutdown(cancel_futures=True)
+                return False
+            if settings['rev_hash_bytes'] == 'true':
+                hashes = [bytes.fromhex(h)[::-1].hex() for h in hashes]
+            out.write('\n'.join(hashes) + '\n')
+    out.flush()
+    return True
+
 def get_rpc_cookie():
     # Open the cookie file
     with open(os.path.join(os.path.expanduser(settings['datadir']), '.cookie'), 'r') as f:
@@ -121,26 +211,33 @@ if __name__ == '__main__':
         settings['max_height'] = 313000
     if 'rev_hash_bytes' not in settings:
         settings['rev_hash_bytes'] = 'false'
+    if 'rest' not in settings:
+        settings['rest'] = 'false'
+    if 'connections' not in settings:
+        settings['connections'] = 4
 
+    settings['rest'] = settings['rest'].lower()
     use_userpass = True
     use_datadir = False
     if 'rpcuser' not in settings or 'rpcpassword' not in settings:
         use_userpass = False
     if 'datadir' in settings and not use_userpass:
         use_datadir = True
-    if not use_userpass and not use_datadir:
+    if not use_userpass and not use_datadir and settings['rest'] != 'true':
         print("Missing datadir or username and/or password in cfg file", file=sys.stderr)
         sys.exit(1)
 
     settings['port'] = int(settings['port'])
     settings['min_height'] = int(settings['min_height'])
     settings['max_height'] = int(settings['max_height'])
+    settings['connections'] = int(settings['connections'])
 
     # Force hash byte format setting to be lowercase to make comparisons easier.
     settings['rev_hash_bytes'] = settings['rev_hash_bytes'].lower()
 
     # Get the rpc user and pass from the cookie if the datadir is set
-    if use_datadir:
+    if use_datadir and settings['rest'] != 'true':
         get_rpc_cookie()
 
-    get_block_hashes(settings)
+    if not get_block_hashes(settings):
+        sys.exit(1)
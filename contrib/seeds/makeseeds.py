@@ -8,16 +8,19 @@
 
 import argparse
 import collections
+from concurrent.futures import ProcessPoolExecutor
+import heapq
 import ipaddress
+import itertools
+import os
 from pathlib import Path
-import random
 import re
 import sys
-from typing import Union
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO, Union
 
 asmap_dir = Path(__file__).parent.parent / "asmap"
 sys.path.append(str(asmap_dir))
-from asmap import ASMap, net_to_prefix  # noqa: E402
+from asmap import ASMap, ip_to_int  # noqa: E402
 
 NSEEDS=512
 
@@ -28,6 +31,26 @@ MAX_SEEDS_PER_ASN = {
 
 MIN_BLOCKS = 910000
 
+# Require at least 50% 30-day uptime for clearnet, onion and i2p; 10% for cjdns
+REQ_UPTIME = {
+    'ipv4': 50,
+    'ipv6': 50,
+    'onion': 50,
+    'i2p': 50,
+    'cjdns': 10,
+}
+
+# Names of the filters applied after removing duplicates, in order (see filters_passed)
+FILTER_PASSES = (
+    'Enforce minimal number of blocks',
+    'Require service bit 1',
+    'Require minimum uptime',
+    'Require a known and recent user agent',
+)
+
+# Number of lines of the DNS seeds file parsed per batch
+LINES_PER_BATCH = 4096
+
 PATTERN_IPV4 = re.compile(r"^(([0-2]?\d{1,2})\.([0-2]?\d{1,2})\.([0-2]?\d{1,2})\.([0-2]?\d{1,2})):(\d{1,5})$")
 PATTERN_IPV6 = re.compile(r"^\[([\da-f:]+)]:(\d{1,5})$", re.IGNORECASE)
 PATTERN_ONION = re.compile(r"^([a-z2-7]{56}\.onion):(\d+)$")
@@ -135,67 +158,115 @@ def parseline(line: str) -> Union[dict, None]:
         'sortkey': sortkey,
     }
 
-def dedup(ips: list[dict]) -> list[dict]:
-    """ Remove duplicates from `ips` where multiple ips share address and port. """
-    d = {}
-    for ip in ips:
-        ip_port = (ip["ip"], ip["port"])
-        if ip_port not in d or ip["lastsuccess"] > d[ip_port]["lastsuccess"]:
-            d[ip_port] = ip
-    return list(d.values())
+class Seed(NamedTuple):
+    """ The details of a parsed line needed after parsing, kept compact as there is one per address. """
+    net: str
+    ip: str
+    port: int
+    sortkey: Union[int, str]
+    uptime: float
+    lastsuccess: int
+    # Number of FILTER_PASSES passed
+    passed: int
+    asn: Optional[int]
 
-def filtermultiport(ips: list[dict]) -> list[dict]:
-    """ Filter out hosts with more nodes per IP"""
-    hist = collections.defaultdict(list)
-    for ip in ips:
-        hist[ip['sortkey']].append(ip)
-    return [value[0] for (key,value) in list(hist.items()) if len(value)==1]
+def filters_passed(ip: dict, minblocks: int) -> int:
+    """ Return how many of the successive filters of FILTER_PASSES the parsed line `ip` passes. """
+    if ip['blocks'] < minblocks:
+        return 0
+    if (ip['service'] & 1) != 1:
+        return 1
+    if ip['uptime'] <= REQ_UPTIME[ip['net']]:
+        return 2
+    if not PATTERN_AGENT.match(ip['agent']):
+        return 3
+    return 4
 
-# Based on Greg Maxwell's seed_filter.py
-def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
-    """ Prunes `ips` by
-    (a) trimming ips to have at most `max_per_net` ips from each net (e.g. ipv4, ipv6); and
-    (b) trimming ips to have at most `max_per_asn` ips from each asn in each net.
-    """
-    # Sift out ips by type
-    ips_ipv46 = [ip for ip in ips if ip['net'] in ['ipv4', 'ipv6']]
-    ips_onion = [ip for ip in ips if ip['net'] == 'onion']
-    ips_i2p = [ip for ip in ips if ip['net'] == 'i2p']
-    ips_cjdns = [ip for ip in ips if ip["net"] == "cjdns"]
+# The asmap of the worker processes, set by init_worker
+worker_asmap: Optional[ASMap] = None
 
-    # Filter IPv46 by ASN, and limit to max_per_net per network
-    result = []
-    net_count: dict[str, int] = collections.defaultdict(int)
-    asn_count: dict[int, int] = collections.defaultdict(int)
+def init_worker(asmap: ASMap) -> None:
+    global worker_asmap
+    worker_asmap = asmap
 
-    for i, ip in enumerate(ips_ipv46):
-        if net_count[ip['net']] == max_per_net:
-            # do not add this ip as we already too many
-            # ips from this network
-            continue
-        asn = asmap.lookup(net_to_prefix(ipaddress.ip_network(ip['ip'])))
-        if not asn or asn_count[ip['net'], asn] == max_per_asn[ip['net']]:
-            # do not add this ip as we already have too many
-            # ips from this ASN on this network
+def parse_batch(lines: list[str], minblocks: int) -> list[Seed]:
+    """ Parse a batch of lines of the DNS seeds file, skipping invalid ones.
+    The ASNs of IPv4 and IPv6 addresses passing all filters are looked up at once.
+    Runs in the worker processes.
+    """
+    assert worker_asmap is not None
+    seeds = []
+    lookups = []
+    for line in lines:
+        ip = parseline(line)
+        if ip is None:
             continue
-        asn_count[ip['net'], asn] += 1
-        net_count[ip['net']] += 1
-        ip['asn'] = asn
-        result.append(ip)
+        passed = filters_passed(ip, minblocks)
+        if passed == len(FILTER_PASSES) and ip['net'] in MAX_SEEDS_PER_ASN:
+            lookups.append(len(seeds))
+        seeds.append(Seed(ip['net'], ip['ip'], ip['port'], ip['sortkey'], ip['uptime'], ip['lastsuccess'], passed, None))
+    asns = worker_asmap.lookup_many(ip_to_int(ipaddress.ip_address(seeds[i].ip)) for i in lookups)
+    for i, asn in zip(lookups, asns):
+        seeds[i] = seeds[i]._replace(asn=asn)
+    return seeds
 
-    # Add back Onions (up to max_per_net)
-    result.extend(ips_onion[0:max_per_net])
-    result.extend(ips_i2p[0:max_per_net])
-    result.extend(ips_cjdns[0:max_per_net])
-    return result
+def read_batches(f: TextIO) -> Iterator[list[str]]:
+    """ Yield the lines of `f` in batches of LINES_PER_BATCH. """
+    while True:
+        lines = list(itertools.islice(f, LINES_PER_BATCH))
+        if not lines:
+            return
+        yield lines
 
-def ip_stats(ips: list[dict]) -> str:
-    """ Format and return pretty string from `ips`. """
-    hist: dict[str, int] = collections.defaultdict(int)
-    for ip in ips:
-        if ip is not None:
-            hist[ip['net']] += 1
+def parse_batches(batches: Iterable[list[str]], asmap: ASMap, minblocks: int, jobs: int) -> Iterator[list[Seed]]:
+    """ Yield parse_batch() of each batch, in order. With more than one job, the
+    batches are parsed in a pool of worker processes, with a bounded number of
+    batches in flight to limit memory usage.
+    """
+    if jobs <= 1:
+        init_worker(asmap)
+        for batch in batches:
+            yield parse_batch(batch, minblocks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(asmap,)) as pool:
+        pending: collections.deque = collections.deque()
+        for batch in batches:
+            pending.append(pool.submit(parse_batch, batch, minblocks))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def push_bounded(heap: list, item: tuple, size: int) -> None:
+    """ Push `item` to the min-heap `heap`, keeping only the `size` largest items. """
+    if len(heap) < size:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
 
+# Based on Greg Maxwell's seed_filter.py
+def select_seeds(seeds: Iterable[Seed], max_per_asn: dict, max_per_net: int) -> list[Seed]:
+    """ Select the most available `seeds` (by uptime, with last success as tie breaker), with
+    (a) at most `max_per_net` seeds from each net (e.g. ipv4, ipv6); and
+    (b) at most `max_per_asn` seeds from each asn in each net listed in `max_per_asn`,
+        skipping addresses without a known asn.
+    Only heaps of the best seeds per asn and per net are kept, bounded by these limits.
+    """
+    per_asn: dict[tuple[str, int], list] = collections.defaultdict(list)
+    per_net: dict[str, list] = collections.defaultdict(list)
+    for seed in seeds:
+        item = ((seed.uptime, seed.lastsuccess, seed.ip), seed)
+        if seed.net not in max_per_asn:
+            push_bounded(per_net[seed.net], item, max_per_net)
+        elif seed.asn:
+            push_bounded(per_asn[seed.net, seed.asn], item, max_per_asn[seed.net])
+    for (net, _), heap in per_asn.items():
+        for item in heap:
+            push_bounded(per_net[net], item, max_per_net)
+    return [seed for heap in per_net.values() for _, seed in heap]
+
+def ip_stats(hist: collections.Counter) -> str:
+    """ Format and return pretty string from the number of addresses per net in `hist`. """
     return f"{hist['ipv4']:6d} {hist['ipv6']:6d} {hist['onion']:6d} {hist['i2p']:6d} {hist['cjdns']:6d}"
 
 def parse_args():
@@ -203,6 +274,7 @@ def parse_args():
     argparser.add_argument("-a","--asmap", help='the location of the asmap asn database file (required)', required=True)
     argparser.add_argument("-s","--seeds", help='the location of the DNS seeds file (required)', required=True)
     argparser.add_argument("-m", "--minblocks", help="The minimum number of blocks each node must have", default=MIN_BLOCKS, type=int)
+    argparser.add_argument("-j", "--jobs", help="The number of processes parsing the DNS seeds file (default: %(default)s)", default=os.cpu_count() or 1, type=int)
     return argparser.parse_args()
 
 def main():
@@ -214,56 +286,43 @@ def main():
     print('Done.', file=sys.stderr)
 
     print('Loading and parsing DNS seeds…', end='', file=sys.stderr, flush=True)
+    # The lines are streamed through the workers, only the latest entry of each
+    # address and port is kept (in case multiple seeds files were concatenated).
+    initial: collections.Counter = collections.Counter()
+    latest: dict[tuple[str, int], Seed] = {}
     with open(args.seeds, 'r') as f:
-        lines = f.readlines()
-    ips = [parseline(line) for line in lines]
-    random.shuffle(ips)
+        for seeds in parse_batches(read_batches(f), asmap, args.minblocks, args.jobs):
+            for seed in seeds:
+                initial[seed.net] += 1
+                key = (seed.ip, seed.port)
+                if key not in latest or seed.lastsuccess > latest[key].lastsuccess:
+                    latest[key] = seed
     print('Done.', file=sys.stderr)
 
     print('\x1b[7m  IPv4   IPv6  Onion    I2P  CJDNS Pass                                               \x1b[0m', file=sys.stderr)
-    print(f'{ip_stats(ips):s} Initial', file=sys.stderr)
-    # Skip entries with invalid address.
-    ips = [ip for ip in ips if ip is not None]
-    print(f'{ip_stats(ips):s} Skip entries with invalid address', file=sys.stderr)
-    # Skip duplicates (in case multiple seeds files were concatenated)
-    ips = dedup(ips)
-    print(f'{ip_stats(ips):s} After removing duplicates', file=sys.stderr)
-    # Enforce minimal number of blocks.
-    ips = [ip for ip in ips if ip['blocks'] >= args.minblocks]
-    print(f'{ip_stats(ips):s} Enforce minimal number of blocks', file=sys.stderr)
-    # Require service bit 1.
-    ips = [ip for ip in ips if (ip['service'] & 1) == 1]
-    print(f'{ip_stats(ips):s} Require service bit 1', file=sys.stderr)
-    # Require at least 50% 30-day uptime for clearnet, onion and i2p; 10% for cjdns
-    req_uptime = {
-        'ipv4': 50,
-        'ipv6': 50,
-        'onion': 50,
-        'i2p': 50,
-        'cjdns': 10,
-    }
-    ips = [ip for ip in ips if ip['uptime'] > req_uptime[ip['net']]]
-    print(f'{ip_stats(ips):s} Require minimum uptime', file=sys.stderr)
-    # Require a known and recent user agent.
-    ips = [ip for ip in ips if PATTERN_AGENT.match(ip['agent'])]
-    print(f'{ip_stats(ips):s} Require a known and recent user agent', file=sys.stderr)
-    # Sort by availability (and use last success as tie breaker)
-    ips.sort(key=lambda x: (x['uptime'], x['lastsuccess'], x['ip']), reverse=True)
+    print(f'{ip_stats(initial):s} Initial', file=sys.stderr)
+    # Entries with invalid address were skipped while parsing.
+    print(f'{ip_stats(initial):s} Skip entries with invalid address', file=sys.stderr)
+    print(f'{ip_stats(collections.Counter(seed.net for seed in latest.values())):s} After removing duplicates', file=sys.stderr)
+    for i, name in enumerate(FILTER_PASSES):
+        print(f'{ip_stats(collections.Counter(seed.net for seed in latest.values() if seed.passed > i)):s} {name}', file=sys.stderr)
     # Filter out hosts with multiple bitcoin ports, these are likely abusive
-    ips = filtermultiport(ips)
-    print(f'{ip_stats(ips):s} Filter out hosts with multiple bitcoin ports', file=sys.stderr)
-    # Look up ASNs and limit results, both per ASN and globally.
-    ips = filterbyasn(asmap, ips, MAX_SEEDS_PER_ASN, NSEEDS)
-    print(f'{ip_stats(ips):s} Look up ASNs and limit results per ASN and per net', file=sys.stderr)
+    ports = collections.Counter(seed.sortkey for seed in latest.values() if seed.passed == len(FILTER_PASSES))
+    def candidates() -> Iterator[Seed]:
+        return (seed for seed in latest.values() if seed.passed == len(FILTER_PASSES) and ports[seed.sortkey] == 1)
+    print(f'{ip_stats(collections.Counter(seed.net for seed in candidates())):s} Filter out hosts with multiple bitcoin ports', file=sys.stderr)
+    # Limit results, both per ASN and globally.
+    ips = select_seeds(candidates(), MAX_SEEDS_PER_ASN, NSEEDS)
+    print(f'{ip_stats(collections.Counter(seed.net for seed in ips)):s} Look up ASNs and limit results per ASN and per net', file=sys.stderr)
     # Sort the results by IP address (for deterministic output).
-    ips.sort(key=lambda x: (x['net'], x['sortkey']))
+    ips.sort(key=lambda x: (x.net, x.sortkey))
     for ip in ips:
-        if ip['net'] == 'ipv6' or ip["net"] == "cjdns":
-            print(f"[{ip['ip']}]:{ip['port']}", end="")
+        if ip.net == 'ipv6' or ip.net == "cjdns":
+            print(f"[{ip.ip}]:{ip.port}", end="")
         else:
-            print(f"{ip['ip']}:{ip['port']}", end="")
-        if 'asn' in ip:
-            print(f" # AS{ip['asn']}", end="")
+            print(f"{ip.ip}:{ip.port}", end="")
+        if ip.asn is not None:
+            print(f" # AS{ip.asn}", end="")
         print()
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Tool to verify and compare compact-serialized UTXO sets without a node.
+
+The input UTXO sets can be generated by Bitcoin Core with the `dumptxoutset` RPC:
+$ bitcoin-cli dumptxoutset ~/utxos.dat latest
+
+The `hash` command computes the commitments of a snapshot that `gettxoutsetinfo`
+reports: `hash_serialized_3` (also used for assumeutxo) and, with --muhash,
+`muhash`. The coins are serialized and, for MuHash, hashed in parallel batches.
+With --expected, the tool exits with an error if hash_serialized_3 differs:
+$ ./utxo_snapshot.py hash utxos.dat --expected a2a5521b...
+
+The `diff` command compares two snapshots. The coins of both are sorted by
+outpoint, so they are streamed through a merge join in constant memory. It
+reports the coins spent and created between the snapshots, with the value
+deltas per script type:
+$ ./utxo_snapshot.py diff old_utxos.dat new_utxos.dat
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+from utxo_to_columns import SCRIPT_TYPES, script_type
+from utxo_to_sqlite import (
+    BATCH_SIZE,
+    CoinBatcher,
+    map_batches,
+    parse_coins,
+    read_metadata,
+)
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../test/functional'))
+
+from test_framework.crypto.muhash import MuHash3072, data_to_num3072  # noqa: E402
+from test_framework.messages import COIN, ser_compact_size, ser_varint  # noqa: E402
+
+
+def open_snapshot(filename):
+    """Open a UTXO dump and return (file, block hash, number of coins)."""
+    if not os.path.exists(filename):
+        print(f"Error: provided input file '{filename}' doesn't exist.")
+        sys.exit(1)
+    f = open(filename, 'rb')
+    _, block_hash, num_utxos = read_metadata(f, filename)
+    return f, block_hash, num_utxos
+
+
+def snapshot_batches(f, num_utxos):
+    """Yield the batches of serialized coins of an opened UTXO dump (see CoinBatcher)."""
+    batcher = CoinBatcher(f)
+    for coin_idx in range(0, num_utxos, BATCH_SIZE):
+        yield batcher.next_batch(min(BATCH_SIZE, num_utxos - coin_idx))
+    if batcher.remaining() != b'' or f.read(1) != b'':  # EOF should be reached by now
+        print(f"WARNING: input file {f.name} has not reached EOF yet!")
+        sys.exit(1)
+
+
+def decode_batch(batch):
+    """Return the coins of a batch as list of (prevout hash, prevout index, amount, coinbase flag, height, scriptPubKey)."""
+    return list(parse_coins(memoryview(batch[0]), *batch[1:]))
+
+
+def outpoint_key(coin):
+    """Return the sort key of the outpoint of a coin. The coins of a dump are in
+    the order of the coins database, whose keys serialize the output index as
+    VARINT (see serialization module). That order differs from the numeric one,
+    e.g. output 16512 comes before output 16511."""
+    return coin[0], ser_varint(coin[1])
+
+
+def snapshot_coins(f, num_utxos, jobs):
+    """Yield the coins of an opened UTXO dump in order, checking that they are sorted by outpoint (see outpoint_key)."""
+    last_coin = None
+    for _, coins in map_batches(snapshot_batches(f, num_utxos), decode_batch, jobs):
+        for coin in coins:
+            if last_coin is not None and outpoint_key(coin) <= outpoint_key(last_coin):
+                print(f"Error: coins of input file '{f.name}' are not sorted by outpoint "
+                      f"({format_outpoint(coin[:2])} follows {format_outpoint(last_coin[:2])}).")
+                sys.exit(1)
+            last_coin = coin
+            yield coin
+
+
+def hash_batch(batch, muhash):
+    """Serialize the coins of a batch like `TxOutSer()` (see coinstats module).
+
+    Runs in the worker processes. Returns the serialized coins, the product
+    of their MuHash3072 elements (1 unless muhash is set) and their total
+    amount. The products of all batches multiply to the MuHash numerator."""
+    serialized = bytearray()
+    numerator = 1
+    amount = 0
+    for prevout_hash, prevout_index, value, is_coinbase, height, scriptpubkey in parse_coins(memoryview(batch[0]), *batch[1:]):
+        coin_ser = (prevout_hash + prevout_index.to_bytes(4, 'little') +
+                    (height * 2 + is_coinbase).to_bytes(4, 'little') +
+                    value.to_bytes(8, 'little', signed=True) + ser_compact_size(len(scriptpubkey)) + scriptpubkey)
+        serialized += coin_ser
+        if muhash:
+            numerator = (numerator * data_to_num3072(hashlib.sha256(coin_ser).digest())) % MuHash3072.MODULUS
+        amount += value
+    return bytes(serialized), numerator, amount
+
+
+def format_amount(amount):
+    sign = "-" if amount < 0 else ""
+    return f"{sign}{abs(amount) // COIN}.{abs(amount) % COIN:08d}"
+
+
+def format_outpoint(outpoint):
+    return f"{outpoint[0][::-1].hex()}:{outpoint[1]}"
+
+
+def merge_join(old_coins, new_coins):
+    """Yield ("spent", coin) for each coin only in old_coins and ("created", coin)
+    for each coin only in new_coins, both sorted by outpoint (see outpoint_key).
+    A coin whose outpoint is in both, but with different contents, is spent
+    and created."""
+    old = next(old_coins, None)
+    new = next(new_coins, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and outpoint_key(old) < outpoint_key(new)):
+            yield "spent", old
+            old = next(old_coins, None)
+        elif old is None or outpoint_key(new) < outpoint_key(old):
+            yield "created", new
+            new = next(new_coins, None)
+        else:
+            if old != new:
+                yield "spent", old
+                yield "created", new
+            old = next(old_coins, None)
+            new = next(new_coins, None)
+
+
+def cmd_hash(args):
+    f, block_hash, num_utxos = open_snapshot(args.snapshot)
+    hasher = hashlib.sha256()
+    numerator = 1
+    total_amount = 0
+    # The batches are serialized (and hashed for MuHash) in parallel, the
+    # SHA256 stream of hash_serialized_3 is fed in order.
+    for _, (serialized, batch_numerator, amount) in map_batches(snapshot_batches(f, num_utxos), hash_batch, args.jobs, args.muhash):
+        hasher.update(serialized)
+        numerator = (numerator * batch_numerator) % MuHash3072.MODULUS
+        total_amount += amount
+    hash_serialized = hashlib.sha256(hasher.digest()).digest()[::-1].hex()
+
+    print(f"bestblock: {block_hash[::-1].hex()}")
+    print(f"txouts: {num_utxos}")
+    print(f"total_amount: {format_amount(total_amount)}")
+    print(f"hash_serialized_3: {hash_serialized}")
+    if args.muhash:
+        print(f"muhash: {hashlib.sha256(numerator.to_bytes(384, 'little')).digest()[::-1].hex()}")
+    if args.expected is not None and args.expected.lower() != hash_serialized:
+        print(f"Error: hash_serialized_3 does not match the expected {args.expected}.")
+        sys.exit(1)
+
+
+def cmd_diff(args):
+    old_f, _, old_num_utxos = open_snapshot(args.old)
+    new_f, _, new_num_utxos = open_snapshot(args.new)
+    jobs = max(args.jobs // 2, 1)
+    # {script type: [spent coins, spent amount, created coins, created amount]}
+    deltas = {name: [0, 0, 0, 0] for name in SCRIPT_TYPES}
+    for change, coin in merge_join(snapshot_coins(old_f, old_num_utxos, jobs), snapshot_coins(new_f, new_num_utxos, jobs)):
+        prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey = coin
+        spk_type = SCRIPT_TYPES[script_type(scriptpubkey)]
+        column = 0 if change == "spent" else 2
+        deltas[spk_type][column] += 1
+        deltas[spk_type][column + 1] += amount
+        if args.verbose:
+            print(f"{change:<7} {format_outpoint(coin[:2])} amount={format_amount(amount)} height={height} "
+                  f"coinbase={is_coinbase} type={spk_type} scriptPubKey={scriptpubkey.hex()}")
+
+    print(f"{'script type':<22} {'spent':>10} {'spent amount':>20} {'created':>10} {'created amount':>20} {'delta':>21}")
+    totals = [0, 0, 0, 0]
+    for name, counts in deltas.items():
+        if not any(counts):
+            continue
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f"{name:<22} {counts[0]:>10} {format_amount(counts[1]):>20} {counts[2]:>10} {format_amount(counts[3]):>20} "
+              f"{format_amount(counts[3] - counts[1]):>21}")
+    print(f"{'TOTAL':<22} {totals[0]:>10} {format_amount(totals[1]):>20} {totals[2]:>10} {format_amount(totals[3]):>20} "
+          f"{format_amount(totals[3] - totals[1]):>21}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='number of processes decoding coins (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    hash_parser = subparsers.add_parser('hash', parents=[common], help='compute the hash_serialized_3 and MuHash commitments of a snapshot')
+    hash_parser.add_argument('snapshot', help='filename of compact-serialized UTXO set')
+    hash_parser.add_argument('--muhash', action='store_true', help='also compute the MuHash commitment (slow)')
+    hash_parser.add_argument('--expected', metavar='HASH', help='fail unless hash_serialized_3 matches HASH')
+    hash_parser.set_defaults(func=cmd_hash)
+    diff_parser = subparsers.add_parser('diff', parents=[common], help='report the coins spent and created between two snapshots')
+    diff_parser.add_argument('old', help='filename of the older compact-serialized UTXO set')
+    diff_parser.add_argument('new', help='filename of the newer compact-serialized UTXO set')
+    diff_parser.add_argument('--verbose', action='store_true', help='show each spent and created coin')
+    diff_parser.set_defaults(func=cmd_diff)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
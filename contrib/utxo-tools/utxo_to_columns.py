@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Tool to convert a compact-serialized UTXO set to columnar NumPy arrays.
+
+The input UTXO set can be generated by Bitcoin Core with the `dumptxoutset` RPC:
+$ bitcoin-cli dumptxoutset ~/utxos.dat latest
+
+The created directory contains one NumPy `.npy` file per column, each holding
+one entry per coin in the order of the dump:
+
+  txid.npy            uint8[n, 32]  txid (sha256 byteorder, like in the dump)
+  vout.npy            uint32[n]     output index
+  amount.npy          int64[n]      value in satoshis
+  height.npy          uint32[n]     height of the block containing the coin
+  coinbase.npy        bool[n]       whether the coin is a coinbase output
+  script_type.npy     uint8[n]      index into SCRIPT_TYPES
+  script_offsets.npy  uint64[n+1]   scriptPubKey i is scripts[offsets[i]:offsets[i+1]]
+  scripts.npy         uint8[m]      all scriptPubKeys, concatenated
+
+and a `metadata.json` file with the network, block hash and number of coins.
+
+Writing the files does not need NumPy. The files can be memory-mapped with
+`numpy.load(path, mmap_mode='r')`, or through the UtxoColumns class of this
+module, which adds filtering and aggregation helpers:
+
+    from utxo_to_columns import UtxoColumns
+    utxos = UtxoColumns("utxos")
+    taproot = utxos.select(script_types=["witness_v1_taproot"], min_height=800000)
+    print(utxos.total_amount(taproot), utxos.amount_by_script_type())
+"""
+import argparse
+from array import array
+import json
+import os
+import sys
+import time
+
+from utxo_to_sqlite import (
+    BATCH_SIZE,
+    NET_MAGIC_BYTES,
+    CoinBatcher,
+    map_batches,
+    parse_coins,
+    read_metadata,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Names as used by `GetTxnOutputType()` (see solver module)
+SCRIPT_TYPES = (
+    "nonstandard",
+    "pubkey",
+    "pubkeyhash",
+    "scripthash",
+    "multisig",
+    "witness_v0_keyhash",
+    "witness_v0_scripthash",
+    "witness_v1_taproot",
+    "anchor",
+    "witness_unknown",
+)
+SCRIPT_TYPE_CODES = {name: code for code, name in enumerate(SCRIPT_TYPES)}
+
+# Column name, NumPy type (without byte order) and shape of each entry
+COLUMNS = (
+    ("txid", "u1", (32,)),
+    ("vout", "u4", ()),
+    ("amount", "i8", ()),
+    ("height", "u4", ()),
+    ("coinbase", "b1", ()),
+    ("script_type", "u1", ()),
+    ("script_offsets", "u8", ()),
+    ("scripts", "u1", ()),
+)
+COLUMNS_VERSION = 1
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# Space reserved for the .npy header, which is written once the number of entries is known
+NPY_HEADER_SIZE = 128
+NATIVE_BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA4 = 0x4e
+OP_1 = 0x51
+OP_16 = 0x60
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+MAX_PUBKEYS_PER_MULTISIG = 20
+
+
+def get_script_op(spk, pos):
+    """Return the opcode and pushed data of the script operation at pos, and
+    the position after it, like `CScript::GetOp()`. Return None at the end of
+    the script or if a push is truncated."""
+    if pos >= len(spk):
+        return None
+    opcode = spk[pos]
+    pos += 1
+    if opcode > OP_PUSHDATA4:
+        return opcode, b"", pos
+    if opcode < OP_PUSHDATA1:
+        size = opcode
+    else:
+        width = 1 << (opcode - OP_PUSHDATA1)
+        if pos + width > len(spk):
+            return None
+        size = int.from_bytes(spk[pos:pos + width], "little")
+        pos += width
+    if pos + size > len(spk):
+        return None
+    return opcode, spk[pos:pos + size], pos + size
+
+
+def script_number(opcode, data, min_value, max_value):
+    """Return the number in [min_value, max_value] that an OP_n or a minimal
+    push encodes, or None. Only numbers up to 127 are decoded."""
+    if OP_1 <= opcode <= OP_16:
+        value = opcode - OP_1 + 1
+    elif opcode == 1 and 16 < data[0] < 0x80:
+        # values 1-16 must use OP_n, larger ones need a single byte push
+        value = data[0]
+    else:
+        return None
+    return value if min_value <= value <= max_value else None
+
+
+def is_valid_pubkey_size(data):
+    """Return whether the size of data matches its public key header byte, like `CPubKey::ValidSize()`."""
+    if not data:
+        return False
+    if data[0] in (2, 3):
+        return len(data) == 33
+    if data[0] in (4, 6, 7):
+        return len(data) == 65
+    return False
+
+
+def is_multisig(spk):
+    """Return whether spk is a bare multisig script: OP_m <pubkey>... OP_n OP_CHECKMULTISIG."""
+    if not spk or spk[-1] != OP_CHECKMULTISIG:
+        return False
+    op = get_script_op(spk, 0)
+    if op is None:
+        return False
+    required = script_number(op[0], op[1], 1, MAX_PUBKEYS_PER_MULTISIG)
+    if required is None:
+        return False
+    num_pubkeys = 0
+    while (op := get_script_op(spk, op[2])) is not None and is_valid_pubkey_size(op[1]):
+        num_pubkeys += 1
+    if op is None or script_number(op[0], op[1], required, MAX_PUBKEYS_PER_MULTISIG) != num_pubkeys:
+        return False
+    return op[2] + 1 == len(spk)
+
+
+def script_type(spk):
+    """Return the code of the script type of spk, classified like `Solver()` (see solver module)."""
+    n = len(spk)
+    if n == 23 and spk[:2] == b"\xa9\x14" and spk[22] == 0x87:
+        return SCRIPT_TYPE_CODES["scripthash"]
+    if 4 <= n <= 42 and (spk[0] == OP_0 or OP_1 <= spk[0] <= OP_16) and spk[1] + 2 == n:
+        version = 0 if spk[0] == OP_0 else spk[0] - OP_1 + 1
+        if version == 0 and n == 22:
+            return SCRIPT_TYPE_CODES["witness_v0_keyhash"]
+        if version == 0 and n == 34:
+            return SCRIPT_TYPE_CODES["witness_v0_scripthash"]
+        if version == 1 and n == 34:
+            return SCRIPT_TYPE_CODES["witness_v1_taproot"]
+        if spk == b"\x51\x02\x4e\x73":
+            return SCRIPT_TYPE_CODES["anchor"]
+        if version != 0:
+            return SCRIPT_TYPE_CODES["witness_unknown"]
+        return SCRIPT_TYPE_CODES["nonstandard"]
+    if n in (35, 67) and spk[0] == n - 2 and spk[-1] == OP_CHECKSIG and is_valid_pubkey_size(spk[1:-1]):
+        return SCRIPT_TYPE_CODES["pubkey"]
+    if n == 25 and spk[:3] == b"\x76\xa9\x14" and spk[23:] == b"\x88\xac":
+        return SCRIPT_TYPE_CODES["pubkeyhash"]
+    if is_multisig(spk):
+        return SCRIPT_TYPE_CODES["multisig"]
+    return SCRIPT_TYPE_CODES["nonstandard"]
+
+
+def encode_columns(batch):
+    """Decode a batch of coins (see CoinBatcher) into the raw data of each column.
+
+    Runs in the worker processes. script_offsets holds the end offset of each
+    script relative to the start of the batch's scripts."""
+    txids = bytearray()
+    vout = array("I")
+    amount = array("q")
+    height = array("I")
+    coinbase = bytearray()
+    script_types = bytearray()
+    script_ends = array("Q")
+    scripts = bytearray()
+    for prevout_hash, prevout_index, value, is_coinbase, coin_height, scriptpubkey in parse_coins(memoryview(batch[0]), *batch[1:]):
+        txids += prevout_hash
+        vout.append(prevout_index)
+        amount.append(value)
+        height.append(coin_height)
+        coinbase.append(is_coinbase)
+        script_types.append(script_type(scriptpubkey))
+        scripts += scriptpubkey
+        script_ends.append(len(scripts))
+    return {
+        "txid": bytes(txids),
+        "vout": vout.tobytes(),
+        "amount": amount.tobytes(),
+        "height": height.tobytes(),
+        "coinbase": bytes(coinbase),
+        "script_type": bytes(script_types),
+        "script_offsets": script_ends,
+        "scripts": bytes(scripts),
+    }
+
+
+class NpyWriter:
+    """Write a single-column .npy file (format version 1.0) from raw chunks of data."""
+
+    def __init__(self, path, dtype, item_shape=()):
+        self.f = open(path, "wb")
+        self.f.write(bytes(NPY_HEADER_SIZE))
+        self.descr = ("|" if dtype[1] == "1" else NATIVE_BYTE_ORDER) + dtype
+        self.item_shape = item_shape
+        self.count = 0
+
+    def write(self, data, count):
+        self.f.write(data)
+        self.count += count
+
+    def close(self):
+        shape = (self.count,) + self.item_shape
+        header = repr({"descr": self.descr, "fortran_order": False, "shape": shape}).encode()
+        header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - 1) + b"\n"
+        assert len(NPY_MAGIC) + 2 + len(header) == NPY_HEADER_SIZE
+        self.f.seek(0)
+        self.f.write(NPY_MAGIC + len(header).to_bytes(2, "little") + header)
+        self.f.close()
+
+
+class UtxoColumns:
+    """A UTXO set exported by this tool, with each column memory-mapped as a NumPy array.
+
+    The columns are available as attributes named like the files (e.g.
+    `utxos.amount`). Masks returned by select() can be used to index them."""
+
+    def __init__(self, path):
+        if np is None:
+            raise ImportError("Reading a columnar UTXO set requires NumPy")
+        with open(os.path.join(path, "metadata.json"), encoding="utf8") as f:
+            self.metadata = json.load(f)
+        if self.metadata.get("version") != COLUMNS_VERSION:
+            raise ValueError(f"Unsupported columnar UTXO set version {self.metadata.get('version')}")
+        for name, _, _ in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.amount)
+
+    def script(self, i):
+        """Return the scriptPubKey of coin i."""
+        return bytes(self.scripts[self.script_offsets[i]:self.script_offsets[i + 1]])
+
+    def txid_hex(self, i):
+        """Return the txid of coin i as hex string, as shown by the RPCs."""
+        return bytes(self.txid[i])[::-1].hex()
+
+    def select(self, *, script_types=None, min_height=None, max_height=None, coinbase=None, min_amount=None):
+        """Return a boolean mask of the coins matching all given conditions.
+
+        script_types is a list of names of SCRIPT_TYPES, the heights and the
+        minimum amount are inclusive."""
+        mask = np.ones(len(self), dtype=bool)
+        if script_types is not None:
+            mask &= np.isin(self.script_type, [SCRIPT_TYPE_CODES[name] for name in script_types])
+        if min_height is not None:
+            mask &= self.height >= min_height
+        if max_height is not None:
+            mask &= self.height <= max_height
+        if coinbase is not None:
+            mask &= self.coinbase == coinbase
+        if min_amount is not None:
+            mask &= self.amount >= min_amount
+        return mask
+
+    def total_amount(self, mask=None):
+        """Return the sum of the amounts (in satoshis) of all coins, or of the coins selected by mask."""
+        amount = self.amount if mask is None else self.amount[mask]
+        return int(amount.sum(dtype=np.int64))
+
+    def amount_by_script_type(self, mask=None):
+        """Return {script type name: (number of coins, total amount)} of all coins, or of the coins selected by mask."""
+        types = self.script_type if mask is None else self.script_type[mask]
+        amount = self.amount if mask is None else self.amount[mask]
+        counts = np.bincount(types, minlength=len(SCRIPT_TYPES))
+        return {
+            name: (int(counts[code]), int(amount[types == code].sum(dtype=np.int64)))
+            for code, name in enumerate(SCRIPT_TYPES) if counts[code]
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('infile', help='filename of compact-serialized UTXO set (input)')
+    parser.add_argument('outdir', help='directory of the created column files (output)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='number of processes decoding coins (default: %(default)s)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.infile):
+        print(f"Error: provided input file '{args.infile}' doesn't exist.")
+        sys.exit(1)
+
+    if os.path.exists(args.outdir):
+        print(f"Error: provided output directory '{args.outdir}' already exists.")
+        sys.exit(1)
+
+    f = open(args.infile, 'rb')
+    network_magic, block_hash, num_utxos = read_metadata(f, args.infile)
+    os.mkdir(args.outdir)
+    writers = {name: NpyWriter(os.path.join(args.outdir, f"{name}.npy"), dtype, item_shape)
+               for name, dtype, item_shape in COLUMNS}
+    writers["script_offsets"].write(array("Q", [0]).tobytes(), 1)
+
+    start_time = time.time()
+    batcher = CoinBatcher(f)
+    batches = (batcher.next_batch(min(BATCH_SIZE, num_utxos - coin_idx)) for coin_idx in range(0, num_utxos, BATCH_SIZE))
+    coin_idx = 0
+    scripts_size = 0
+    for batch, columns in map_batches(batches, encode_columns, args.jobs):
+        count = batch[1]
+        # make the batch's script offsets absolute
+        columns["script_offsets"] = array("Q", [scripts_size + end for end in columns["script_offsets"]]).tobytes()
+        scripts_size += len(columns["scripts"])
+        for name, _, _ in COLUMNS:
+            writers[name].write(columns[name], len(columns[name]) if name == "scripts" else count)
+        coin_idx += count
+
+        if coin_idx % (1024*1024) == 0:
+            elapsed = time.time() - start_time
+            print(f"{coin_idx} coins converted [{coin_idx/num_utxos*100:.2f}%], " +
+                  f"{elapsed:.3f}s passed since start")
+    for writer in writers.values():
+        writer.close()
+
+    with open(os.path.join(args.outdir, "metadata.json"), "w", encoding="utf8") as metadata:
+        json.dump({
+            "version": COLUMNS_VERSION,
+            "network": NET_MAGIC_BYTES.get(network_magic, "unknown"),
+            "network_magic": network_magic.hex(),
+            "block_hash": block_hash[::-1].hex(),
+            "coins": num_utxos,
+            "script_types": SCRIPT_TYPES,
+        }, metadata, indent=1)
+
+    print(f"TOTAL: {num_utxos} coins written to {args.outdir}.")
+    if batcher.remaining() != b'' or f.read(1) != b'':  # EOF should be reached by now
+        print(f"WARNING: input file {args.infile} has not reached EOF yet!")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
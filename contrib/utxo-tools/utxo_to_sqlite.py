@@ -12,8 +12,16 @@ The created database contains a table `utxos` with the following schema:
 
 If --txid=raw or --txid=rawle is specified, txid will be BLOB instead;
 if --spk=raw, then scriptpubkey will be BLOB instead.
+
+The input is read in large chunks and split into batches of coins, which are
+decoded by a pool of worker processes (see --jobs) while the main process
+inserts the decoded batches. The whole conversion runs in a single transaction
+without a rollback journal, so an interrupted conversion leaves an unusable
+database behind. Indexes requested with --index are created after the load.
 """
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import os
 import sqlite3
 import sys
@@ -30,29 +38,50 @@ NET_MAGIC_BYTES = {
     b"\xfa\xbf\xb5\xda": "Regtest",
 }
 
+# Number of coins decoded and inserted at once
+BATCH_SIZE = 16 * 1024
+# Size of the chunks read from the input file
+READ_CHUNK_SIZE = 16 * 1024 * 1024
+# Upper bound of the serialized size of a single coin, including the prevout
+# hash and coin count preceding it (the script is limited to 10000 bytes)
+MAX_COIN_SIZE = 16 * 1024
+# Sizes of the compressed script types 0-5, see `DecompressScript()`
+SPECIAL_SCRIPT_SIZES = (20, 20, 32, 32, 32, 32)
+# Indexes that can be created with --index
+INDEXES = {
+    "outpoint": "txid, vout",
+    "scriptpubkey": "scriptpubkey",
+    "height": "height",
+}
+
 
-def read_varint(f):
-    """Equivalent of `ReadVarInt()` (see serialization module)."""
+def read_varint(buf, pos):
+    """Equivalent of `ReadVarInt()` (see serialization module).
+
+    Returns the value read from buf at offset pos and the offset following it."""
     n = 0
     while True:
-        dat = f.read(1)[0]
+        dat = buf[pos]
+        pos += 1
         n = (n << 7) | (dat & 0x7f)
         if (dat & 0x80) > 0:
             n += 1
         else:
-            return n
+            return n, pos
+
 
+def read_compactsize(buf, pos):
+    """Equivalent of `ReadCompactSize()` (see serialization module).
 
-def read_compactsize(f):
-    """Equivalent of `ReadCompactSize()` (see serialization module)."""
-    n = f.read(1)[0]
+    Returns the value read from buf at offset pos and the offset following it."""
+    n = buf[pos]
     if n == 253:
-        n = int.from_bytes(f.read(2), "little")
+        return int.from_bytes(buf[pos+1:pos+3], "little"), pos + 3
     elif n == 254:
-        n = int.from_bytes(f.read(4), "little")
+        return int.from_bytes(buf[pos+1:pos+5], "little"), pos + 5
     elif n == 255:
-        n = int.from_bytes(f.read(8), "little")
-    return n
+        return int.from_bytes(buf[pos+1:pos+9], "little"), pos + 9
+    return n, pos + 1
 
 
 def decompress_amount(x):
@@ -75,22 +104,24 @@ def decompress_amount(x):
     return n
 
 
-def decompress_script(f):
-    """Equivalent of `DecompressScript()` (see compressor module)."""
-    size = read_varint(f)  # sizes 0-5 encode compressed script types
+def decompress_script(buf, pos):
+    """Equivalent of `DecompressScript()` (see compressor module).
+
+    Returns the script read from buf at offset pos and the offset following it."""
+    size, pos = read_varint(buf, pos)  # sizes 0-5 encode compressed script types
     if size == 0:  # P2PKH
-        return bytes([0x76, 0xa9, 20]) + f.read(20) + bytes([0x88, 0xac])
+        return bytes([0x76, 0xa9, 20]) + buf[pos:pos+20] + bytes([0x88, 0xac]), pos + 20
     elif size == 1:  # P2SH
-        return bytes([0xa9, 20]) + f.read(20) + bytes([0x87])
+        return bytes([0xa9, 20]) + buf[pos:pos+20] + bytes([0x87]), pos + 20
     elif size in (2, 3):  # P2PK (compressed)
-        return bytes([33, size]) + f.read(32) + bytes([0xac])
+        return bytes([33, size]) + buf[pos:pos+32] + bytes([0xac]), pos + 32
     elif size in (4, 5):  # P2PK (uncompressed)
-        compressed_pubkey = bytes([size - 2]) + f.read(32)
-        return bytes([65]) + decompress_pubkey(compressed_pubkey) + bytes([0xac])
+        compressed_pubkey = bytes([size - 2]) + buf[pos:pos+32]
+        return bytes([65]) + decompress_pubkey(compressed_pubkey) + bytes([0xac]), pos + 32
     else:  # others (bare multisig, segwit etc.)
         size -= 6
         assert size <= 10000, f"too long script with size {size}"
-        return f.read(size)
+        return bytes(buf[pos:pos+size]), pos + size
 
 
 def decompress_pubkey(compressed_pubkey):
@@ -110,6 +141,164 @@ def decompress_pubkey(compressed_pubkey):
     return bytes([4]) + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
 
 
+def skip_coins(buf, pos, end, count, coins_per_hash_left):
+    """Skip up to count coins in buf, starting at offset pos, without decoding them.
+
+    Only coins starting before offset end are skipped. Returns the offset
+    following the last skipped coin, the number of coins skipped, the number
+    of coins left for the current prevout hash and the offset of the last
+    prevout hash read (None if no prevout hash was read)."""
+    skipped = 0
+    hash_pos = None
+    while skipped < count and pos < end:
+        if coins_per_hash_left == 0:  # skip next prevout hash
+            hash_pos = pos
+            coins_per_hash_left, pos = read_compactsize(buf, pos + 32)
+        n = buf[pos]  # prevout index
+        pos += 1 if n < 253 else (3, 5, 9)[n - 253]
+        while buf[pos] & 0x80:  # code (height and coinbase flag)
+            pos += 1
+        pos += 1
+        while buf[pos] & 0x80:  # compressed amount
+            pos += 1
+        size, pos = read_varint(buf, pos + 1)
+        pos += SPECIAL_SCRIPT_SIZES[size] if size < 6 else size - 6
+        coins_per_hash_left -= 1
+        skipped += 1
+    return pos, skipped, coins_per_hash_left, hash_pos
+
+
+def parse_coins(buf, count, prevout_hash, coins_per_hash_left):
+    """Yield (prevout hash, prevout index, amount, coinbase flag, height, scriptPubKey)
+    for count coins serialized in buf. If the first coins belong to a prevout
+    hash preceding buf, it is given with the number of coins left for it."""
+    pos = 0
+    for _ in range(count):
+        # read key (COutPoint)
+        if coins_per_hash_left == 0:  # read next prevout hash
+            prevout_hash = bytes(buf[pos:pos+32])
+            coins_per_hash_left, pos = read_compactsize(buf, pos + 32)
+        prevout_index, pos = read_compactsize(buf, pos)
+        # read value (Coin)
+        code, pos = read_varint(buf, pos)
+        compressed_amount, pos = read_varint(buf, pos)
+        scriptpubkey, pos = decompress_script(buf, pos)
+        coins_per_hash_left -= 1
+        yield prevout_hash, prevout_index, decompress_amount(compressed_amount), code & 1, code >> 1, scriptpubkey
+    assert pos == len(buf), "coin batch not fully parsed"
+
+
+def decode_coins(batch, spk_hex, txid_hex, txid_reverse):
+    """Decode a batch of coins (see CoinBatcher) into rows of the utxos table.
+
+    Runs in the worker processes. Returns the rows and the largest height."""
+    rows = []
+    max_height = 0
+    last_hash = txid_write = None
+    for prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey in parse_coins(memoryview(batch[0]), *batch[1:]):
+        if prevout_hash is not last_hash:  # encode each txid only once
+            last_hash = prevout_hash
+            txid_write = prevout_hash[::-1] if txid_reverse else prevout_hash
+            txid_write = txid_write.hex() if txid_hex else txid_write
+        rows.append((txid_write, prevout_index, amount, is_coinbase, height,
+                     scriptpubkey.hex() if spk_hex else scriptpubkey))
+        if height > max_height:
+            max_height = height
+    return rows, max_height
+
+
+def map_batches(batches, func, jobs, *args):
+    """Yield (batch, func(batch, *args)) for each batch, in order.
+
+    With more than one job, func runs in a pool of worker processes, with a
+    bounded number of batches in flight to limit memory usage."""
+    if jobs <= 1:
+        for batch in batches:
+            yield batch, func(batch, *args)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.submit(func, batch, *args)))
+            if len(pending) > 2 * jobs:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+def read_metadata(f, filename):
+    """Read the metadata of a UTXO dump and return (network magic, block hash, number of coins).
+
+    Exits with an error if the file is not a UTXO dump of a supported version."""
+    magic_bytes = f.read(5)
+    version = int.from_bytes(f.read(2), 'little')
+    network_magic = f.read(4)
+    block_hash = f.read(32)
+    num_utxos = int.from_bytes(f.read(8), 'little')
+    if magic_bytes != UTXO_DUMP_MAGIC:
+        print(f"Error: provided input file '{filename}' is not an UTXO dump.")
+        sys.exit(1)
+    if version != UTXO_DUMP_VERSION:
+        print(f"Error: provided input file '{filename}' has unknown UTXO dump version {version} "
+              f"(only version {UTXO_DUMP_VERSION} supported)")
+        sys.exit(1)
+    network_string = NET_MAGIC_BYTES.get(network_magic, f"unknown network ({network_magic.hex()})")
+    print(f"UTXO Snapshot for {network_string} at block hash "
+          f"{block_hash[::-1].hex()[:32]}..., contains {num_utxos} coins")
+    return network_magic, block_hash, num_utxos
+
+
+class CoinBatcher:
+    """Split the coins of a UTXO dump into batches of serialized coins.
+
+    The input is read in chunks of READ_CHUNK_SIZE and only scanned for coin
+    boundaries. Each batch is a tuple (data, number of coins, prevout hash,
+    coins left for the prevout hash), where the last two describe the prevout
+    hash preceding data if its first coins belong to it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = memoryview(b'')
+        self.pos = 0
+        self.eof = False
+        self.prevout_hash = None
+        self.coins_per_hash_left = 0
+
+    def refill(self):
+        chunk = self.f.read(READ_CHUNK_SIZE)
+        self.eof = len(chunk) < READ_CHUNK_SIZE
+        self.buf = memoryview(bytes(self.buf[self.pos:]) + chunk)
+        self.pos = 0
+
+    def remaining(self):
+        """Return the bytes following the last batch that were read already."""
+        return bytes(self.buf[self.pos:])
+
+    def next_batch(self, count):
+        pieces = []
+        start = self.pos
+        batch = (count, self.prevout_hash, self.coins_per_hash_left)
+        while count > 0:
+            # Only scan coins that are entirely in the buffer, unless it reaches the end of the input
+            end = len(self.buf) if self.eof else len(self.buf) - MAX_COIN_SIZE
+            if self.pos >= end:
+                if self.eof:
+                    raise EOFError("UTXO dump ends before all coins were read")
+                pieces.append(self.buf[start:self.pos])
+                self.refill()
+                start = 0
+                continue
+            self.pos, skipped, self.coins_per_hash_left, hash_pos = skip_coins(
+                self.buf, self.pos, end, count, self.coins_per_hash_left)
+            if hash_pos is not None:
+                self.prevout_hash = bytes(self.buf[hash_pos:hash_pos+32])
+            count -= skipped
+        pieces.append(self.buf[start:self.pos])
+        return (b''.join(pieces),) + batch
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('infile', help='filename of compact-serialized UTXO set (input)')
@@ -117,6 +306,9 @@ def main():
     parser.add_argument('--verbose', action='store_true', help='show details about each UTXO')
     parser.add_argument('--spk', choices=['hex', 'raw'], default='hex', help='encode scriptPubKey as hex or raw bytes')
     parser.add_argument('--txid', choices=['hex', 'raw', 'rawle'], default='hex', help='encode txid as hex, raw bytes (sha256 byteorder), or reversed raw bytes (little endian)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='number of processes decoding coins (default: %(default)s)')
+    parser.add_argument('--index', choices=sorted(INDEXES), action='append', default=[],
+                        help='create an index on the given column(s) after the load, can be given multiple times')
     args = parser.parse_args()
 
     if not os.path.exists(args.infile):
@@ -131,77 +323,58 @@ def main():
     txid_hex = (args.txid == 'hex')
     txid_reverse = (args.txid != 'raw')
 
-    # create database table
+    # create database table, with bulk-load settings: the database is
+    # worthless if the conversion does not finish, so neither a rollback
+    # journal nor syncing is needed
     txid_fmt = "TEXT" if txid_hex else "BLOB"
     spk_fmt = "TEXT" if spk_hex else "BLOB"
     con = sqlite3.connect(args.outfile)
+    con.execute("PRAGMA journal_mode = OFF")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("PRAGMA locking_mode = EXCLUSIVE")
+    con.execute("PRAGMA temp_store = MEMORY")
+    con.execute("PRAGMA cache_size = -1048576")  # 1 GiB
     con.execute(f"CREATE TABLE utxos(txid {txid_fmt}, vout INT, value INT, coinbase INT, height INT, scriptpubkey {spk_fmt})")
 
     # read metadata (magic bytes, version, network magic, block hash, UTXO count)
     f = open(args.infile, 'rb')
-    magic_bytes = f.read(5)
-    version = int.from_bytes(f.read(2), 'little')
-    network_magic = f.read(4)
-    block_hash = f.read(32)
-    num_utxos = int.from_bytes(f.read(8), 'little')
-    if magic_bytes != UTXO_DUMP_MAGIC:
-        print(f"Error: provided input file '{args.infile}' is not an UTXO dump.")
-        sys.exit(1)
-    if version != UTXO_DUMP_VERSION:
-        print(f"Error: provided input file '{args.infile}' has unknown UTXO dump version {version} "
-              f"(only version {UTXO_DUMP_VERSION} supported)")
-        sys.exit(1)
-    network_string = NET_MAGIC_BYTES.get(network_magic, f"unknown network ({network_magic.hex()})")
-    print(f"UTXO Snapshot for {network_string} at block hash "
-          f"{block_hash[::-1].hex()[:32]}..., contains {num_utxos} coins")
+    _, _, num_utxos = read_metadata(f, args.infile)
 
     start_time = time.time()
-    write_batch = []
-    coins_per_hash_left = 0
-    prevout_hash = None
-    max_height = 0
-
-    for coin_idx in range(1, num_utxos+1):
-        # read key (COutPoint)
-        if coins_per_hash_left == 0:  # read next prevout hash
-            prevout_hash = f.read(32)
-            coins_per_hash_left = read_compactsize(f)
-        prevout_index = read_compactsize(f)
-        # read value (Coin)
-        code = read_varint(f)
-        height = code >> 1
-        is_coinbase = code & 1
-        amount = decompress_amount(read_varint(f))
-        scriptpubkey = decompress_script(f)
-
-        scriptpubkey_write = scriptpubkey.hex() if spk_hex else scriptpubkey
-        txid_write = prevout_hash[::-1] if txid_reverse else prevout_hash
-        txid_write = txid_write.hex() if txid_hex else txid_write
-        write_batch.append((txid_write, prevout_index, amount, is_coinbase, height, scriptpubkey_write))
-        if height > max_height:
-            max_height = height
-        coins_per_hash_left -= 1
+    batcher = CoinBatcher(f)
+    batches = (batcher.next_batch(min(BATCH_SIZE, num_utxos - coin_idx)) for coin_idx in range(0, num_utxos, BATCH_SIZE))
 
+    coin_idx = 0
+    max_height = 0
+    con.execute("BEGIN")
+    for batch, (rows, batch_max_height) in map_batches(batches, decode_coins, args.jobs, spk_hex, txid_hex, txid_reverse):
         if args.verbose:
-            print(f"Coin {coin_idx}/{num_utxos}:")
-            print(f"    prevout = {prevout_hash[::-1].hex()}:{prevout_index}")
-            print(f"    amount = {amount}, height = {height}, coinbase = {is_coinbase}")
-            print(f"    scriptPubKey = {scriptpubkey.hex()}\n")
+            for i, (prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey) in enumerate(
+                    parse_coins(memoryview(batch[0]), *batch[1:]), start=coin_idx + 1):
+                print(f"Coin {i}/{num_utxos}:")
+                print(f"    prevout = {prevout_hash[::-1].hex()}:{prevout_index}")
+                print(f"    amount = {amount}, height = {height}, coinbase = {is_coinbase}")
+                print(f"    scriptPubKey = {scriptpubkey.hex()}\n")
 
-        if coin_idx % (16*1024) == 0 or coin_idx == num_utxos:
-            # write utxo batch to database
-            con.executemany("INSERT INTO utxos VALUES(?, ?, ?, ?, ?, ?)", write_batch)
-            con.commit()
-            write_batch.clear()
+        # write utxo batch to database
+        con.executemany("INSERT INTO utxos VALUES(?, ?, ?, ?, ?, ?)", rows)
+        max_height = max(max_height, batch_max_height)
+        coin_idx += len(rows)
 
         if coin_idx % (1024*1024) == 0:
             elapsed = time.time() - start_time
             print(f"{coin_idx} coins converted [{coin_idx/num_utxos*100:.2f}%], " +
                   f"{elapsed:.3f}s passed since start")
+    con.commit()
+
+    for index in args.index:
+        print(f"Creating index on {INDEXES[index]}...")
+        con.execute(f"CREATE INDEX utxos_{index} ON utxos({INDEXES[index]})")
+        con.commit()
     con.close()
 
     print(f"TOTAL: {num_utxos} coins written to {args.outfile}, snapshot height is {max_height}.")
-    if f.read(1) != b'':  # EOF should be reached by now
+    if batcher.remaining() != b'' or f.read(1) != b'':  # EOF should be reached by now
         print(f"WARNING: input file {args.infile} has not reached EOF yet!")
         sys.exit(1)
 
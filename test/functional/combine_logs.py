@@ -7,7 +7,14 @@
 This streams the combined log output to stdout. Use combine_logs.py > outputfile
 to write to an outputfile.
 
-If no argument is provided, the most recent test directory will be used."""
+If no argument is provided, the most recent test directory will be used.
+
+With --index, or any of the query options (--since, --until, --node,
+--category, --grep, --page), the log events are first added to an SQLite index
+in the test directory (combined_logs.sqlite by default) together with their
+node, category and thread, and then queried from it. Only the parts of the log
+files appended since the last run are parsed again, so repeated queries of a
+large test directory are fast."""
 
 import argparse
 from collections import defaultdict, namedtuple
@@ -16,6 +23,7 @@ import itertools
 import os
 import pathlib
 import re
+import sqlite3
 import sys
 import tempfile
 
@@ -28,8 +36,32 @@ TMPDIR_PREFIX = "bitcoin_func_test_"
 # Matches on the date format at the start of the log event
 TIMESTAMP_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{6})?Z")
 
+# Matches the optional mocktime, thread name, source location and category
+# following the timestamp in a debug.log event
+NODE_EVENT_PATTERN = re.compile(r"^\S+ (?:\(mocktime: [^)]*\) )?(?:\[([^\]]*)\] )?(?:\[[^\]]+:\d+\] \[[^\]]*\] )?(?:\[([a-z0-9_]+)(?::[a-z]+)?\] )?")
+# Matches the logger name following the timestamp in a test_framework.log event
+TEST_EVENT_PATTERN = re.compile(r"^\S+ (\S+) \(")
+
+# Name of the index file in the test directory
+INDEX_FILENAME = "combined_logs.sqlite"
+# Increased whenever the schema or the parsing changes, to rebuild old indexes
+INDEX_VERSION = 1
+DEFAULT_PAGE_SIZE = 5000
+# Number of events inserted into the index at once
+INDEX_BATCH_SIZE = 10000
+
 LogEvent = namedtuple('LogEvent', ['timestamp', 'source', 'event'])
 
+def positive_int(value):
+    """Argument type for --page and --pagesize."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"invalid value '{value}', expected a positive integer")
+    return number
+
 def main():
     """Main function. Parses args, reads the log files and renders them as text or html."""
     parser = argparse.ArgumentParser(
@@ -40,6 +72,15 @@ def main():
               'Defaults to the most recent'))
     parser.add_argument('-c', '--color', dest='color', action='store_true', help='outputs the combined log with events colored by source (requires posix terminal colors. Use less -r for viewing)')
     parser.add_argument('--html', dest='html', action='store_true', help='outputs the combined log as html. Requires jinja2. pip install jinja2')
+    parser.add_argument('--index', action='store_true', help='build or update the index of the test directory and read the events from it')
+    parser.add_argument('--indexfile', help=f'index file to use (default: {INDEX_FILENAME} in the test directory)')
+    parser.add_argument('--since', help='only events at or after this (possibly partial) timestamp, e.g. 2024-01-01T12:00:05')
+    parser.add_argument('--until', help='only events before this (possibly partial) timestamp')
+    parser.add_argument('--node', dest='sources', action='append', help='only events from this source, e.g. node0 or test. Can be specified multiple times')
+    parser.add_argument('--category', dest='categories', action='append', help='only events of this debug category (e.g. net), or logger name for the test log. Can be specified multiple times')
+    parser.add_argument('--grep', help='only events containing the words of this text as a phrase')
+    parser.add_argument('--page', type=positive_int, help='only output the n-th page (starting at 1) of --pagesize events')
+    parser.add_argument('--pagesize', type=positive_int, default=DEFAULT_PAGE_SIZE, help='number of events per page (default: %(default)s)')
     args = parser.parse_args()
 
     if args.html and args.color:
@@ -64,10 +105,19 @@ def main():
         colors["node3"] = "\033[0;33m"  # YELLOW
         colors["reset"] = "\033[0m"  # Reset font color
 
-    log_events = read_logs(testdir)
+    query = {key: getattr(args, key) for key in ("since", "until", "sources", "categories", "grep")}
+    page = None
+    if args.index or args.page or any(query.values()):
+        conn = update_index(testdir, args.indexfile or os.path.join(testdir, INDEX_FILENAME))
+        if args.page:
+            page = (args.page, max(1, -(-count_indexed_events(conn, **query) // args.pagesize)))
+            query.update(limit=args.pagesize, offset=(args.page - 1) * args.pagesize)
+        log_events = query_index(conn, **query)
+    else:
+        log_events = read_logs(testdir)
 
     if args.html:
-        print_logs_html(log_events)
+        print_logs_html(log_events, page)
     else:
         print_logs_plain(log_events, colors)
         print_node_warnings(testdir, colors)
@@ -79,24 +129,7 @@ def read_logs(tmp_dir):
     Delegates to generator function get_log_events() to provide individual log events
     for each of the input log files."""
 
-    # Find out what the folder is called that holds node 0's debug.log file
-    debug_logs = list(pathlib.Path(tmp_dir).glob('node0/**/debug.log'))
-    match len(debug_logs):
-        case 0:
-            chain = 'regtest'  # fallback to regtest
-        case 1:
-            chain = re.search(r'node0/(.+?)/debug\.log$', debug_logs[0].as_posix()).group(1)
-        case _:
-            raise RuntimeError('Max one debug.log is supported, found several:\n\t' +
-                               '\n\t'.join(map(str, debug_logs)))
-
-    files = [("test", "%s/test_framework.log" % tmp_dir)]
-    for i in itertools.count():
-        logfile = "{}/node{}/{}/debug.log".format(tmp_dir, i, chain)
-        if not os.path.isfile(logfile):
-            break
-        files.append(("node%d" % i, logfile))
-
+    files = log_files(tmp_dir)
     return heapq.merge(*[get_log_events(source, f) for source, f in files])
 
 
@@ -148,35 +181,209 @@ def get_log_events(source, logfile):
     Log events may be split over multiple lines. We use the timestamp
     regex match as the marker for a new log event."""
     try:
-        with open(logfile, 'r') as infile:
-            event = ''
-            timestamp = ''
-            for line in infile:
-                # skip blank lines
-                if line == '\n':
-                    continue
-                # if this line has a timestamp, it's the start of a new log event.
-                time_match = TIMESTAMP_PATTERN.match(line)
-                if time_match:
-                    if event:
-                        yield LogEvent(timestamp=timestamp, source=source, event=event.rstrip())
-                    timestamp = time_match.group()
-                    if time_match.group(1) is None:
-                        # timestamp does not have microseconds. Add zeroes.
-                        timestamp_micro = timestamp.replace("Z", ".000000Z")
-                        line = line.replace(timestamp, timestamp_micro)
-                        timestamp = timestamp_micro
-                    event = line
-                # if it doesn't have a timestamp, it's a continuation line of the previous log.
-                else:
-                    # Add the line. Prefix with space equivalent to the source + timestamp so log lines are aligned
-                    event += "                                   " + line
-            # Flush the final event
-            yield LogEvent(timestamp=timestamp, source=source, event=event.rstrip())
+        with open(logfile, 'rb') as infile:
+            for _, event in parse_log_events(source, infile):
+                yield event
     except FileNotFoundError:
         print("File %s could not be opened. Continuing without it." % logfile, file=sys.stderr)
 
 
+def parse_log_events(source, infile):
+    """Yield (byte offset, LogEvent) for the log events in the binary file
+    infile, starting at its current position."""
+    offset = infile.tell()
+    event = ''
+    timestamp = ''
+    event_offset = offset
+    for raw_line in infile:
+        line_offset = offset
+        offset += len(raw_line)
+        line = raw_line.decode('utf-8', errors='replace')
+        # skip blank lines
+        if line == '\n':
+            continue
+        # if this line has a timestamp, it's the start of a new log event.
+        time_match = TIMESTAMP_PATTERN.match(line)
+        if time_match:
+            if event:
+                yield event_offset, LogEvent(timestamp=timestamp, source=source, event=event.rstrip())
+            timestamp = time_match.group()
+            if time_match.group(1) is None:
+                # timestamp does not have microseconds. Add zeroes.
+                timestamp_micro = timestamp.replace("Z", ".000000Z")
+                line = line.replace(timestamp, timestamp_micro)
+                timestamp = timestamp_micro
+            event = line
+            event_offset = line_offset
+        # if it doesn't have a timestamp, it's a continuation line of the previous log.
+        else:
+            # Add the line. Prefix with space equivalent to the source + timestamp so log lines are aligned
+            event += "                                   " + line
+    # Flush the final event
+    yield event_offset, LogEvent(timestamp=timestamp, source=source, event=event.rstrip())
+
+
+def event_thread_and_category(event):
+    """Return the thread name and the category of a log event, where present."""
+    if event.source == "test":
+        match = TEST_EVENT_PATTERN.match(event.event)
+        return None, match.group(1) if match else None
+    match = NODE_EVENT_PATTERN.match(event.event)
+    return match.group(1), match.group(2)
+
+
+def log_files(tmp_dir):
+    """Return the list of (source, path) of the log files in a test directory."""
+    # Find out what the folder is called that holds node 0's debug.log file
+    debug_logs = list(pathlib.Path(tmp_dir).glob('node0/**/debug.log'))
+    match len(debug_logs):
+        case 0:
+            chain = 'regtest'  # fallback to regtest
+        case 1:
+            chain = re.search(r'node0/(.+?)/debug\.log$', debug_logs[0].as_posix()).group(1)
+        case _:
+            raise RuntimeError('Max one debug.log is supported, found several:\n\t' +
+                               '\n\t'.join(map(str, debug_logs)))
+
+    files = [("test", "%s/test_framework.log" % tmp_dir)]
+    for i in itertools.count():
+        logfile = "{}/node{}/{}/debug.log".format(tmp_dir, i, chain)
+        if not os.path.isfile(logfile):
+            break
+        files.append(("node%d" % i, logfile))
+    return files
+
+
+def has_fts5(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_check USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_check")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def open_index(index_path):
+    """Open the index, creating it if it does not exist or is outdated."""
+    conn = sqlite3.connect(index_path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+        conn.close()
+        os.remove(index_path)
+        conn = sqlite3.connect(index_path)
+        conn.executescript(f"""
+            CREATE TABLE events(id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, source TEXT NOT NULL,
+                                category TEXT, thread TEXT, offset INTEGER NOT NULL, event TEXT NOT NULL);
+            CREATE INDEX events_timestamp ON events(timestamp);
+            CREATE INDEX events_source ON events(source, timestamp);
+            CREATE INDEX events_category ON events(category, timestamp);
+            -- Position up to which each log file is indexed completely
+            CREATE TABLE files(source TEXT PRIMARY KEY, path TEXT NOT NULL, inode INTEGER NOT NULL, offset INTEGER NOT NULL);
+            PRAGMA user_version = {INDEX_VERSION};
+        """)
+        if has_fts5(conn):
+            conn.execute("CREATE VIRTUAL TABLE events_fts USING fts5(event, content='events', content_rowid='id')")
+    conn.execute("PRAGMA synchronous = OFF")
+    return conn
+
+
+def has_fts_table(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'events_fts'").fetchone() is not None
+
+
+def delete_indexed_events(conn, source, min_offset):
+    """Remove the events of source starting at min_offset from the index."""
+    if has_fts_table(conn):
+        conn.execute("INSERT INTO events_fts(events_fts, rowid, event) SELECT 'delete', id, event FROM events WHERE source = ? AND offset >= ?", (source, min_offset))
+    conn.execute("DELETE FROM events WHERE source = ? AND offset >= ?", (source, min_offset))
+
+
+def index_events(conn, source, offset_events):
+    """Add the (offset, LogEvent) pairs to the index and return the offset of
+    the last event, or None if there was none."""
+    fts = has_fts_table(conn)
+    last_offset = None
+    while True:
+        rows = []
+        for offset, event in itertools.islice(offset_events, INDEX_BATCH_SIZE):
+            if not event.event:
+                continue
+            thread, category = event_thread_and_category(event)
+            rows.append((event.timestamp, source, category, thread, offset, event.event))
+            last_offset = offset
+        if not rows:
+            return last_offset
+        first_id = (conn.execute("SELECT MAX(id) FROM events").fetchone()[0] or 0) + 1
+        conn.executemany("INSERT INTO events(timestamp, source, category, thread, offset, event) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if fts:
+            conn.execute("INSERT INTO events_fts(rowid, event) SELECT id, event FROM events WHERE id >= ?", (first_id,))
+
+
+def update_index(tmp_dir, index_path):
+    """Add the log events written since the last update to the index and return the connection.
+
+    The last event of each file may still get continuation lines, so it is
+    parsed again on the next update."""
+    conn = open_index(index_path)
+    with conn:
+        for source, path in log_files(tmp_dir):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                print("File %s could not be opened. Continuing without it." % path, file=sys.stderr)
+                continue
+            row = conn.execute("SELECT path, inode, offset FROM files WHERE source = ?", (source,)).fetchone()
+            start = 0
+            if row is not None and row[0] == path and row[1] == st.st_ino and row[2] <= st.st_size:
+                start = row[2]
+            delete_indexed_events(conn, source, start)
+            with open(path, 'rb') as infile:
+                infile.seek(start)
+                last_offset = index_events(conn, source, parse_log_events(source, infile))
+            conn.execute("INSERT OR REPLACE INTO files(source, path, inode, offset) VALUES (?, ?, ?, ?)",
+                         (source, path, st.st_ino, start if last_offset is None else last_offset))
+    return conn
+
+
+def query_conditions(conn, *, since=None, until=None, sources=None, categories=None, grep=None):
+    conditions, params = [], []
+    if since:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if sources:
+        conditions.append(f"source IN ({', '.join('?' * len(sources))})")
+        params += sources
+    if categories:
+        conditions.append(f"category IN ({', '.join('?' * len(categories))})")
+        params += categories
+    if grep:
+        if has_fts_table(conn):
+            conditions.append("id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)")
+            params.append('"{}"'.format(grep.replace('"', '""')))
+        else:
+            conditions.append("instr(event, ?) > 0")
+            params.append(grep)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def count_indexed_events(conn, **query):
+    where, params = query_conditions(conn, **query)
+    return conn.execute("SELECT COUNT(*) FROM events" + where, params).fetchone()[0]
+
+
+def query_index(conn, *, limit=None, offset=0, **query):
+    """Generator returning the LogEvents from the index matching the query, in the order of read_logs()."""
+    where, params = query_conditions(conn, **query)
+    sql = "SELECT timestamp, source, event FROM events" + where + " ORDER BY timestamp, source, id"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    for row in conn.execute(sql, params):
+        yield LogEvent(*row)
+
+
 def print_logs_plain(log_events, colors):
     """Renders the iterator of log events into text."""
     for event in log_events:
@@ -187,8 +394,8 @@ def print_logs_plain(log_events, colors):
                 print("{0}{1}{2}".format(colors[event.source.rstrip()], line, colors["reset"]))
 
 
-def print_logs_html(log_events):
-    """Renders the iterator of log events into html."""
+def print_logs_html(log_events, page=None):
+    """Renders the iterator of log events into html. page is (page number, number of pages) for a paged query."""
     try:
         import jinja2 #type:ignore
     except ImportError:
@@ -196,7 +403,8 @@ def print_logs_html(log_events):
         sys.exit(1)
     print(jinja2.Environment(loader=jinja2.FileSystemLoader('./'))
                     .get_template('combined_log_template.html')
-                    .render(title="Combined Logs from testcase", log_events=[event._asdict() for event in log_events]))
+                    .render(title="Combined Logs from testcase" + (" (page {} of {})".format(*page) if page else ""),
+                            log_events=[event._asdict() for event in log_events]))
 
 
 if __name__ == '__main__':
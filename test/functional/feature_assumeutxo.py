@@ -700,12 +700,11 @@ class AssumeutxoTest(BitcoinTestFramework):
         self.log.info("Re-check nTx and nChainTx values")
         check_tx_counts(final=True)
 
-        for i in (0, 1):
-            n = self.nodes[i]
-            self.log.info(f"Restarting node {i} to ensure (Check|Load)BlockIndex passes")
-            with self.assert_disk_cleanup(n, i == 1):
-                self.restart_node(i, extra_args=self.extra_args[i])
+        self.log.info("Restarting nodes 0 and 1 to ensure (Check|Load)BlockIndex passes")
+        with self.assert_disk_cleanup(self.nodes[0], False), self.assert_disk_cleanup(self.nodes[1], True):
+            self.restart_nodes([0, 1], extra_args=[self.extra_args[0], self.extra_args[1]])
 
+        for n in (self.nodes[0], self.nodes[1]):
             assert_equal(n.getblockchaininfo()["blocks"], FINAL_HEIGHT)
 
             chainstate, = n.getchainstates()['chainstates']
@@ -778,12 +777,11 @@ class AssumeutxoTest(BitcoinTestFramework):
         }
         self.wait_until(lambda: n2.getindexinfo() == completed_idx_state)
 
-        for i in (0, 2):
-            n = self.nodes[i]
-            self.log.info(f"Restarting node {i} to ensure (Check|Load)BlockIndex passes")
-            with self.assert_disk_cleanup(n, i == 2):
-                self.restart_node(i, extra_args=self.extra_args[i])
+        self.log.info("Restarting nodes 0 and 2 to ensure (Check|Load)BlockIndex passes")
+        with self.assert_disk_cleanup(self.nodes[0], False), self.assert_disk_cleanup(self.nodes[2], True):
+            self.restart_nodes([0, 2], extra_args=[self.extra_args[0], self.extra_args[2]])
 
+        for n in (self.nodes[0], self.nodes[2]):
             assert_equal(n.getblockchaininfo()["blocks"], FINAL_HEIGHT)
 
             chainstate, = n.getchainstates()['chainstates']
@@ -18,19 +18,25 @@ TEST_FRAMEWORK_MODULES = [
     "address",
     "crypto.bip324_cipher",
     "blocktools",
+    "chain_fixture",
     "compressor",
+    "datadir_copy",
     "crypto.chacha20",
     "crypto.ellswift",
     "extendedkey",
     "key",
+    "log_follower",
     "messages",
     "crypto.muhash",
     "crypto.poly1305",
     "crypto.ripemd160",
+    "resource_usage",
+    "rpc_stats",
     "crypto.secp256k1",
     "crypto.siphash",
     "script",
     "script_util",
+    "test_history",
     "segwit_addr",
     "wallet_util",
 ]
@@ -69,8 +69,7 @@ class FeatureIndexPruneTest(BitcoinTestFramework):
         self.wait_until(lambda: self.nodes[2].getindexinfo() == expected)
 
     def restart_without_indices(self):
-        for i in range(3):
-            self.restart_node(i, extra_args=["-fastprune", "-prune=1"])
+        self.restart_nodes(range(3), extra_args=[["-fastprune", "-prune=1"]] * 3)
 
     def check_for_block(self, node, hash):
         try:
@@ -185,9 +184,7 @@ class FeatureIndexPruneTest(BitcoinTestFramework):
             node.assert_start_raises_init_error(extra_args=self.extra_args[i], expected_msg=msg+end_msg)
 
         self.log.info("make sure the nodes start again with the indices and an additional -reindex arg")
-        for i in range(3):
-            restart_args = self.extra_args[i] + ["-reindex"]
-            self.restart_node(i, extra_args=restart_args)
+        self.restart_nodes(range(3), extra_args=[self.extra_args[i] + ["-reindex"] for i in range(3)])
 
         self.linear_sync(self.nodes[3])
         self.sync_index(height=2500)
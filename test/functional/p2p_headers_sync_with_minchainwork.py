@@ -127,7 +127,7 @@ class RejectLowDifficultyHeadersTest(BitcoinTestFramework):
         # Ensure we have a long chain already
         current_height = self.nodes[0].getblockcount()
         if (current_height < 3000):
-            self.generate(node, 3000-current_height, sync_fun=self.no_op)
+            self.generate_offline(node, 3000-current_height, sync_fun=self.no_op)
 
         # Send a group of 2000 headers, forking from genesis.
         new_blocks = []
@@ -157,8 +157,8 @@ class RejectLowDifficultyHeadersTest(BitcoinTestFramework):
         # received headers during a sync are fully between locator entries.
         BLOCKS_TO_MINE = 4110
 
-        self.generate(self.nodes[0], BLOCKS_TO_MINE, sync_fun=self.no_op)
-        self.generate(self.nodes[1], BLOCKS_TO_MINE+2, sync_fun=self.no_op)
+        self.generate_offline(self.nodes[0], BLOCKS_TO_MINE, sync_fun=self.no_op)
+        self.generate_offline(self.nodes[1], BLOCKS_TO_MINE+2, sync_fun=self.no_op)
 
         self.reconnect_all()
 
@@ -13,7 +13,7 @@ bucket refills (R tokens/second as mocktime advances).
 from decimal import Decimal
 import time
 
-from test_framework.blocktools import COINBASE_MATURITY
+from test_framework.chain_fixture import ChainFixture
 from test_framework.p2p import P2PTxInvStore
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import assert_equal
@@ -28,6 +28,8 @@ class TxRelayRateLimitTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 1
         self.extra_args = [[f'-txsendrate={SEND_RATE}']]
+        # Enough mature coinbase UTXOs for all transactions
+        self.chain_fixture = ChainFixture(height=400, miniwallet_utxos=NUM_TXS + 50)
 
     def inbound_backlog(self, node):
         return node.getnetworkinfo()['inv_buckets']['inbound']['backlog']
@@ -38,9 +40,6 @@ class TxRelayRateLimitTest(BitcoinTestFramework):
 
         node.setmocktime(int(time.time()))
 
-        # Mine enough blocks for mature coinbase UTXOs.
-        self.generate(wallet, COINBASE_MATURITY + NUM_TXS + 50)
-
         # Connect an inbound peer (negotiates wtxid relay by default)
         peer = node.add_p2p_connection(P2PTxInvStore())
 
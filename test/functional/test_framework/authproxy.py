@@ -76,6 +76,9 @@ class AuthServiceProxy():
         # "Invalid argument" exception in Python's HTTP(S) client
         # library on some operating systems (e.g. OpenBSD, FreeBSD)
         self.timeout = min(timeout, 2147483)
+        # Payload sizes of the last request sent and response received, in bytes
+        self._last_request_size = 0
+        self._last_response_size = 0
         self._set_conn(connection)
 
     def __getattr__(self, name):
@@ -98,6 +101,8 @@ class AuthServiceProxy():
                    'Content-type': 'application/json'}
         if not self.reuse_http_connections:
             self._set_conn()
+        self._last_request_size = len(postdata)
+        self._last_response_size = 0
         self.__conn.request(method, path, postdata, headers)
         return self._get_response()
 
@@ -190,6 +195,7 @@ class AuthServiceProxy():
                 http_response.status)
 
         data = http_response.read()
+        self._last_response_size = len(data)
         try:
             responsedata = data.decode('utf8')
         except UnicodeDecodeError as e:
@@ -89,6 +89,11 @@ SIGNET_HEADER = b"\xec\xc7\xda\xa2"
 # Number of blocks to create in temporary blockchain branch for reorg testing
 FORK_LENGTH = 10
 
+# Number of previous blocks the median time past is calculated from
+MEDIAN_TIME_SPAN = 11
+# Number of blocks sent per JSON-RPC batch request by submit_blocks()
+SUBMIT_BLOCKS_BATCH_SIZE = 100
+
 def nbits_str(nbits):
     return f"{nbits:08x}"
 
@@ -138,6 +143,45 @@ def create_empty_fork(node, fork_length=FORK_LENGTH):
 
     return blocks
 
+def create_chain(node, num_blocks, *, script_pubkey):
+    """Create num_blocks empty blocks extending node's active chain, without
+    the node's help. Returns the solved blocks, to be submitted in order.
+
+    Each coinbase pays the block subsidy to script_pubkey. Like the node's own
+    mining RPCs, the block time is the node's (mock) time, but at least the
+    median time past of the previous blocks plus one."""
+    tip = node.getbestblockhash()
+    header = node.getblockheader(tip)
+    height = header["height"]
+    times = [header["time"]]
+    while len(times) < MEDIAN_TIME_SPAN and "previousblockhash" in header:
+        header = node.getblockheader(header["previousblockhash"])
+        times.insert(0, header["time"])
+    now = node.mocktime or int(time.time())
+
+    tip = int(tip, 16)
+    blocks = []
+    for _ in range(num_blocks):
+        height += 1
+        block_time = max(now, sorted(times)[len(times) // 2] + 1)
+        block = create_block(tip, create_coinbase(height, script_pubkey=script_pubkey), ntime=block_time)
+        block.solve()
+        blocks.append(block)
+        tip = block.hash_int
+        times = times[1 - MEDIAN_TIME_SPAN:] + [block_time]
+    return blocks
+
+def submit_blocks(node, blocks, *, batch_size=SUBMIT_BLOCKS_BATCH_SIZE):
+    """Submit blocks to node in order, using batched submitblock calls.
+
+    Raises an AssertionError if any block is not accepted."""
+    for i in range(0, len(blocks), batch_size):
+        batch = blocks[i:i + batch_size]
+        responses = node.batch([node.submitblock.get_request(block.serialize().hex()) for block in batch])
+        for block, response in zip(batch, responses):
+            if response["error"] is not None or response["result"] is not None:
+                raise AssertionError(f"Block {block.hash_hex} was not accepted: {response}")
+
 def get_witness_script(witness_root, witness_nonce):
     witness_commitment = hash256(ser_uint256(witness_root) + ser_uint256(witness_nonce))
     output_data = WITNESS_COMMITMENT_HEADER + witness_commitment
@@ -288,6 +332,17 @@ class TestFrameworkBlockTools(unittest.TestCase):
         )
         assert_equal(CScriptNum.decode(block.vtx[0].vin[0].scriptSig), 200)
 
+    def test_solve(self):
+        block = create_block(hashprev=1, height=1, ntime=TIME_GENESIS_BLOCK + 1)
+        block.solve()
+        self.assertTrue(block.is_valid())
+        # The first valid nonce is found, as with a naive search
+        nonce = block.nNonce
+        block.nNonce = 0
+        while block.hash_int > REGTEST_TARGET:
+            block.nNonce += 1
+        assert_equal(block.nNonce, nonce)
+
     def test_create_coinbase(self):
         height = 20
         coinbase_tx = create_coinbase(height=height)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Declarative chain fixtures built on top of the 199-block cache.
+
+A test that needs more than the cached chain sets `self.chain_fixture` in
+set_test_params(), e.g.
+
+    self.chain_fixture = ChainFixture(height=500, miniwallet_utxos=300, txindex=True)
+
+The first test of a run that needs a fixture builds it in the cache directory
+from a copy of the base cache: it mines the additional blocks to the default
+MiniWallet address, builds the requested indexes and creates the requested
+wallets. Concurrent tests needing the same fixture wait for it and all later
+tests only copy it, like the base cache.
+"""
+
+import contextlib
+from dataclasses import dataclass
+import itertools
+import json
+import os
+import shutil
+import unittest
+
+from .blocktools import COINBASE_MATURITY
+from .util import MAX_NODES
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Height of the chain in the base cache, see BitcoinTestFramework._initialize_chain()
+CACHE_HEIGHT = 199
+# Blocks of the base cache with a coinbase output to the default MiniWallet address
+CACHE_MINIWALLET_BLOCKS = range(76, 101), range(176, CACHE_HEIGHT + 1)
+# Wallet i of a fixture is moved to the default wallet of node i
+FIXTURE_WALLET_PREFIX = "fixture_wallet_"
+
+
+@dataclass(frozen=True)
+class ChainFixture:
+    """Chain state the nodes of a test start from.
+
+    height: height of the chain. Blocks above the base cache pay to the
+        default MiniWallet address.
+    miniwallet_utxos: minimum number of mature coinbase outputs of the
+        default MiniWallet. Only checked, the height determines the number.
+    wallets: number of nodes (starting with node 0) that start with their
+        default wallet already created and the node's deterministic coinbase
+        key imported.
+    txindex, blockfilterindex, coinstatsindex: indexes that are built and
+        enabled in the nodes' bitcoin.conf."""
+    height: int = CACHE_HEIGHT
+    miniwallet_utxos: int = 0
+    wallets: int = 0
+    txindex: bool = False
+    blockfilterindex: bool = False
+    coinstatsindex: bool = False
+
+    def __post_init__(self):
+        if self.height < CACHE_HEIGHT:
+            raise ValueError(f"Chain fixture height must be at least {CACHE_HEIGHT}")
+        if not 0 <= self.wallets <= MAX_NODES:
+            raise ValueError(f"Chain fixture wallets must be between 0 and {MAX_NODES}")
+        mature = self.mature_miniwallet_utxos()
+        if mature < self.miniwallet_utxos:
+            raise ValueError(f"A chain of height {self.height} has only {mature} mature MiniWallet UTXOs, {self.miniwallet_utxos} requested")
+
+    def mature_miniwallet_utxos(self):
+        last_mature = self.height - COINBASE_MATURITY + 1
+        blocks = itertools.chain(*CACHE_MINIWALLET_BLOCKS, range(CACHE_HEIGHT + 1, self.height + 1))
+        return sum(1 for height in blocks if height <= last_mature)
+
+    def is_base_cache(self):
+        """Whether the fixture is just the base cache."""
+        return self.name() == ChainFixture().name()
+
+    def name(self):
+        """Name of the fixture's cache directory. The number of MiniWallet UTXOs follows from the height."""
+        parts = [f"height{self.height}"]
+        if self.wallets:
+            parts.append(f"wallets{self.wallets}")
+        parts += self.indexes()
+        return "fixture_" + "_".join(parts)
+
+    def indexes(self):
+        return [index for index in ("txindex", "blockfilterindex", "coinstatsindex") if getattr(self, index)]
+
+    def config_lines(self):
+        """Lines added to the bitcoin.conf of every node, to keep the fixture's indexes enabled."""
+        return [f"{index}=1" for index in self.indexes()]
+
+
+@contextlib.contextmanager
+def fixture_lock(lock_path):
+    """Serialize the building of a fixture between concurrent tests.
+
+    Where file locks are not available, concurrent tests may build the same
+    fixture and only the first finished copy is kept."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def assign_fixture_wallet(datadir, chain, node_index, wallet_name):
+    """Turn fixture wallet node_index in a node's copy of a fixture into the
+    node's wallet wallet_name, loaded on startup, and remove the other wallets."""
+    wallets_dir = os.path.join(datadir, chain, "wallets")
+    if not os.path.isdir(wallets_dir):
+        return
+    for entry in os.listdir(wallets_dir):
+        path = os.path.join(wallets_dir, entry)
+        if entry == f"{FIXTURE_WALLET_PREFIX}{node_index}":
+            os.rename(path, os.path.join(wallets_dir, wallet_name))
+            with open(os.path.join(datadir, chain, "settings.json"), "w", encoding="utf8") as f:
+                json.dump({"wallet": [wallet_name]}, f)
+        elif entry.startswith(FIXTURE_WALLET_PREFIX):
+            shutil.rmtree(path)
+
+
+class TestFrameworkChainFixture(unittest.TestCase):
+    def test_mature_miniwallet_utxos(self):
+        self.assertEqual(ChainFixture().mature_miniwallet_utxos(), 25)
+        self.assertEqual(ChainFixture(height=275).mature_miniwallet_utxos(), 25 + 1)
+        self.assertEqual(ChainFixture(height=400).mature_miniwallet_utxos(), 25 + 126)
+        with self.assertRaises(ValueError):
+            ChainFixture(height=250, miniwallet_utxos=26)
+        with self.assertRaises(ValueError):
+            ChainFixture(height=100)
+
+    def test_name(self):
+        self.assertTrue(ChainFixture().is_base_cache())
+        self.assertTrue(ChainFixture(miniwallet_utxos=10).is_base_cache())
+        fixture = ChainFixture(height=300, miniwallet_utxos=40, wallets=2, txindex=True, coinstatsindex=True)
+        self.assertFalse(fixture.is_base_cache())
+        self.assertEqual(fixture.name(), "fixture_height300_wallets2_txindex_coinstatsindex")
+        self.assertEqual(fixture.config_lines(), ["txindex=1", "coinstatsindex=1"])
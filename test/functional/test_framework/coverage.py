@@ -9,8 +9,10 @@ testing.
 """
 
 import os
+import time
 
 from .authproxy import AuthServiceProxy
+from .rpc_stats import RPCStats
 from typing import Optional
 
 REFERENCE_FILENAME = 'rpc_interface.txt'
@@ -21,36 +23,74 @@ class AuthServiceProxyWrapper():
     An object that wraps AuthServiceProxy to record specific RPC calls.
 
     """
-    def __init__(self, auth_service_proxy_instance: AuthServiceProxy, rpc_url: str, coverage_logfile: Optional[str]=None):
+    def __init__(self, auth_service_proxy_instance: AuthServiceProxy, rpc_url: str, coverage_logfile: Optional[str]=None, rpc_stats: Optional[RPCStats]=None):
         """
         Kwargs:
             auth_service_proxy_instance: the instance being wrapped.
             rpc_url: url of the RPC instance being wrapped
             coverage_logfile: if specified, write each service_name
                 out to a file when called.
+            rpc_stats: if specified, record the latency and payload sizes
+                of each call.
 
         """
         self.auth_service_proxy_instance = auth_service_proxy_instance
         self.rpc_url = rpc_url
         self.coverage_logfile = coverage_logfile
+        self.rpc_stats = rpc_stats
 
     def __getattr__(self, name):
         return_val = getattr(self.auth_service_proxy_instance, name)
         if not isinstance(return_val, type(self.auth_service_proxy_instance)):
             # If proxy getattr returned an unwrapped value, do the same here.
             return return_val
-        return AuthServiceProxyWrapper(return_val, self.rpc_url, self.coverage_logfile)
+        return AuthServiceProxyWrapper(return_val, self.rpc_url, self.coverage_logfile, self.rpc_stats)
 
     def __call__(self, *args, **kwargs):
         """
         Delegates to AuthServiceProxy, then writes the particular RPC method
-        called to a file.
+        called to a file and records its statistics.
 
         """
-        return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+        start_time = time.perf_counter()
+        try:
+            return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+        except Exception:
+            # RPC errors as well as transport errors, e.g. timeouts
+            self._record_stats(self.auth_service_proxy_instance._service_name, start_time, error=True)
+            raise
+        self._record_stats(self.auth_service_proxy_instance._service_name, start_time, error=False)
         self._log_call()
         return return_val
 
+    def batch(self, rpc_call_list):
+        """
+        Delegates to AuthServiceProxy.batch, recording the whole batch as one
+        call of the pseudo-method "batch", which is an error if any of the
+        calls in it failed.
+
+        """
+        start_time = time.perf_counter()
+        try:
+            responses = self.auth_service_proxy_instance.batch(rpc_call_list)
+        except Exception:
+            self._record_stats("batch", start_time, error=True)
+            raise
+        self._record_stats("batch", start_time, error=any(response.get("error") for response in responses))
+        return responses
+
+    def _record_stats(self, method, start_time, *, error):
+        if self.rpc_stats is None:
+            return
+        proxy = self.auth_service_proxy_instance
+        self.rpc_stats.record(
+            method,
+            time.perf_counter() - start_time,
+            request_bytes=proxy._last_request_size,
+            response_bytes=proxy._last_response_size,
+            error=error,
+        )
+
     def _log_call(self):
         rpc_method = self.auth_service_proxy_instance._service_name
 
@@ -61,7 +101,8 @@ class AuthServiceProxyWrapper():
     def __truediv__(self, relative_uri):
         return AuthServiceProxyWrapper(self.auth_service_proxy_instance / relative_uri,
                                        self.rpc_url,
-                                       self.coverage_logfile)
+                                       self.coverage_logfile,
+                                       self.rpc_stats)
 
     def get_request(self, *args, **kwargs):
         self._log_call()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Cheap copies of the cached node data directories.
+
+Every test that does not use a clean chain starts from a copy of the cached
+datadir. Instead of copying all bytes, CacheCopier tries, per file:
+
+1. a reflink (FICLONE ioctl), which shares the data blocks with the source
+   until either side writes to them. This is supported by e.g. btrfs, XFS and
+   bcachefs and is safe for any file.
+2. a hard link, but only for files that are never modified in place once
+   written. LevelDB table files (`*.ldb`) are such files: LevelDB only ever
+   creates and deletes them. The shared inode is made read-only, so that an
+   accidental in-place write by a test fails loudly instead of corrupting the
+   cache. Read-only permissions do not stop root, so hard links are not used
+   when running as root (as e.g. in CI containers). Block and undo files are
+   appended to by bitcoind and are always copied.
+3. a plain copy.
+
+Once a method failed (for example because the filesystem does not support
+reflinks or the destination is on another device), it is not tried again.
+"""
+
+import errno
+import os
+from pathlib import Path
+import shutil
+import stat
+import tempfile
+import unittest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# From <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Files that are never modified in place and may be shared through hard links
+IMMUTABLE_FILE_SUFFIXES = (".ldb",)
+
+# Errors meaning that a method is not available for this source/destination pair
+UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.EMLINK}
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src. Raise OSError if not supported."""
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflinks are not supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def running_as_root():
+    return hasattr(os, "geteuid") and os.geteuid() == 0
+
+
+class CacheCopier:
+    """Copy function for shutil.copytree() that shares data with the source where it is safe.
+
+    The number of files copied with each method is recorded in `counts`."""
+
+    METHODS = ("reflink", "hardlink", "copy")
+
+    def __init__(self, *, use_reflinks=True, use_hardlinks=True):
+        self.use_reflinks = use_reflinks and fcntl is not None
+        # Read-only files cannot be removed on Windows, which would break the
+        # cleanup of the test directory. Root can write to read-only files, so
+        # the shared inode would not be protected.
+        self.use_hardlinks = use_hardlinks and os.name != "nt" and not running_as_root()
+        self.counts = dict.fromkeys(self.METHODS, 0)
+
+    def __call__(self, src, dst):
+        if self.use_reflinks:
+            try:
+                reflink(src, dst)
+                self.counts["reflink"] += 1
+                return dst
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                self.use_reflinks = False
+        if self.use_hardlinks and str(src).endswith(IMMUTABLE_FILE_SUFFIXES):
+            try:
+                mode = os.stat(src).st_mode
+                os.chmod(src, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+                os.link(src, dst)
+                self.counts["hardlink"] += 1
+                return dst
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                self.use_hardlinks = False
+        shutil.copy2(src, dst)
+        self.counts["copy"] += 1
+        return dst
+
+    def summary(self):
+        return ", ".join(f"{method}: {self.counts[method]}" for method in self.METHODS)
+
+
+def copy_datadir(src, dst, copier=None):
+    """Copy the data directory src to the new directory dst and return the CacheCopier used."""
+    if copier is None:
+        copier = CacheCopier()
+    shutil.copytree(src, dst, copy_function=copier)
+    return copier
+
+
+class TestFrameworkDatadirCopy(unittest.TestCase):
+    def make_cache(self, root):
+        cache = Path(root) / "cache"
+        (cache / "regtest" / "blocks" / "index").mkdir(parents=True)
+        (cache / "regtest" / "blocks" / "blk00000.dat").write_bytes(b"block data")
+        (cache / "regtest" / "blocks" / "index" / "000005.ldb").write_bytes(b"table")
+        (cache / "regtest" / "blocks" / "index" / "MANIFEST-000002").write_bytes(b"manifest")
+        (cache / "bitcoin.conf").write_text("regtest=1\n")
+        return cache
+
+    def check_copy(self, cache, copy):
+        for path in cache.rglob("*"):
+            copied = copy / path.relative_to(cache)
+            if path.is_dir():
+                self.assertTrue(copied.is_dir())
+            else:
+                self.assertEqual(copied.read_bytes(), path.read_bytes())
+        # Rewriting and appending to a copied mutable file leaves the cache intact
+        (copy / "bitcoin.conf").write_text("port=1\n")
+        with open(copy / "regtest" / "blocks" / "blk00000.dat", "ab") as f:
+            f.write(b" appended")
+        self.assertEqual((cache / "bitcoin.conf").read_text(), "regtest=1\n")
+        self.assertEqual((cache / "regtest" / "blocks" / "blk00000.dat").read_bytes(), b"block data")
+
+    def test_copy_datadir(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = self.make_cache(tmpdir)
+            copier = copy_datadir(cache, Path(tmpdir) / "node0")
+            self.check_copy(cache, Path(tmpdir) / "node0")
+            self.assertEqual(sum(copier.counts.values()), 4)
+            if copier.counts["reflink"] == 0 and os.name != "nt" and not running_as_root():
+                # Without reflinks, only the LevelDB table is hard linked
+                self.assertEqual(copier.counts["hardlink"], 1)
+                ldb = Path(tmpdir) / "node0" / "regtest" / "blocks" / "index" / "000005.ldb"
+                self.assertEqual(ldb.stat().st_nlink, 2)
+                self.assertFalse(ldb.stat().st_mode & stat.S_IWUSR)
+            if running_as_root():
+                # Read-only permissions would not protect the cache from root
+                self.assertEqual(copier.counts["hardlink"], 0)
+
+    def test_plain_copy(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = self.make_cache(tmpdir)
+            copier = copy_datadir(cache, Path(tmpdir) / "node0", CacheCopier(use_reflinks=False, use_hardlinks=False))
+            self.check_copy(cache, Path(tmpdir) / "node0")
+            self.assertEqual(copier.counts, {"reflink": 0, "hardlink": 0, "copy": 4})
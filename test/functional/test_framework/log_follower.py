@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Incremental follower for a node's debug.log.
+
+A DebugLogFollower keeps a read offset into debug.log and, while at least one
+LogWatch is registered, runs a thread that sleeps until the file changes
+(using Linux inotify through ctypes, falling back to polling elsewhere),
+reads only the newly appended bytes and feeds them to all registered watches.
+Each watch scans the new bytes for all of its expected and unexpected
+substrings at once.
+"""
+
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import re
+import select
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Interval between checks of the log file when inotify is not available
+POLL_INTERVAL = 0.05
+# Upper bound on how long the follower thread sleeps without a file event
+FOLLOWER_WAKEUP_INTERVAL = 0.5
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+
+class InotifyWaiter:
+    """Wait for changes to the files in a directory using Linux inotify."""
+
+    def __init__(self, dirname):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(dirname), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed for {dirname}")
+
+    def wait(self, timeout):
+        """Block until a file in the directory changed or the timeout expired."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        # Drain the queued events. Their content is irrelevant, the caller
+        # re-reads the file anyway.
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWaiter:
+    """Fallback for platforms without inotify."""
+
+    def __init__(self, dirname, *, retry_inotify=False):
+        # Whether inotify should be tried again once the directory exists
+        self.retry_inotify = retry_inotify
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, POLL_INTERVAL))
+
+    def close(self):
+        pass
+
+
+def make_waiter(dirname):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWaiter(dirname)
+        except (OSError, AttributeError):
+            # No libc inotify symbols, no watchable directory yet or out of
+            # inotify instances: poll instead.
+            return PollingWaiter(dirname, retry_inotify=not os.path.isdir(dirname))
+    return PollingWaiter(dirname)
+
+
+class MultiPatternMatcher:
+    """Streaming search for a set of byte substrings.
+
+    All patterns that are still missing are combined into one regular
+    expression, so each chunk of input is scanned once for all of them,
+    independent of the number of patterns. The last few bytes of the previous
+    chunk are kept, so that a pattern split across two chunks is found."""
+
+    def __init__(self, patterns):
+        self.remaining = set(patterns)
+        self.tail = b""
+        self.max_len = max((len(p) for p in self.remaining), default=0)
+        self._compile()
+
+    def _compile(self):
+        # Longest first, so that a pattern which is a prefix of another one
+        # does not shadow it. The lookahead allows overlapping matches.
+        alternatives = b"|".join(re.escape(p) for p in sorted(self.remaining, key=len, reverse=True))
+        self.regex = re.compile(b"(?=(" + alternatives + b"))") if self.remaining else None
+
+    def feed(self, data):
+        """Return the list of patterns found for the first time in data."""
+        if self.regex is None:
+            return []
+        found = []
+        buf = self.tail + data
+        pos = 0
+        while self.regex is not None:
+            m = self.regex.search(buf, pos)
+            if m is None:
+                break
+            found.append(m.group(1))
+            self.remaining.discard(m.group(1))
+            self._compile()
+            # Other patterns may still match at the same position.
+            pos = m.start()
+        self.tail = buf[max(0, len(buf) - self.max_len + 1):] if self.max_len > 1 else b""
+        return found
+
+
+class LogWatch:
+    """A set of expected and unexpected substrings searched for in the log
+    bytes appended after the watch was registered."""
+
+    def __init__(self, follower, start, expected_msgs, unexpected_msgs, *, keep_log=True):
+        self.follower = follower
+        self.start = start
+        self.keep_log = keep_log
+        self.log = bytearray()
+        # Patterns may be passed as str or bytes. Matching is done on the
+        # UTF-8 encoded bytes, reporting is done with the original objects.
+        self._originals = {}
+        for msg in list(expected_msgs) + list(unexpected_msgs):
+            self._originals[msg.encode("utf-8") if isinstance(msg, str) else msg] = msg
+        self.remaining_expected = list(expected_msgs)
+        self.unexpected_found = []
+        self._unexpected = set(unexpected_msgs)
+        self._matcher = MultiPatternMatcher(self._originals.keys())
+
+    def _feed(self, offset, data):
+        """Called by the follower with its lock held."""
+        end = offset + len(data)
+        if end <= self.start:
+            return
+        if offset < self.start:
+            data = data[self.start - offset:]
+        if self.keep_log:
+            self.log += data
+        for pattern in self._matcher.feed(data):
+            msg = self._originals[pattern]
+            if msg in self._unexpected:
+                self.unexpected_found.append(msg)
+            if msg in self.remaining_expected:
+                self.remaining_expected = [e for e in self.remaining_expected if e != msg]
+
+    def done(self):
+        return bool(self.unexpected_found) or not self.remaining_expected
+
+    def wait(self, timeout):
+        """Wait until all expected messages were found, an unexpected message
+        was found, or the timeout (in seconds) expired.
+
+        The log is read up to its current end before returning, even if the
+        timeout is zero."""
+        time_end = time.time() + timeout
+        self.follower.read_new()
+        with self.follower.changed:
+            while not self.done():
+                remaining = time_end - time.time()
+                if remaining <= 0:
+                    break
+                self.follower.changed.wait(remaining)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.follower.remove_watch(self)
+
+
+class DebugLogFollower:
+    """Follow a growing log file and dispatch new bytes to the registered watches."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset = 0
+        self.watches = []
+        self.thread = None
+        self.lock = threading.Lock()
+        # Notified whenever new bytes were dispatched to the watches
+        self.changed = threading.Condition(self.lock)
+
+    def _size(self):
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def watch(self, expected_msgs, unexpected_msgs=(), *, keep_log=True):
+        """Register and return a LogWatch for the bytes appended from now on.
+
+        Use the returned watch as a context manager to unregister it. Pass
+        keep_log=False if the log text is not needed for error messages."""
+        with self.lock:
+            start = self._size()
+            if not self.watches:
+                self.offset = start
+            watch = LogWatch(self, start, expected_msgs, unexpected_msgs, keep_log=keep_log)
+            self.watches.append(watch)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f"logfollower-{self.path.parent.parent.name}", daemon=True)
+                self.thread.start()
+        return watch
+
+    def remove_watch(self, watch):
+        with self.lock:
+            if watch in self.watches:
+                self.watches.remove(watch)
+
+    def read_new(self):
+        """Read the bytes appended since the last call and feed them to the watches."""
+        with self.lock:
+            try:
+                with open(self.path, "rb") as f:
+                    size = f.seek(0, os.SEEK_END)
+                    if size < self.offset:
+                        # The file was truncated or replaced; start over.
+                        self.offset = 0
+                        for watch in self.watches:
+                            watch.start = 0
+                    f.seek(self.offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            if not data:
+                return
+            for watch in self.watches:
+                watch._feed(self.offset, data)
+            self.offset += len(data)
+            self.changed.notify_all()
+
+    def _run(self):
+        waiter = None
+        try:
+            while True:
+                with self.lock:
+                    if not self.watches:
+                        self.thread = None
+                        return
+                if waiter is None or (getattr(waiter, "retry_inotify", False) and self.path.parent.is_dir()):
+                    if waiter is not None:
+                        waiter.close()
+                    waiter = make_waiter(self.path.parent)
+                waiter.wait(FOLLOWER_WAKEUP_INTERVAL)
+                self.read_new()
+        finally:
+            if waiter is not None:
+                waiter.close()
+
+
+class TestFrameworkLogFollower(unittest.TestCase):
+    def test_matcher_streaming(self):
+        matcher = MultiPatternMatcher([b"foo bar", b"bar baz", b"bar", b"qux"])
+        self.assertEqual(matcher.feed(b"xx foo b"), [])
+        self.assertEqual(sorted(matcher.feed(b"ar baz")), [b"bar", b"bar baz", b"foo bar"])
+        self.assertEqual(matcher.feed(b"bar baz"), [])
+        self.assertEqual(matcher.feed(b"q"), [])
+        self.assertEqual(matcher.feed(b"ux"), [b"qux"])
+        self.assertEqual(matcher.feed(b"qux"), [])
+
+    def test_follower(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "debug.log"
+            path.write_bytes(b"old line: expected\n")
+            follower = DebugLogFollower(path)
+
+            # Only bytes written after the watch was registered count
+            with follower.watch(["expected"], ["unexpected"]) as watch:
+                watch.wait(0)
+                self.assertEqual(watch.remaining_expected, ["expected"])
+                def append_in_two_writes():
+                    with path.open("ab", buffering=0) as f:
+                        f.write(b"new line: expe")
+                        time.sleep(0.05)
+                        f.write(b"cted\n")
+                writer = threading.Timer(0.1, append_in_two_writes)
+                writer.start()
+                watch.wait(10)
+                writer.join()
+                self.assertEqual(watch.remaining_expected, [])
+                self.assertEqual(watch.unexpected_found, [])
+                self.assertEqual(bytes(watch.log), b"new line: expected\n")
+
+            with follower.watch([b"never"], [b"unexpected"]) as watch:
+                with path.open("ab") as f:
+                    f.write(b"an unexpected line\n")
+                watch.wait(10)
+                self.assertEqual(watch.unexpected_found, [b"unexpected"])
+                self.assertEqual(watch.remaining_expected, [b"never"])
+
+            # The follower thread exits once no watches are left
+            for _ in range(100):
+                if follower.thread is None:
+                    break
+                time.sleep(0.1)
+            self.assertIsNone(follower.thread)
@@ -861,8 +861,19 @@ class CBlock(CBlockHeader):
 
     def solve(self):
         target = uint256_from_compact(self.nBits)
-        while self.hash_int > target:
-            self.nNonce += 1
+        header = self._serialize_header()
+        # The nonce is in the second 64-byte chunk of the header, so the
+        # SHA256 state after the first chunk is the same for every attempt.
+        midstate = hashlib.sha256(header[:64])
+        tail = header[64:76]
+        nonce = self.nNonce
+        while True:
+            inner = midstate.copy()
+            inner.update(tail + nonce.to_bytes(4, "little"))
+            if uint256_from_str(hashlib.sha256(inner.digest()).digest()) <= target:
+                break
+            nonce += 1
+        self.nNonce = nonce
 
     # Calculate the block weight using witness and non-witness
     # serialization size (does NOT use sigops).
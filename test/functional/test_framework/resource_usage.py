@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Resource usage accounting for the test process and its bitcoind nodes.
+
+The usage of a process is summarized as a dict with its peak resident set size
+("max_rss", in bytes), user and system CPU time ("cpu_user" and "cpu_sys", in
+seconds) and the bytes read from and written to storage ("read_bytes" and
+"write_bytes"). The values come from getrusage(2)/wait4(2), so the usage of a
+bitcoind process is only known once it exited and was reaped by TestNode.
+
+The framework writes the usage of the Python test process and of each node
+(accumulated over restarts) to `--resourceusagefile`, which `test_runner.py`
+reads to report the heaviest tests. The file also holds the space taken by the
+test directory at the end of the test, which `test_runner.py --ramdisk` uses to
+keep disk-heavy tests off the ramdisk.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+USAGE_KEYS = ("max_rss", "cpu_user", "cpu_sys", "read_bytes", "write_bytes")
+
+# ru_maxrss is given in kilobytes on Linux, but in bytes on macOS
+MAX_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+# ru_inblock/ru_oublock count blocks of 512 bytes
+BLOCK_SIZE = 512
+
+
+def new_usage():
+    return dict.fromkeys(USAGE_KEYS, 0)
+
+
+def usage_from_rusage(ru):
+    return {
+        "max_rss": ru.ru_maxrss * MAX_RSS_UNIT,
+        "cpu_user": ru.ru_utime,
+        "cpu_sys": ru.ru_stime,
+        "read_bytes": ru.ru_inblock * BLOCK_SIZE,
+        "write_bytes": ru.ru_oublock * BLOCK_SIZE,
+    }
+
+
+def self_usage():
+    """Return the usage of the current process, or None where getrusage() is not available."""
+    if resource is None:
+        return None
+    return usage_from_rusage(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def merge_usage(into, other):
+    """Add the usage `other` of a process that ran after or instead of `into`, in place.
+
+    CPU time and I/O add up, the peak RSS is the maximum of both."""
+    into["max_rss"] = max(into["max_rss"], other["max_rss"])
+    for key in ("cpu_user", "cpu_sys", "read_bytes", "write_bytes"):
+        into[key] += other[key]
+
+
+def add_usage(into, other):
+    """Add the usage `other` of a process that ran concurrently with `into`, in place.
+
+    The peak RSS values add up as well, giving an upper bound of the combined peak."""
+    for key in USAGE_KEYS:
+        into[key] += other[key]
+
+
+def poll_process(process):
+    """Like process.poll(), but also return the resource usage of the exited process.
+
+    Returns (returncode, usage), where both are None while the process is
+    running, and usage is None where wait4() is not available."""
+    if process.returncode is not None or not hasattr(os, "wait4"):
+        return process.poll(), None
+    try:
+        pid, status, ru = os.wait4(process.pid, os.WNOHANG)
+    except ChildProcessError:
+        # Reaped elsewhere
+        return process.poll(), None
+    if pid == 0:
+        return None, None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage_from_rusage(ru)
+
+
+def directory_size(path):
+    """Return the space allocated by the files below path in bytes, ignoring files that vanish meanwhile."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            # st_blocks is not available on Windows
+            total += st.st_blocks * BLOCK_SIZE if hasattr(st, "st_blocks") else st.st_size
+    return total
+
+
+def write_usage(filename, python_usage, nodes_usage, disk_usage=None):
+    """Write the usage of the test process and of all nodes, given as {node
+    index: usage}, and optionally the size of the test directory to a JSON file."""
+    with open(filename, "w", encoding="utf8") as f:
+        json.dump({
+            "python": python_usage,
+            "nodes": {str(i): usage for i, usage in nodes_usage.items()},
+            "disk_usage": disk_usage,
+        }, f, indent=1)
+
+
+def read_usage(filename):
+    """Read a file written by write_usage() and return (python usage, {node index: usage}, disk usage or None)."""
+    with open(filename, encoding="utf8") as f:
+        data = json.load(f)
+    return data["python"], data["nodes"], data.get("disk_usage")
+
+
+class TestFrameworkResourceUsage(unittest.TestCase):
+    def test_merge_and_add(self):
+        a = {"max_rss": 100, "cpu_user": 1.0, "cpu_sys": 0.5, "read_bytes": 512, "write_bytes": 1024}
+        b = {"max_rss": 300, "cpu_user": 2.0, "cpu_sys": 0.5, "read_bytes": 0, "write_bytes": 512}
+        merged = new_usage()
+        merge_usage(merged, a)
+        merge_usage(merged, b)
+        self.assertEqual(merged, {"max_rss": 300, "cpu_user": 3.0, "cpu_sys": 1.0, "read_bytes": 512, "write_bytes": 1536})
+        added = dict(a)
+        add_usage(added, b)
+        self.assertEqual(added["max_rss"], 400)
+
+    @unittest.skipIf(resource is None or not hasattr(os, "wait4"), "getrusage/wait4 not available")
+    def test_poll_process(self):
+        process = subprocess.Popen([sys.executable, "-c", "bytearray(50 * 1024 * 1024)"])
+        for _ in range(500):
+            returncode, usage = poll_process(process)
+            if returncode is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(returncode, 0)
+        self.assertGreater(usage["max_rss"], 50 * 1024 * 1024)
+        # The process was reaped, so the returncode is still available
+        self.assertEqual(process.wait(), 0)
+        self.assertEqual(poll_process(process), (0, None))
+        self.assertGreater(self_usage()["max_rss"], 0)
+
+    def test_directory_size(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertEqual(directory_size(tmpdir), 0)
+            os.mkdir(os.path.join(tmpdir, "blocks"))
+            with open(os.path.join(tmpdir, "blocks", "blk00000.dat"), "wb") as f:
+                f.write(os.urandom(100 * 1024))
+            self.assertGreaterEqual(directory_size(tmpdir), 100 * 1024)
+            usage_file = os.path.join(tmpdir, "usage.json")
+            write_usage(usage_file, new_usage(), {0: new_usage()}, disk_usage=123)
+            self.assertEqual(read_usage(usage_file), (new_usage(), {"0": new_usage()}, 123))
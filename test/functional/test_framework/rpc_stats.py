@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Per-method RPC latency statistics.
+
+Every RPC call made through a TestNode's AuthServiceProxy is recorded into the
+node's RPCStats object: call count, error count, accumulated and maximum
+latency, a fixed-bucket latency histogram and request/response payload sizes.
+Failed calls count as errors, whether the node returned an RPC error or the
+call failed in transport (e.g. a timeout). A batch request is recorded as one
+call of the pseudo-method "batch".
+
+The framework writes the statistics of all nodes to `rpc_stats.json` in the
+test's tmpdir (and to `--rpcstatsfile` if given), which `test_runner.py
+--rpcstats` aggregates into a suite-wide report.
+"""
+
+import json
+import threading
+import unittest
+
+# Upper bounds (in milliseconds) of the latency histogram buckets. The last
+# bucket catches everything slower than the last bound.
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def new_method_stats():
+    return {
+        "count": 0,
+        "errors": 0,
+        "time": 0.0,
+        "max_time": 0.0,
+        "request_bytes": 0,
+        "response_bytes": 0,
+        "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    }
+
+
+def bucket_index(elapsed):
+    """Return the histogram bucket for a latency given in seconds."""
+    elapsed_ms = elapsed * 1000
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def merge_method_stats(into, other):
+    """Add the method statistics `other` to `into` in place."""
+    for key in ("count", "errors", "request_bytes", "response_bytes"):
+        into[key] += other[key]
+    into["time"] += other["time"]
+    into["max_time"] = max(into["max_time"], other["max_time"])
+    into["histogram"] = [a + b for a, b in zip(into["histogram"], other["histogram"])]
+
+
+def histogram_percentile(histogram, q):
+    """Return an upper bound (in seconds) for the q-th quantile (0 < q <= 1) of a latency histogram.
+
+    Returns None for an empty histogram, and infinity if the quantile falls
+    into the overflow bucket."""
+    total = sum(histogram)
+    if total == 0:
+        return None
+    target = q * total
+    seen = 0
+    for i, n in enumerate(histogram):
+        seen += n
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[i] / 1000 if i < len(LATENCY_BUCKETS_MS) else float("inf")
+    return float("inf")
+
+
+class RPCStats:
+    """Thread-safe recorder of per-method RPC statistics for one node."""
+
+    def __init__(self):
+        self.methods = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, elapsed, *, request_bytes=0, response_bytes=0, error=False):
+        with self.lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = new_method_stats()
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            stats["request_bytes"] += request_bytes
+            stats["response_bytes"] += response_bytes
+            stats["histogram"][bucket_index(elapsed)] += 1
+
+    def total_time(self):
+        with self.lock:
+            return sum(s["time"] for s in self.methods.values())
+
+    def to_dict(self):
+        with self.lock:
+            return {method: dict(stats, histogram=list(stats["histogram"])) for method, stats in self.methods.items()}
+
+
+def write_stats(filename, nodes_stats):
+    """Write the statistics of all nodes of a test, given as {node index: RPCStats}, to a JSON file."""
+    with open(filename, "w", encoding="utf8") as f:
+        json.dump({
+            "buckets_ms": LATENCY_BUCKETS_MS,
+            "nodes": {str(i): stats.to_dict() for i, stats in nodes_stats.items()},
+        }, f, indent=1)
+
+
+def read_stats(filename):
+    """Read a file written by write_stats() and return {node index: {method: stats}}."""
+    with open(filename, encoding="utf8") as f:
+        data = json.load(f)
+    if data.get("buckets_ms") != LATENCY_BUCKETS_MS:
+        raise ValueError(f"{filename} was written with different histogram buckets")
+    return data["nodes"]
+
+
+class TestFrameworkRPCStats(unittest.TestCase):
+    def test_bucket_index(self):
+        self.assertEqual(bucket_index(0), 0)
+        self.assertEqual(bucket_index(0.0001), 0)
+        self.assertEqual(bucket_index(0.0003), 2)
+        self.assertEqual(bucket_index(0.003), 5)
+        self.assertEqual(bucket_index(20), len(LATENCY_BUCKETS_MS))
+
+    def test_record_and_merge(self):
+        stats = RPCStats()
+        stats.record("getblockcount", 0.002, request_bytes=60, response_bytes=40)
+        stats.record("getblockcount", 0.004, request_bytes=60, response_bytes=40, error=True)
+        stats.record("stop", 0.3)
+        methods = stats.to_dict()
+        self.assertEqual(methods["getblockcount"]["count"], 2)
+        self.assertEqual(methods["getblockcount"]["errors"], 1)
+        self.assertEqual(methods["getblockcount"]["request_bytes"], 120)
+        self.assertAlmostEqual(methods["getblockcount"]["max_time"], 0.004)
+        self.assertAlmostEqual(stats.total_time(), 0.306)
+
+        merged = new_method_stats()
+        merge_method_stats(merged, methods["getblockcount"])
+        merge_method_stats(merged, methods["stop"])
+        self.assertEqual(merged["count"], 3)
+        self.assertEqual(sum(merged["histogram"]), 3)
+        self.assertAlmostEqual(merged["max_time"], 0.3)
+
+    def test_histogram_percentile(self):
+        self.assertIsNone(histogram_percentile(new_method_stats()["histogram"], 0.5))
+        histogram = new_method_stats()["histogram"]
+        histogram[3] = 9  # <= 1ms
+        histogram[9] = 1  # <= 100ms
+        self.assertEqual(histogram_percentile(histogram, 0.5), 0.001)
+        self.assertEqual(histogram_percentile(histogram, 0.95), 0.1)
+        histogram[-1] = 10
+        self.assertEqual(histogram_percentile(histogram, 1), float("inf"))
@@ -5,6 +5,7 @@
 """Base class for RPC testing."""
 
 import configparser
+from concurrent import futures
 from enum import Enum
 import argparse
 from datetime import datetime, timezone
@@ -23,7 +24,16 @@ import tempfile
 import time
 
 from .address import create_deterministic_address_bcrt1_p2tr_op_true
+from .chain_fixture import (
+    CACHE_HEIGHT,
+    FIXTURE_WALLET_PREFIX,
+    assign_fixture_wallet,
+    fixture_lock,
+)
 from . import coverage
+from . import resource_usage
+from . import rpc_stats
+from .datadir_copy import CacheCopier, copy_datadir
 from .messages import CAddress
 from .p2p import NetworkThread
 from .test_node import TestNode
@@ -31,6 +41,7 @@ from .util import (
     Binaries,
     MAX_NODES,
     PortSeed,
+    append_config,
     assert_equal,
     check_json_precision,
     export_env_build_path,
@@ -56,6 +67,12 @@ TEST_EXIT_SKIPPED = 77
 
 TMPDIR_PREFIX = "bitcoin_func_test_"
 
+# Maximum number of nodes waited for (to start up or to stop) concurrently
+MAX_PARALLEL_NODE_OPERATIONS = 8
+
+# Shortest interval between two polls of sync_mempools(), used while the mempools are still changing
+SYNC_MIN_POLL_INTERVAL = 0.05
+
 
 class SkipTest(Exception):
     """This exception is raised to skip a test"""
@@ -104,6 +121,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """Sets test framework defaults. Do not override this method. Instead, override the set_test_params() method"""
         self.chain: str = 'regtest'
         self.setup_clean_chain: bool = False
+        # Optional ChainFixture describing the chain state the nodes start
+        # from, instead of the 199-block cache. See chain_fixture.py.
+        self.chain_fixture = None
         self.noban_tx_relay: bool = False
         self.nodes: list[TestNode] = []
         self.extra_args = None
@@ -130,6 +150,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.disable_autoconnect = True
         self.set_test_params()
         assert self.wallet_names is None or len(self.wallet_names) <= self.num_nodes
+        assert self.chain_fixture is None or not self.setup_clean_chain, "A chain fixture can not be used with a clean chain"
+        assert self.chain_fixture is None or not self.chain_fixture.wallets or self.wallet_names is None, "Chain fixture wallets require the default wallet names"
         self.rpc_timeout = int(self.rpc_timeout * self.options.timeout_factor) # optionally, increase timeout by a factor
 
     def main(self):
@@ -185,6 +207,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="Force test of previous releases (default: %(default)s). Previous releases binaries can be downloaded via `test/get_previous_releases.py`.")
         parser.add_argument("--coveragedir", dest="coveragedir",
                             help="Write tested RPC commands into this directory")
+        parser.add_argument("--rpcstatsfile", dest="rpcstatsfile",
+                            help="Also write per-node, per-method RPC statistics (normally written to rpc_stats.json in the test directory) to this file")
+        parser.add_argument("--resourceusagefile", dest="resourceusagefile",
+                            help="Write the resource usage (peak RSS, CPU time, I/O) of the test process and of each node to this file")
         parser.add_argument("--configfile", dest="configfile",
                             default=os.path.abspath(os.path.dirname(test_file) + "/../config.ini"),
                             help="Location of the test framework config file (default: %(default)s)")
@@ -289,6 +315,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             if self.nodes:
                 self.stop_nodes()
 
+        self._write_rpc_stats()
+        if self.options.resourceusagefile:
+            self._write_resource_usage()
+
         should_clean_up = (
             not self.options.nocleanup and
             self.success != TestStatus.FAILED
@@ -382,8 +412,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         if self.uses_wallet:
             self.import_deterministic_coinbase_privkeys()
         if not self.setup_clean_chain:
+            chain_height = CACHE_HEIGHT if self.chain_fixture is None else self.chain_fixture.height
             for n in self.nodes:
-                assert_equal(n.getblockchaininfo()["blocks"], 199)
+                assert_equal(n.getblockchaininfo()["blocks"], chain_height)
             # To ensure that all nodes are out of IBD, the most recent block
             # must have a timestamp not too old (see IsInitialBlockDownload()).
             self.log.debug('Generate a block with current time')
@@ -392,7 +423,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             for n in self.nodes:
                 n.submitblock(block)
                 chain_info = n.getblockchaininfo()
-                assert_equal(chain_info["blocks"], 200)
+                assert_equal(chain_info["blocks"], chain_height + 1)
                 assert_equal(chain_info["initialblockdownload"], False)
 
     def import_deterministic_coinbase_privkeys(self):
@@ -400,6 +431,9 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.init_wallet(node=i)
 
     def init_wallet(self, *, node):
+        if self.chain_fixture is not None and node < self.chain_fixture.wallets:
+            # Created by the chain fixture and loaded on startup
+            return
         wallet_name = self.default_wallet_name if self.wallet_names is None else self.wallet_names[node] if node < len(self.wallet_names) else False
         if wallet_name is not False:
             n = self.nodes[node]
@@ -502,18 +536,23 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             coverage.write_all_rpc_commands(self.options.coveragedir, node._rpc)
 
     def start_nodes(self, extra_args=None, *args, **kwargs):
-        """Start multiple bitcoinds"""
+        """Start multiple bitcoinds concurrently"""
 
         if extra_args is None:
             extra_args = [None] * self.num_nodes
         assert_equal(len(extra_args), self.num_nodes)
-        for i, node in enumerate(self.nodes):
-            node.start(extra_args[i], *args, **kwargs)
-        for node in self.nodes:
-            node.wait_for_rpc_connection()
+        self._start_nodes(self.nodes, extra_args, *args, **kwargs)
+
+    def _start_nodes(self, nodes, extra_args, *args, **kwargs):
+        # Launching a process is quick, so all nodes are launched first. Only the
+        # waits for their RPC interfaces run on the bounded thread pool, so nodes
+        # beyond MAX_PARALLEL_NODE_OPERATIONS still start up concurrently.
+        for node, node_extra_args in zip(nodes, extra_args):
+            node.start(node_extra_args, *args, **kwargs)
+        self.run_node_operations(lambda _, node: node.wait_for_rpc_connection(), nodes)
 
         if self.options.coveragedir is not None:
-            for node in self.nodes:
+            for node in nodes:
                 coverage.write_all_rpc_commands(self.options.coveragedir, node._rpc)
 
     def stop_node(self, i, expected_stderr='', wait=0):
@@ -521,14 +560,29 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.nodes[i].stop_node(expected_stderr, wait=wait)
 
     def stop_nodes(self, wait=0):
-        """Stop multiple bitcoind test nodes"""
-        for node in self.nodes:
-            # Issue RPC to stop nodes
-            node.stop_node(wait=wait, wait_until_stopped=False)
-
-        for node in self.nodes:
-            # Wait for nodes to stop
-            node.wait_until_stopped()
+        """Stop multiple bitcoind test nodes concurrently"""
+        self.run_node_operations(lambda _, node: node.stop_node(wait=wait), self.nodes)
+
+    def run_node_operations(self, operation, nodes):
+        """Call operation(i, node) for each of the given nodes and its position
+        i in the list, concurrently on a bounded thread pool.
+
+        All operations run to completion, even if some of them fail. A single
+        failure is re-raised unchanged. If several nodes failed, all failures
+        are logged and the one of the first failing node is raised."""
+        nodes = list(nodes)
+        if len(nodes) <= 1:
+            for i, node in enumerate(nodes):
+                operation(i, node)
+            return
+        with futures.ThreadPoolExecutor(max_workers=min(len(nodes), MAX_PARALLEL_NODE_OPERATIONS), thread_name_prefix="nodeop") as executor:
+            results = [(node, executor.submit(operation, i, node)) for i, node in enumerate(nodes)]
+        errors = [(node, fut.exception()) for node, fut in results if fut.exception() is not None]
+        if len(errors) > 1:
+            for node, e in errors:
+                self.log.error(f"Operation on node {node.index} failed ({len(errors)} nodes failed in total)", exc_info=e)
+        if errors:
+            raise errors[0][1]
 
     def cleanup_partially_started_nodes(self):
         """Tear down nodes left running after a failed start_nodes().
@@ -562,6 +616,19 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         else:
             self.start_node(i, extra_args)
 
+    def restart_nodes(self, indices=None, extra_args=None, *, expected_stderr=''):
+        """Stop and start multiple test nodes (all by default) concurrently.
+        extra_args holds the arguments of each restarted node, in the order of indices."""
+        if indices is None:
+            indices = range(self.num_nodes)
+        nodes = [self.nodes[i] for i in indices]
+        if extra_args is None:
+            extra_args = [None] * len(nodes)
+        assert_equal(len(extra_args), len(nodes))
+
+        self.run_node_operations(lambda _, node: node.stop_node(expected_stderr), nodes)
+        self._start_nodes(nodes, extra_args)
+
     def wait_for_node_exit(self, i, timeout):
         self.nodes[i].process.wait(timeout)
 
@@ -677,6 +744,13 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         sync_fun() if sync_fun else self.sync_all()
         return blocks
 
+    def generate_offline(self, generator, *args, sync_fun=None, **kwargs):
+        """Mine empty blocks like generate(), but create them in Python and
+        submit them in batches. Meant for tests that need long chains."""
+        blocks = generator.generate_offline(*args, called_by_framework=True, **kwargs)
+        sync_fun() if sync_fun else self.sync_all()
+        return blocks
+
     def create_outpoints(self, node, *, outputs):
         """Send funds to a given list of `{address: amount}` targets using the bitcoind
         wallet and return the corresponding outpoints as a list of dictionaries
@@ -700,6 +774,12 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         sync_blocks needs to be called with an rpc_connections set that has least
         one node already synced to the latest, stable tip, otherwise there's a
         chance it might return before all nodes are stably synced.
+
+        Instead of sleeping between polls, the node with the least work is
+        long-polled with waitfornewblock for up to `wait` seconds, so the call
+        returns as soon as its tip changes. Nodes of previous releases without
+        the current_tip argument of waitfornewblock are polled every `wait`
+        seconds instead.
         """
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
@@ -710,7 +790,16 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 return
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            # A node with less work than the others has to move to a new tip.
+            # If all tips have the same work, any of them has to move.
+            chainwork = [int(x.getblockheader(h)["chainwork"], 16) for x, h in zip(rpc_connections, best_hash)]
+            lagging = chainwork.index(min(chainwork))
+            if not rpc_connections[lagging].version_is_at_least(300000):
+                time.sleep(wait)
+                continue
+            wait_ms = max(1, int(min(wait, stop_time - time.time()) * 1000))
+            # Returns right away if the tip already changed since getbestblockhash
+            rpc_connections[lagging].waitfornewblock(timeout=wait_ms, current_tip=best_hash[lagging])
         raise AssertionError("Block sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(b) for b in best_hash),
@@ -720,12 +809,21 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """
         Wait until everybody has the same transactions in their memory
         pools
+
+        The mempools are polled again quickly while any mempool sequence
+        number changes, backing off to one poll every `wait` seconds while
+        none of them does. For nodes of previous releases without mempool
+        sequence numbers, a change of their mempool counts instead.
         """
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
+        sequences = None
+        interval = SYNC_MIN_POLL_INTERVAL
         while time.time() <= stop_time:
-            pool = [set(r.getrawmempool()) for r in rpc_connections]
+            mempools = [r.getrawmempool(mempool_sequence=True) if r.version_is_at_least(210000) else r.getrawmempool()
+                        for r in rpc_connections]
+            pool = [set(m["txids"]) if isinstance(m, dict) else set(m) for m in mempools]
             if pool.count(pool[0]) == len(rpc_connections):
                 if flush_scheduler:
                     for r in rpc_connections:
@@ -733,7 +831,13 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 return
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            new_sequences = [m["mempool_sequence"] if isinstance(m, dict) else p for m, p in zip(mempools, pool)]
+            if new_sequences != sequences:
+                interval = SYNC_MIN_POLL_INTERVAL
+            else:
+                interval = min(interval * 2, max(wait, SYNC_MIN_POLL_INTERVAL))
+            sequences = new_sequences
+            time.sleep(interval)
         raise AssertionError("Mempool sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(m) for m in pool),
@@ -902,6 +1006,28 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             rpc_handler.setLevel(logging.DEBUG)
             rpc_logger.addHandler(rpc_handler)
 
+    def _write_rpc_stats(self):
+        """Write the RPC statistics of all nodes to the test directory and, if requested, to --rpcstatsfile."""
+        nodes_stats = {node.index: node.rpc_stats for node in self.nodes}
+        filenames = [os.path.join(self.options.tmpdir, "rpc_stats.json")]
+        if self.options.rpcstatsfile:
+            filenames.append(self.options.rpcstatsfile)
+        for filename in filenames:
+            try:
+                rpc_stats.write_stats(filename, nodes_stats)
+            except OSError as e:
+                self.log.warning(f"Could not write RPC statistics to {filename}: {e}")
+
+    def _write_resource_usage(self):
+        """Write the resource usage of the test process and of all nodes, and
+        the size of the test directory to --resourceusagefile."""
+        nodes_usage = {node.index: node.resource_usage for node in self.nodes}
+        try:
+            disk_usage = resource_usage.directory_size(self.options.tmpdir)
+            resource_usage.write_usage(self.options.resourceusagefile, resource_usage.self_usage(), nodes_usage, disk_usage)
+        except OSError as e:
+            self.log.warning(f"Could not write resource usage to {self.options.resourceusagefile}: {e}")
+
     def _initialize_chain(self):
         """Initialize a pre-mined blockchain for use by the test.
 
@@ -916,26 +1042,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.log.debug("Creating cache directory {}".format(cache_node_dir))
 
             initialize_datadir(self.options.cachedir, CACHE_NODE_ID, self.chain, self.disable_autoconnect)
-            self.nodes.append(
-                TestNode(
-                    CACHE_NODE_ID,
-                    cache_node_dir,
-                    chain=self.chain,
-                    extra_conf=["bind=127.0.0.1"],
-                    extra_args=[],
-                    rpchost=None,
-                    timewait=self.rpc_timeout,
-                    timeout_factor=self.options.timeout_factor,
-                    binaries=self.get_binaries(),
-                    coverage_dir=None,
-                    cwd=self.options.tmpdir,
-                    uses_wallet=self.uses_wallet,
-                ))
-            self.start_node(CACHE_NODE_ID)
-            cache_node = self.nodes[CACHE_NODE_ID]
-
-            # Wait for RPC connections to be ready
-            cache_node.wait_for_rpc_connection()
+            cache_node = self._start_cache_node(cache_node_dir, uses_wallet=self.uses_wallet)
 
             # Set a time in the past, so that blocks don't end up in the future
             cache_node.setmocktime(cache_node.getblockheader(cache_node.getbestblockhash())['time'])
@@ -969,11 +1076,99 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 if entry not in ['chainstate', 'blocks', 'indexes']:  # Only indexes, chainstate and blocks folders
                     os.remove(cache_path(entry))
 
+        fixture = self.chain_fixture
+        if fixture is not None and fixture.is_base_cache():
+            fixture = None
+        source_dir = cache_node_dir if fixture is None else self._get_chain_fixture(cache_node_dir)
+
+        copier = CacheCopier()
         for i in range(self.num_nodes):
-            self.log.debug("Copy cache directory {} to node {}".format(cache_node_dir, i))
+            self.log.debug("Copy cache directory {} to node {}".format(source_dir, i))
             to_dir = get_datadir_path(self.options.tmpdir, i)
-            shutil.copytree(cache_node_dir, to_dir)
+            copy_datadir(source_dir, to_dir, copier)
             initialize_datadir(self.options.tmpdir, i, self.chain, self.disable_autoconnect)  # Overwrite port/rpcport in bitcoin.conf
+            if fixture is not None:
+                append_config(to_dir, fixture.config_lines())
+                assign_fixture_wallet(to_dir, self.chain, i, self.default_wallet_name)
+        self.log.debug(f"Provisioned {self.num_nodes} node(s) from the cache ({copier.summary()})")
+
+    def _start_cache_node(self, datadir, *, extra_args=None, uses_wallet=False):
+        """Start a node on datadir to build a cache. It uses the ports of node 0."""
+        assert not self.nodes
+        self.nodes.append(
+            TestNode(
+                0,
+                datadir,
+                chain=self.chain,
+                extra_conf=["bind=127.0.0.1"],
+                extra_args=extra_args or [],
+                rpchost=None,
+                timewait=self.rpc_timeout,
+                timeout_factor=self.options.timeout_factor,
+                binaries=self.get_binaries(),
+                coverage_dir=None,
+                cwd=self.options.tmpdir,
+                uses_wallet=uses_wallet,
+            ))
+        self.start_node(0)
+        cache_node = self.nodes[0]
+
+        # Wait for RPC connections to be ready
+        cache_node.wait_for_rpc_connection()
+        return cache_node
+
+    def _get_chain_fixture(self, cache_node_dir):
+        """Return the datadir of self.chain_fixture in the cache directory, building it first if needed."""
+        fixture_dir = os.path.join(self.options.cachedir, self.chain_fixture.name())
+        fixture_node_dir = get_datadir_path(fixture_dir, 0)
+        # Other tests of the run may be building the same fixture
+        with fixture_lock(fixture_dir + ".lock"):
+            if not os.path.isdir(fixture_node_dir):
+                self._build_chain_fixture(cache_node_dir, fixture_dir)
+        return fixture_node_dir
+
+    def _build_chain_fixture(self, cache_node_dir, fixture_dir):
+        """Build self.chain_fixture in fixture_dir, starting from a copy of the base cache."""
+        fixture = self.chain_fixture
+        self.log.debug(f"Creating chain fixture {fixture_dir}")
+        build_dir = f"{fixture_dir}.build{os.getpid()}"
+        build_node_dir = get_datadir_path(build_dir, 0)
+        copy_datadir(cache_node_dir, build_node_dir)
+        initialize_datadir(build_dir, 0, self.chain, self.disable_autoconnect)
+        append_config(build_node_dir, fixture.config_lines())
+        node = self._start_cache_node(build_node_dir, uses_wallet=fixture.wallets > 0)
+
+        # Mine the blocks above the base cache to the default MiniWallet address
+        miniwallet_address = create_deterministic_address_bcrt1_p2tr_op_true()[0]
+        self.generatetoaddress(node, nblocks=fixture.height - CACHE_HEIGHT, address=miniwallet_address)
+        assert_equal(node.getblockchaininfo()["blocks"], fixture.height)
+        if fixture.indexes():
+            self.wait_until(lambda: all(index["synced"] for index in node.getindexinfo().values()))
+
+        for i in range(fixture.wallets):
+            wallet_name = f"{FIXTURE_WALLET_PREFIX}{i}"
+            node.createwallet(wallet_name=wallet_name)
+            wallet_importprivkey(node.get_wallet_rpc(wallet_name), TestNode.PRIV_KEYS[i].key, 0, label="coinbase")
+
+        self.stop_nodes()
+        self.nodes = []
+
+        # Like the base cache, only keep the chain data, the indexes and the wallets
+        chain_dir = os.path.join(build_node_dir, self.chain)
+        for entry in os.listdir(chain_dir):
+            path = os.path.join(chain_dir, entry)
+            if entry == "wallets" and not fixture.wallets:
+                shutil.rmtree(path)
+            elif entry not in ['chainstate', 'blocks', 'indexes', 'wallets']:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        try:
+            os.rename(build_dir, fixture_dir)
+        except OSError:
+            # Built concurrently by another test without file locking
+            shutil.rmtree(build_dir)
 
     def _initialize_chain_clean(self):
         """Initialize empty blockchain for use by the test.
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Local history of functional test runs, used by test_runner.py for scheduling.
+
+For every test, including each argument variant such as
+"wallet_basic.py --descriptors", the history keeps an exponentially weighted
+moving average of its duration. test_runner.py starts the tests with the
+longest expected duration first (LPT scheduling), so that a slow test does not
+start late and extend the total runtime, and uses the history to estimate when
+the run will finish. The peak memory usage of each test is kept as well, so
+that `--adaptive` runs can avoid starting memory-heavy tests concurrently, and
+the size of its test directory, so that `--ramdisk` runs keep tests that need
+a lot of space on disk.
+"""
+
+from collections import deque
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+import unittest
+
+# Weight of the most recent run in the moving averages
+EWMA_ALPHA = 0.3
+HISTORY_VERSION = 1
+
+
+def ewma(previous, value):
+    return value if previous is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+
+class TestHistory:
+    """Per-test statistics of previous runs, persisted as JSON."""
+
+    def __init__(self, path=None, *, read_only=False):
+        self.path = path
+        # Whether save() must leave the file untouched, e.g. because several shards read it
+        self.read_only = read_only
+        self.tests = {}
+        if path is not None:
+            self.load()
+
+    def load(self):
+        """Load the history from self.path. A missing or unreadable file results in an empty history."""
+        try:
+            with open(self.path, encoding="utf8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == HISTORY_VERSION:
+            self.tests = data.get("tests", {})
+
+    def save(self):
+        """Write the history to self.path, replacing the previous file atomically.
+        Does nothing for a read-only history."""
+        if self.read_only:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", encoding="utf8", dir=dirname, prefix=".test_history", delete=False) as f:
+            json.dump({"version": HISTORY_VERSION, "tests": self.tests}, f, indent=1, sort_keys=True)
+        os.replace(f.name, self.path)
+
+    def record(self, test, status, duration, max_rss=None, disk_usage=None):
+        """Record a finished test run, optionally with the peak RSS (in bytes) of
+        the test process and its nodes combined and the final size of its test
+        directory (in bytes). Failed runs may have been cut short and are ignored."""
+        if status == "Failed":
+            return
+        entry = self.tests.setdefault(test, {"runs": 0})
+        entry["runs"] += 1
+        entry["duration"] = ewma(entry.get("duration"), duration)
+        if max_rss is not None:
+            entry["max_rss"] = ewma(entry.get("max_rss"), max_rss)
+        if disk_usage is not None:
+            entry["disk_usage"] = ewma(entry.get("disk_usage"), disk_usage)
+
+    def expected_duration(self, test):
+        """Return the expected duration of a test in seconds, or None if it never ran."""
+        entry = self.tests.get(test)
+        return None if entry is None else entry.get("duration")
+
+    def expected_max_rss(self, test):
+        """Return the expected peak RSS of a test in bytes, or None if unknown."""
+        entry = self.tests.get(test)
+        return None if entry is None else entry.get("max_rss")
+
+    def expected_disk_usage(self, test):
+        """Return the expected size of the test directory of a test in bytes, or None if unknown."""
+        entry = self.tests.get(test)
+        return None if entry is None else entry.get("disk_usage")
+
+    def schedule(self, test_list):
+        """Return test_list ordered by expected duration, longest first.
+
+        Tests without history go first, as their duration is unknown. The
+        original order is kept among tests with equal expectations."""
+        def key(test):
+            duration = self.expected_duration(test)
+            return (0, 0) if duration is None else (1, -duration)
+        return deque(sorted(test_list, key=key))
+
+    def shard(self, test_list, index, count):
+        """Return the tests of test_list that belong to shard index (0-based) of count shards.
+
+        Tests with a recorded duration are distributed longest first, each to
+        the shard with the lowest total expected duration so far, which
+        balances the shards. Tests without history are assigned by a hash of
+        their name, so that adding a new test does not move any other test to
+        a different shard. The result only depends on test_list and the
+        history, so all shards must read the same history file, and none of
+        them may update it (see read_only)."""
+        assert 0 <= index < count
+        known = sorted({test for test in test_list if self.expected_duration(test) is not None},
+                       key=lambda test: (-self.expected_duration(test), test))
+        totals = [(0, i) for i in range(count)]
+        assignment = {}
+        for test in known:
+            total, i = heapq.heappop(totals)
+            assignment[test] = i
+            heapq.heappush(totals, (total + self.expected_duration(test), i))
+        for test in test_list:
+            if test not in assignment:
+                assignment[test] = int.from_bytes(hashlib.sha256(test.encode("utf8")).digest()[:8], "big") % count
+        return deque(test for test in test_list if assignment[test] == index)
+
+    def estimate_remaining(self, running, queued, num_jobs):
+        """Estimate the seconds until all tests are done.
+
+        running is a list of (test, elapsed seconds) of the started tests and
+        queued the list of tests not started yet, in the order they will be
+        started on num_jobs parallel slots. Tests without history are assumed
+        to take as long as the median known test. Returns None if there is no
+        history at all."""
+        known = sorted(entry["duration"] for entry in self.tests.values() if "duration" in entry)
+        if not known:
+            return None
+        fallback = known[len(known) // 2]
+
+        def expected(test):
+            duration = self.expected_duration(test)
+            return fallback if duration is None else duration
+
+        # Simulate the remaining run: every slot becomes free once its current
+        # test is expected to end, then takes the next queued test.
+        slots = [max(expected(test) - elapsed, 0) for test, elapsed in running]
+        slots += [0] * max(num_jobs - len(slots), 0)
+        heapq.heapify(slots)
+        for test in queued:
+            heapq.heappush(slots, heapq.heappop(slots) + expected(test))
+        return max(slots, default=0)
+
+
+class TestFrameworkTestHistory(unittest.TestCase):
+    def test_record(self):
+        history = TestHistory()
+        history.record("a.py", "Passed", 10)
+        self.assertEqual(history.expected_duration("a.py"), 10)
+        history.record("a.py", "Passed", 20)
+        self.assertAlmostEqual(history.expected_duration("a.py"), 13)
+        history.record("a.py", "Failed", 1000)
+        self.assertAlmostEqual(history.expected_duration("a.py"), 13)
+        self.assertIsNone(history.expected_duration("a.py --variant"))
+        self.assertIsNone(history.expected_max_rss("a.py"))
+        history.record("a.py", "Passed", 10, max_rss=1000)
+        self.assertEqual(history.expected_max_rss("a.py"), 1000)
+        self.assertIsNone(history.expected_disk_usage("a.py"))
+        history.record("a.py", "Passed", 10, disk_usage=5000)
+        self.assertEqual(history.expected_disk_usage("a.py"), 5000)
+
+    def test_schedule(self):
+        history = TestHistory()
+        for test, duration in [("short.py", 1), ("long.py", 100), ("medium.py", 10), ("medium2.py", 10)]:
+            history.record(test, "Passed", duration)
+        order = ["short.py", "medium.py", "new.py", "long.py", "medium2.py"]
+        self.assertEqual(list(history.schedule(order)), ["new.py", "long.py", "medium.py", "medium2.py", "short.py"])
+
+    def test_shard(self):
+        history = TestHistory()
+        for test, duration in [("a.py", 10), ("b.py", 6), ("c.py", 5), ("d.py", 1), ("e.py --variant", 1)]:
+            history.record(test, "Passed", duration)
+        tests = ["e.py --variant", "d.py", "c.py", "b.py", "a.py"]
+        shards = [list(history.shard(tests, i, 2)) for i in range(2)]
+        # Longest first to the least loaded shard (10 + 1 + 1 vs 6 + 5), the list order is kept
+        self.assertEqual(shards, [["e.py --variant", "d.py", "a.py"], ["c.py", "b.py"]])
+        # New tests without history do not move any other test
+        new_tests = [f"new_{i}.py" for i in range(20)]
+        new_shards = [list(history.shard(tests + new_tests, i, 2)) for i in range(2)]
+        for old, new in zip(shards, new_shards):
+            self.assertEqual([test for test in new if test in tests], old)
+        self.assertEqual(sorted(new_shards[0] + new_shards[1]), sorted(tests + new_tests))
+        self.assertTrue(all(new_shards))
+
+    def test_estimate_remaining(self):
+        history = TestHistory()
+        self.assertIsNone(history.estimate_remaining([], ["a.py"], 2))
+        for test, duration in [("a.py", 10), ("b.py", 6), ("c.py", 4), ("d.py", 2)]:
+            history.record(test, "Passed", duration)
+        # One slot busy with a.py for 4 more seconds, the other one takes b.py,
+        # then c.py goes to the first slot and d.py to the second one.
+        self.assertEqual(history.estimate_remaining([("a.py", 6)], ["b.py", "c.py", "d.py"], 2), 8)
+        # Unknown tests count as the median known duration
+        self.assertEqual(history.estimate_remaining([], ["x.py"], 4), 6)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "history.json")
+            history = TestHistory(path)
+            history.record("a.py", "Skipped", 1)
+            history.save()
+            self.assertEqual(TestHistory(path).expected_duration("a.py"), 1)
+            read_only = TestHistory(path, read_only=True)
+            read_only.record("a.py", "Passed", 100)
+            read_only.save()
+            self.assertEqual(TestHistory(path).expected_duration("a.py"), 1)
+            with open(path, "w", encoding="utf8") as f:
+                f.write("garbage")
+            self.assertEqual(TestHistory(path).tests, {})
@@ -28,8 +28,13 @@ from .authproxy import (
     serialization_fallback,
 )
 from . import coverage
+from .address import address_to_scriptpubkey
+from .blocktools import create_chain, submit_blocks
+from .log_follower import DebugLogFollower, make_waiter
 from .messages import NODE_P2P_V2
 from .p2p import P2P_SERVICES, P2P_SUBVERSION
+from .resource_usage import merge_usage, new_usage, poll_process
+from .rpc_stats import RPCStats
 from .util import (
     MAX_NODES,
     assert_equal,
@@ -44,6 +49,10 @@ from .util import (
 )
 
 BITCOIND_PROC_WAIT_TIMEOUT = 60
+# Logged right after the RPC server leaves warmup
+INIT_DONE_LOG_MSG = b"init message: Done loading"
+# Logged after the mempool was loaded from disk (named "loadblk" before v25)
+IMPORT_DONE_LOG_MSGS = [b"initload thread exit", b"loadblk thread exit"]
 # The size of the blocks xor key
 # from InitBlocksdirXorKey::xor_key.size()
 NUM_XOR_BYTES = 8
@@ -191,12 +200,18 @@ class TestNode():
         self._rpc = None # Should usually not be accessed directly in tests to allow for --usecli mode
         self.reuse_http_connections = True # Must be set before create_new_rpc_connection(), i.e. before restarting node
         self.url = None
+        self.rpc_stats = RPCStats()  # Kept across restarts, written out by the framework on shutdown
+        self.resource_usage = new_usage()  # Accumulated over all bitcoind processes that exited
         self.log = logging.getLogger('TestFramework.node%d' % i)
 
         self.p2ps = []
 
         self.mocktime = None
 
+        self._debug_log_follower = None
+        # Log watches registered by start() to detect when the node is ready
+        self._startup_watches = []
+
     AddressKeyPair = collections.namedtuple('AddressKeyPair', ['address', 'key'])
     PRIV_KEYS = [
             # address , privkey
@@ -313,6 +328,13 @@ class TestNode():
         if env is not None:
             subp_env.update(env)
 
+        # Register before launching, so that no startup log line can be missed
+        self._close_startup_watches()
+        self._startup_watches = [
+            self.debug_log_follower.watch([INIT_DONE_LOG_MSG], keep_log=False),
+            self.debug_log_follower.watch(IMPORT_DONE_LOG_MSGS, keep_log=False),
+        ]
+
         self.process = subprocess.Popen(self.args + extra_args, env=subp_env, stdout=stdout, stderr=stderr, cwd=cwd, **kwargs)
 
         self.running = True
@@ -337,7 +359,7 @@ class TestNode():
             url = f"http://{rpc_u}:{rpc_p}@{host}:{port}"
             proxy = AuthServiceProxy(url, timeout=int(client_timeout))
             coverage_logfile = coverage.get_filename(self.coverage_dir, self.index) if self.coverage_dir else None
-            rpc = coverage.AuthServiceProxyWrapper(proxy, url, coverage_logfile)
+            rpc = coverage.AuthServiceProxyWrapper(proxy, url, coverage_logfile, self.rpc_stats)
             rpc.auth_service_proxy_instance.reuse_http_connections = self.reuse_http_connections
             return rpc
         else:  # mode==CLI
@@ -349,9 +371,16 @@ class TestNode():
             )
 
     def wait_for_rpc_connection(self, *, wait_for_import=True):
-        """Sets up an RPC connection to the bitcoind process. Returns False if unable to connect."""
+        """Sets up an RPC connection to the bitcoind process. Returns False if unable to connect.
+
+        Instead of blindly sleeping between connection attempts, this waits
+        for the log line written when the RPC server leaves warmup (and for
+        the one written once the mempool is loaded), so that it returns as
+        soon as the node is ready. Polling remains as a fallback, e.g. for
+        nodes not writing to the default debug.log."""
         # Poll at a rate of four times per second
         poll_per_s = 4
+        init_watch, import_watch = self._startup_watches or (None, None)
 
         suppressed_errors = collections.defaultdict(int)
         latest_error = None
@@ -361,6 +390,7 @@ class TestNode():
 
         for _ in range(poll_per_s * self.rpc_timeout):
             if self.process.poll() is not None:
+                self._close_startup_watches()
                 # Attach abrupt shutdown error/s to the exception message
                 self.stderr.seek(0)
                 str_error = ''.join(line.decode('utf-8') for line in self.stderr)
@@ -375,7 +405,7 @@ class TestNode():
                 if self.version_is_at_least(190000) and wait_for_import:
                     # getmempoolinfo.loaded is available since commit
                     # bb8ae2c (version 0.19.0)
-                    self.wait_until(lambda: rpc.getmempoolinfo()['loaded'])
+                    self._wait_for_mempool_loaded(rpc, import_watch)
                     # Wait for the node to finish reindex, block import, and
                     # loading the mempool. Usually importing happens fast or
                     # even "immediate" when the node is started. However, there
@@ -393,6 +423,7 @@ class TestNode():
                     # as possible. Some tests might not need this, but the
                     # overhead is trivial, and the added guarantees are worth
                     # the minimal performance cost.
+                self._close_startup_watches()
                 self.log.debug("RPC successfully started")
                 # Set rpc_connected even if we are in use_cli mode so that we know we can call self.stop() if needed.
                 self.rpc_connected = True
@@ -439,24 +470,51 @@ class TestNode():
                 if "No RPC credentials" not in str(e):
                     raise
                 latest_error = suppress_error("missing_credentials", e)
-            time.sleep(1.0 / poll_per_s)
+            if init_watch is None or init_watch.done():
+                time.sleep(1.0 / poll_per_s)
+            else:
+                # Wakes up early once the RPC server left warmup
+                init_watch.wait(1.0 / poll_per_s)
+        self._close_startup_watches()
         self._raise_assertion_error(f"Unable to connect to bitcoind after {self.rpc_timeout}s (ignored errors: {dict(suppressed_errors)!s}{'' if latest_error is None else f', latest: {latest_error[0]!r}/{latest_error[1]}'})")
 
     def wait_for_cookie_credentials(self):
         """Ensures auth cookie credentials can be read, e.g. for testing CLI with -rpcwait before RPC connection is up."""
         self.log.debug("Waiting for cookie credentials")
-        # Poll at a rate of four times per second.
+        # Check at least four times per second, and whenever a file in the
+        # chain directory (such as the .cookie file) is created or modified.
         poll_per_s = 4
-        for _ in range(poll_per_s * self.rpc_timeout):
-            try:
-                get_auth_cookie(self.datadir_path, self.chain)
-                self.log.debug("Cookie credentials successfully retrieved")
-                return
-            except ValueError:  # cookie file not found and no rpcuser or rpcpassword; bitcoind is still starting
-                pass            # so we continue polling until RPC credentials are retrieved
-            time.sleep(1.0 / poll_per_s)
+        waiter = make_waiter(self.chain_path)
+        try:
+            for _ in range(poll_per_s * self.rpc_timeout):
+                try:
+                    get_auth_cookie(self.datadir_path, self.chain)
+                    self.log.debug("Cookie credentials successfully retrieved")
+                    return
+                except ValueError:  # cookie file not found and no rpcuser or rpcpassword; bitcoind is still starting
+                    pass            # so we continue polling until RPC credentials are retrieved
+                waiter.wait(1.0 / poll_per_s)
+        finally:
+            waiter.close()
         self._raise_assertion_error("Unable to retrieve cookie credentials after {}s".format(self.rpc_timeout))
 
+    def _wait_for_mempool_loaded(self, rpc, import_watch):
+        """Wait until getmempoolinfo reports the mempool as loaded, checking
+        again as soon as the node logs the end of the import."""
+        time_end = time.time() + 60 * self.timeout_factor
+        while not rpc.getmempoolinfo()['loaded']:
+            if time.time() >= time_end:
+                self._raise_assertion_error("Mempool was not loaded after {}s".format(60 * self.timeout_factor))
+            if import_watch is None or import_watch.done():
+                time.sleep(0.05)
+            else:
+                import_watch.wait(0.5)
+
+    def _close_startup_watches(self):
+        for watch in self._startup_watches:
+            watch.follower.remove_watch(watch)
+        self._startup_watches = []
+
     def generate(self, nblocks, maxtries=1000000, **kwargs):
         self.log.debug("TestNode.generate() dispatches `generate` call to `generatetoaddress`")
         return self.generatetoaddress(nblocks=nblocks, address=self.get_deterministic_priv_key().address, maxtries=maxtries, **kwargs)
@@ -473,6 +531,16 @@ class TestNode():
         assert called_by_framework, "Direct call of this mining RPC is discouraged. Please use one of the self.generate* methods on the test framework, which sync the nodes to avoid intermittent test issues. You may use sync_fun=self.no_op to disable the sync explicitly."
         return self.__getattr__('generatetodescriptor')(*args, **kwargs)
 
+    def generate_offline(self, nblocks, *, called_by_framework):
+        """Like generate(), but the empty blocks are created and solved in
+        Python and submitted in batches, which is much faster for long chains.
+        Mempool transactions are not included."""
+        assert called_by_framework, "Direct call of this mining method is discouraged. Please use self.generate_offline on the test framework, which syncs the nodes to avoid intermittent test issues. You may use sync_fun=self.no_op to disable the sync explicitly."
+        script_pubkey = address_to_scriptpubkey(self.get_deterministic_priv_key().address)
+        blocks = create_chain(self, nblocks, script_pubkey=script_pubkey)
+        submit_blocks(self, blocks)
+        return [block.hash_hex for block in blocks]
+
     def setmocktime(self, timestamp):
         """Wrapper for setmocktime RPC, sets self.mocktime"""
         if timestamp == 0:
@@ -526,9 +594,11 @@ class TestNode():
         This method is responsible for freeing resources (self.process)."""
         if not self.running:
             return True
-        return_code = self.process.poll()
+        return_code, usage = poll_process(self.process)
         if return_code is None:
             return False
+        if usage is not None:
+            merge_usage(self.resource_usage, usage)
 
         # process has stopped. Assert that it didn't return an error code.
         if not isinstance(expected_ret_code, Iterable):
@@ -546,6 +616,7 @@ class TestNode():
 
         self.stdout.close()
         self.stderr.close()
+        self._close_startup_watches()
 
         self.running = False
         self.process = None
@@ -603,6 +674,16 @@ class TestNode():
     def wallets_path(self) -> Path:
         return self.chain_path / "wallets"
 
+    @property
+    def debug_log_follower(self) -> DebugLogFollower:
+        """The follower shared by assert_debug_log and busy_wait_for_debug_log.
+
+        Re-created if the debug.log path changed, e.g. because a test switched
+        the node to another chain or datadir."""
+        if self._debug_log_follower is None or self._debug_log_follower.path != self.debug_log_path:
+            self._debug_log_follower = DebugLogFollower(self.debug_log_path)
+        return self._debug_log_follower
+
     def debug_log_size(self, **kwargs) -> int:
         with open(self.debug_log_path, **kwargs) as dl:
             dl.seek(0, 2)
@@ -614,66 +695,42 @@ class TestNode():
             unexpected_msgs = []
         assert_equal(type(expected_msgs), list)
         assert_equal(type(unexpected_msgs), list)
-        remaining_expected = list(expected_msgs)
 
         time_end = time.time() + timeout * self.timeout_factor
-        prev_size = self.debug_log_size(encoding="utf-8")  # Must use same encoding that is used to read() below
 
         def join_log(log):
             return " - " + "\n - ".join(log.splitlines())
 
-        yield
+        with self.debug_log_follower.watch(expected_msgs, unexpected_msgs) as watch:
+            yield
+            # The timeout counts from entering the context, like before the yield.
+            watch.wait(max(time_end - time.time(), 0))
 
-        while True:
-            with open(self.debug_log_path, encoding="utf-8", errors="replace") as dl:
-                dl.seek(prev_size)
-                log = dl.read()
-            for unexpected_msg in unexpected_msgs:
-                if unexpected_msg in log:
-                    self._raise_assertion_error(f'Unexpected message "{unexpected_msg}" '
-                                                f'found in log:\n\n{join_log(log)}\n\n')
-            while remaining_expected and remaining_expected[-1] in log:
-                remaining_expected.pop()
-            if not remaining_expected:
-                return
-            if time.time() >= time_end:
-                break
-            time.sleep(0.05)
-        remaining_expected = [e for e in remaining_expected if e not in log]
-        self._raise_assertion_error(f'Expected message(s) {remaining_expected!s} '
-                                    f'not found in log:\n\n{join_log(log)}\n\n')
+        log = watch.log.decode("utf-8", errors="replace")
+        if watch.unexpected_found:
+            self._raise_assertion_error(f'Unexpected message "{watch.unexpected_found[0]}" '
+                                        f'found in log:\n\n{join_log(log)}\n\n')
+        if watch.remaining_expected:
+            self._raise_assertion_error(f'Expected message(s) {watch.remaining_expected!s} '
+                                        f'not found in log:\n\n{join_log(log)}\n\n')
 
     @contextlib.contextmanager
     def busy_wait_for_debug_log(self, expected_msgs, timeout=60):
         """
         Block until we see a particular debug log message fragment or until we exceed the timeout.
+
+        The log is followed with inotify where available, so the message is
+        detected as soon as it is written without spinning on the file.
         """
         time_end = time.time() + timeout * self.timeout_factor
-        prev_size = self.debug_log_size(mode="rb")  # Must use same mode that is used to read() below
-        remaining_expected = list(expected_msgs)
-
-        yield
-
-        while True:
-            with open(self.debug_log_path, "rb") as dl:
-                dl.seek(prev_size)
-                log = dl.read()
-
-            while remaining_expected and remaining_expected[-1] in log:
-                remaining_expected.pop()
-            if not remaining_expected:
-                return
-
-            if time.time() >= time_end:
-                print_log = " - " + "\n - ".join(log.decode("utf8", errors="replace").splitlines())
-                break
-
-            # No sleep here because we want to detect the message fragment as fast as
-            # possible.
+        with self.debug_log_follower.watch(expected_msgs) as watch:
+            yield
+            watch.wait(max(time_end - time.time(), 0))
 
-        remaining_expected = [e for e in remaining_expected if e not in log]
-        self._raise_assertion_error(f'Expected message(s) {remaining_expected!s} '
-                                    f'not found in log:\n\n{print_log}\n\n')
+        if watch.remaining_expected:
+            print_log = " - " + "\n - ".join(watch.log.decode("utf8", errors="replace").splitlines())
+            self._raise_assertion_error(f'Expected message(s) {watch.remaining_expected!s} '
+                                        f'not found in log:\n\n{print_log}\n\n')
 
     @contextlib.contextmanager
     def wait_for_new_peer(self, timeout=5):
@@ -707,6 +764,7 @@ class TestNode():
             try:
                 self.start(extra_args, stdout=log_stdout, stderr=log_stderr, *args, **kwargs)
                 ret = self.process.wait(timeout=self.rpc_timeout)
+                self._close_startup_watches()
                 self.log.debug(self._node_msg(f'bitcoind exited with status {ret} during initialization'))
                 assert_not_equal(ret, 0) # Exit code must indicate failure
                 self.running = False
@@ -729,6 +787,7 @@ class TestNode():
                                 'Expected message "{}" does not fully match stderr:\n"{}"'.format(expected_msg, stderr))
             except subprocess.TimeoutExpired as e:
                 self.process.kill()
+                self._close_startup_watches()
                 self.running = False
                 self.process = None
                 assert_msg = f'bitcoind should have exited within {self.rpc_timeout}s '
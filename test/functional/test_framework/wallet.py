@@ -19,7 +19,11 @@ from test_framework.address import (
     key_to_p2wpkh,
     output_key_to_p2tr,
 )
-from test_framework.blocktools import COINBASE_MATURITY
+from test_framework.blocktools import (
+    COINBASE_MATURITY,
+    create_chain,
+    submit_blocks,
+)
 from test_framework.descriptors import descsum_create
 from test_framework.key import (
     ECKey,
@@ -209,6 +213,28 @@ class MiniWallet:
         self.rescan_utxos()
         return blocks
 
+    def generate_offline(self, num_blocks, **kwargs):
+        """Like generate(), but create and solve the empty blocks in Python
+        (see TestNode.generate_offline) and add their coinbase outputs
+        directly instead of rescanning the UTXO set. Mempool transactions
+        are not mined."""
+        assert kwargs.pop("called_by_framework"), "Direct call of this mining method is discouraged. Please use self.generate_offline on the test framework."
+        blocks = create_chain(self._test_node, num_blocks, script_pubkey=self._scriptPubKey)
+        submit_blocks(self._test_node, blocks)
+        for utxo in self._utxos:
+            if utxo["confirmations"] > 0:
+                utxo["confirmations"] += num_blocks
+        first_height = self._test_node.getblockcount() - num_blocks + 1
+        for i, block in enumerate(blocks):
+            coinbase = block.vtx[0]
+            self._utxos.append(self._create_utxo(txid=coinbase.txid_hex,
+                                                 vout=0,
+                                                 value=Decimal(coinbase.vout[0].nValue) / COIN,
+                                                 height=first_height + i,
+                                                 coinbase=True,
+                                                 confirmations=num_blocks - i))
+        return [block.hash_hex for block in blocks]
+
     def get_output_script(self):
         return self._scriptPubKey
 
@@ -29,6 +29,20 @@ import sys
 import tempfile
 import re
 import logging
+from test_framework.resource_usage import (
+    USAGE_KEYS,
+    add_usage,
+    new_usage,
+    read_usage,
+)
+from test_framework.rpc_stats import (
+    LATENCY_BUCKETS_MS,
+    histogram_percentile,
+    merge_method_stats,
+    new_method_stats,
+    read_stats,
+)
+from test_framework.test_history import TestHistory
 from test_framework.util import (
     Binaries,
     export_env_build_path,
@@ -41,6 +55,23 @@ MIN_FREE_SPACE = 1.1 * 1024 * 1024 * 1024
 ADDITIONAL_SPACE_PER_JOB = 100 * 1024 * 1024
 # Minimum amount of space required for --nocleanup
 MIN_NO_CLEANUP_SPACE = 12 * 1024 * 1024 * 1024
+# --adaptive: Do not start more tests once the 1-minute load average per CPU exceeds this.
+MAX_LOAD_PER_CPU = 1.5
+# --adaptive: Memory to keep available for the running tests to grow into.
+MIN_AVAILABLE_MEMORY = 512 * 1024 * 1024
+# --adaptive: Share of the memory available at start that the expected peaks of
+# all concurrently running tests may add up to.
+MEMORY_BUDGET_FRACTION = 0.8
+# --adaptive: Assumed peak memory usage of a test without history.
+DEFAULT_TEST_MEMORY = 256 * 1024 * 1024
+# --ramdisk: Memory-backed filesystem the test directories are put on.
+RAMDISK_PATH = "/dev/shm"
+# --ramdisk without a size: Share of the free space in RAMDISK_PATH to use.
+RAMDISK_DEFAULT_FRACTION = 0.5
+# --ramdisk: Assumed size of the test directory of a test without history.
+DEFAULT_TEST_DISK_USAGE = 100 * 1024 * 1024
+# --ramdisk: Tests known to need a lot of space, kept on disk until their usage is recorded.
+DISK_HEAVY_TESTS = ["feature_pruning.py", "feature_dbcrash.py"]
 
 # Formatting. Default colors to empty strings.
 DEFAULT, BOLD, GREEN, RED = ("", ""), ("", ""), ("", ""), ("", "")
@@ -84,6 +115,17 @@ TEST_EXIT_SKIPPED = 77
 
 TEST_FRAMEWORK_UNIT_TESTS = 'feature_framework_unit_tests.py'
 
+# Number of tests listed in the summary of the heaviest tests
+HEAVIEST_TESTS_COUNT = 10
+# Units of the resource usage columns in the results file
+RESOURCE_UNITS = {
+    "max_rss": "bytes",
+    "cpu_user": "seconds",
+    "cpu_sys": "seconds",
+    "read_bytes": "bytes",
+    "write_bytes": "bytes",
+}
+
 EXTENDED_SCRIPTS = [
     # These tests are not run by default.
     # Longest test should go first, to favor running tests in parallel
@@ -99,7 +141,8 @@ BASE_SCRIPTS = [
     # Special scripts that are "expanded" later
     TOOL_BENCH_SANITY_CHECK,
     # Scripts that are run by default.
-    # Longest test should go first, to favor running tests in parallel
+    # Longest test should go first, to favor running tests in parallel.
+    # Once durations are recorded in the history file, they determine the order.
     # vv Tests less than 5m vv
     'feature_fee_estimation.py',
     'feature_taproot.py',
@@ -272,6 +315,7 @@ BASE_SCRIPTS = [
     'mempool_package_limits.py',
     'mempool_package_rbf.py',
     'tool_utxo_to_sqlite.py',
+    'tool_utxo_snapshot.py',
     'feature_versionbits_warning.py',
     'feature_blocksxor.py',
     'rpc_preciousblock.py',
@@ -417,6 +461,22 @@ NON_SCRIPTS = [
     "test_runner.py",
 ]
 
+def parse_shard(value):
+    """Parse a --shard value of the form i/N with 1 <= i <= N into (i, N)."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N with 1 <= i <= N")
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_size(value):
+    """Parse a size such as 512M or 4G (binary units) into bytes."""
+    match = re.fullmatch(r"(\d+)([KMG]?)", value.upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}', expected e.g. 512M or 4G")
+    return int(match.group(1)) * 1024 ** "_KMG".index(match.group(2) or "_")
+
+
 def main():
     # Parse arguments and pass through unrecognised args
     parser = argparse.ArgumentParser(add_help=False,
@@ -425,6 +485,7 @@ def main():
                                      epilog='''
     Help text and arguments for individual test script:''',
                                      formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--adaptive', action='store_true', help='only start another test (up to --jobs at a time) while CPU load, available memory and free space in tmpdir are within budget, taking into account the recorded peak memory usage of the running tests')
     parser.add_argument('--ansi', action='store_true', default=sys.stdout.isatty(), help="Use ANSI colors and dots in output (enabled by default when standard output is a TTY)")
     parser.add_argument('--combinedlogslen', '-c', type=int, default=0, metavar='n', help='On failure, print a log (of length n lines) to the console, combined from the test framework and all test nodes.')
     parser.add_argument('--coverage', action='store_true', help='generate a basic coverage report for the RPC interface')
@@ -433,12 +494,17 @@ def main():
     parser.add_argument('--help', '-h', '-?', action='store_true', help='print help text and exit')
     parser.add_argument('--jobs', '-j', type=int, default=4, help='how many test scripts to run in parallel. Default=4.')
     parser.add_argument('--quiet', '-q', action='store_true', help='only print dots, results summary and failure logs')
+    parser.add_argument('--ramdisk', nargs='?', const=0, type=parse_size, metavar='SIZE', help=f'put the test directories on {RAMDISK_PATH} (memory-backed, no root needed), using at most --ramdisk=SIZE (e.g. 4G, default: half of its free space). Tests whose recorded disk usage does not fit next to the running tests run in tmpdir on disk')
     parser.add_argument('--tmpdirprefix', '-t', default=tempfile.gettempdir(), help="Root directory for datadirs")
     parser.add_argument('--failfast', '-F', action='store_true', help='stop execution after the first test failure')
     parser.add_argument('--filter', help='filter scripts to run by regular expression')
     parser.add_argument("--nocleanup", dest="nocleanup", default=False, action="store_true",
                         help="Leave bitcoinds and test.* datadir on exit or error")
+    parser.add_argument('--mergeresults', metavar='FILE', help='merge the --resultsfile outputs given as positional arguments (e.g. of all shards) into FILE, print the combined results and exit')
     parser.add_argument('--resultsfile', '-r', help='store test results (as CSV) to the provided file')
+    parser.add_argument('--historyfile', metavar='FILE', help='file keeping the durations of previous test runs, used to start the longest tests first and to estimate the remaining time. Default: test_history.json in the build test directory')
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N', help='only run the i-th of N groups of the selected tests. With --historyfile, the groups are balanced by the durations in that file, which is then not updated; all shards must use the same file. Otherwise the tests are assigned by a hash of their name')
+    parser.add_argument('--rpcstats', action='store_true', help='collect per-method RPC latency statistics and print a report of the slowest RPCs and the tests spending the most time waiting on RPC')
 
     args, unknown_args = parser.parse_known_args()
     # Fail on self-check warnings before running the tests.
@@ -454,6 +520,9 @@ def main():
     tests = [arg for arg in unknown_args if arg[:2] != "--"]
     passon_args = [arg for arg in unknown_args if arg[:2] == "--"]
 
+    if args.mergeresults:
+        sys.exit(not merge_results(tests, pathlib.Path(args.mergeresults)))
+
     # Read config generated by configure.
     config = configparser.ConfigParser()
     configfile = os.path.abspath(os.path.dirname(__file__)) + "/../config.ini"
@@ -472,6 +541,17 @@ def main():
 
     logging.debug("Temporary test directory at %s" % tmpdir)
 
+    ramdisk_dir = None
+    ramdisk_size = None
+    if args.ramdisk is not None:
+        if os.path.isdir(RAMDISK_PATH):
+            ramdisk_dir = os.path.join(RAMDISK_PATH, os.path.basename(tmpdir))
+            os.makedirs(ramdisk_dir)
+            ramdisk_size = args.ramdisk or int(shutil.disk_usage(RAMDISK_PATH).free * RAMDISK_DEFAULT_FRACTION)
+            logging.debug(f"Ramdisk test directory at {ramdisk_dir}, using up to {ramdisk_size // (1024 * 1024)} MiB")
+        else:
+            print(f"{BOLD[1]}WARNING!{BOLD[0]} {RAMDISK_PATH} does not exist, running all tests in {tmpdir}.")
+
     results_filepath = None
     if args.resultsfile:
         results_filepath = pathlib.Path(args.resultsfile)
@@ -560,6 +640,25 @@ def main():
     if args.filter:
         test_list = deque(filter(re.compile(args.filter).search, test_list))
 
+    if args.shard:
+        # Every shard must compute the same partition, so the history is only
+        # read, and only from an explicitly given file shared by all shards.
+        # Without one, the tests are assigned by a hash of their name.
+        history = TestHistory(args.historyfile, read_only=True) if args.historyfile else TestHistory()
+    else:
+        history_filepath = args.historyfile or os.path.join(config["environment"]["BUILDDIR"], "test", "test_history.json")
+        logging.debug("Test durations are recorded in " + history_filepath)
+        history = TestHistory(history_filepath)
+
+    if args.shard:
+        shard_index, shard_count = args.shard
+        test_list = history.shard(test_list, shard_index - 1, shard_count)
+        expected = sum(history.expected_duration(test) or 0 for test in test_list)
+        logging.debug(f"Shard {shard_index}/{shard_count}: {len(test_list)} tests, {int(expected)} s of recorded test durations")
+        if not test_list:
+            print(f"No tests in shard {shard_index}/{shard_count}.")
+            sys.exit(0)
+
     if not test_list:
         print("No valid test scripts specified. Check that your test is in one "
               "of the test lists in test_runner.py, or run test_runner.py with no arguments to run all tests")
@@ -587,15 +686,21 @@ def main():
         tmpdir=tmpdir,
         jobs=args.jobs,
         enable_coverage=args.coverage,
+        enable_rpc_stats=args.rpcstats,
         args=passon_args,
         combined_logs_len=args.combinedlogslen,
         failfast=args.failfast,
         use_term_control=args.ansi,
         results_filepath=results_filepath,
+        history=history,
+        adaptive=args.adaptive,
+        ramdisk_dir=ramdisk_dir,
+        ramdisk_size=ramdisk_size,
     )
 
-def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, use_term_control, results_filepath=None):
+def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, enable_rpc_stats=False, args=None, combined_logs_len=0, failfast=False, use_term_control, results_filepath=None, history=None, adaptive=False, ramdisk_dir=None, ramdisk_size=None):
     args = args or []
+    history = history or TestHistory()
 
     # Some optional Python dependencies (e.g. pycapnp) may emit warnings or fail under
     # CPython free-threaded builds when the GIL is disabled. Force it on for all
@@ -632,6 +737,15 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
     else:
         coverage = None
 
+    if enable_rpc_stats:
+        rpc_stats = RPCStatsReport()
+        logging.debug("Initializing RPC statistics directory at %s" % rpc_stats.dir)
+    else:
+        rpc_stats = None
+
+    # The test processes write their resource usage here
+    resource_dir = tempfile.TemporaryDirectory(prefix="functional_test_resources")
+
     if len(test_list) > 1 and jobs > 1:
         # Populate cache
         try:
@@ -640,6 +754,10 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
             sys.stdout.buffer.write(e.output)
             raise
 
+    # Start the longest tests first, so that no slow test starts late and
+    # prolongs the run while the other jobs are idle.
+    test_list = history.schedule(test_list)
+
     # Run Tests
     job_queue = TestHandler(
         num_tests_parallel=jobs,
@@ -648,6 +766,10 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
         test_list=test_list,
         flags=flags,
         use_term_control=use_term_control,
+        rpc_stats=rpc_stats,
+        resource_dir=resource_dir.name,
+        limits=AdaptiveLimits(tmpdir=tmpdir, history=history) if adaptive else None,
+        placement=RamdiskPlacement(ramdisk_dir=ramdisk_dir, budget=ramdisk_size, tmpdir=tmpdir, history=history) if ramdisk_dir else None,
     )
     start_time = time.time()
     test_results = []
@@ -655,47 +777,72 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
     max_len_name = len(max(test_list, key=len))
     test_count = len(test_list)
     all_passed = True
-    while not job_queue.done():
-        if failfast and not all_passed:
-            break
-        for test_result, testdir, stdout, stderr, exit_code, skip_reason in job_queue.get_next():
-            test_results.append(test_result)
-            done_str = f"{len(test_results)}/{test_count} - {BOLD[1]}{test_result.name}{BOLD[0]}"
-            if test_result.status == "Passed":
-                logging.debug("%s passed, Duration: %s s" % (done_str, test_result.time))
-            elif test_result.status == "Skipped":
-                logging.debug(f"{done_str} skipped ({skip_reason})")
-            else:
-                all_passed = False
-                print(f"{done_str} failed (exit code {exit_code}), Duration: {test_result.time} s\n")
-                print(BOLD[1] + 'stdout:\n' + BOLD[0] + stdout + '\n')
-                print(BOLD[1] + 'stderr:\n' + BOLD[0] + stderr + '\n')
-                if combined_logs_len and os.path.isdir(testdir):
-                    # Print the final `combinedlogslen` lines of the combined logs
-                    print('{}Combine the logs and print the last {} lines ...{}'.format(BOLD[1], combined_logs_len, BOLD[0]))
-                    print('\n============')
-                    print('{}Combined log for {}:{}'.format(BOLD[1], testdir, BOLD[0]))
-                    print('============\n')
-                    combined_logs_args = [sys.executable, os.path.join(tests_dir, 'combine_logs.py'), testdir]
-                    if BOLD[0]:
-                        combined_logs_args += ['--color']
-                    combined_logs, _ = subprocess.Popen(combined_logs_args, text=True, stdout=subprocess.PIPE).communicate()
-                    print("\n".join(deque(combined_logs.splitlines(), combined_logs_len)))
-
-                if failfast:
-                    logging.debug("Early exiting after test failure")
-                    break
-
-                if "[Errno 28] No space left on device" in stdout:
-                    sys.exit(f"Early exiting after test failure due to insufficient free space in {tmpdir}\n"
-                             f"Test execution data left in {tmpdir}.\n"
-                             f"Additional storage is needed to execute testing.")
+    failed_testdirs = []
+    try:
+        while not job_queue.done():
+            if failfast and not all_passed:
+                break
+            for test_result, testdir, stdout, stderr, exit_code, skip_reason in job_queue.get_next():
+                test_results.append(test_result)
+                history.record(test_result.name, test_result.status, test_result.time,
+                               test_result.total_usage()["max_rss"] if test_result.resources else None,
+                               test_result.disk_usage)
+                done_str = f"{len(test_results)}/{test_count} - {BOLD[1]}{test_result.name}{BOLD[0]}"
+                if test_result.status == "Passed":
+                    logging.debug("%s passed, Duration: %s s%s" % (done_str, test_result.time, job_queue.eta_str(history)))
+                elif test_result.status == "Skipped":
+                    logging.debug(f"{done_str} skipped ({skip_reason})")
+                else:
+                    all_passed = False
+                    failed_testdirs.append(testdir)
+                    print(f"{done_str} failed (exit code {exit_code}), Duration: {test_result.time} s\n")
+                    print(BOLD[1] + 'stdout:\n' + BOLD[0] + stdout + '\n')
+                    print(BOLD[1] + 'stderr:\n' + BOLD[0] + stderr + '\n')
+                    if combined_logs_len and os.path.isdir(testdir):
+                        # Print the final `combinedlogslen` lines of the combined logs
+                        print('{}Combine the logs and print the last {} lines ...{}'.format(BOLD[1], combined_logs_len, BOLD[0]))
+                        print('\n============')
+                        print('{}Combined log for {}:{}'.format(BOLD[1], testdir, BOLD[0]))
+                        print('============\n')
+                        combined_logs_args = [sys.executable, os.path.join(tests_dir, 'combine_logs.py'), testdir]
+                        if BOLD[0]:
+                            combined_logs_args += ['--color']
+                        combined_logs, _ = subprocess.Popen(combined_logs_args, text=True, stdout=subprocess.PIPE).communicate()
+                        print("\n".join(deque(combined_logs.splitlines(), combined_logs_len)))
+
+                    if failfast:
+                        logging.debug("Early exiting after test failure")
+                        break
+
+                    if "[Errno 28] No space left on device" in stdout:
+                        full_dir = ramdisk_dir if ramdisk_dir and testdir.startswith(ramdisk_dir) else tmpdir
+                        sys.exit(f"Early exiting after test failure due to insufficient free space in {full_dir}\n"
+                                 f"Test execution data left in {tmpdir}.\n"
+                                 f"Additional storage is needed to execute testing.")
+    finally:
+        # Clean up dangling processes if any. This may only happen with the
+        # --failfast option, after an early exit or an interrupt.
+        if not os.getenv("CI_FAILFAST_TEST_LEAVE_DANGLING"):
+            job_queue.kill_jobs()
+        if ramdisk_dir:
+            teardown_ramdisk(job_queue, ramdisk_dir, tmpdir, failed_testdirs)
 
     runtime = int(time.time() - start_time)
     print_results(test_results, max_len_name, runtime)
+    print_heaviest_tests(test_results, max_len_name)
+    if job_queue.placement:
+        job_queue.placement.print_summary(test_results)
+    if history.path and not history.read_only:
+        try:
+            history.save()
+        except OSError as e:
+            print(f"{BOLD[1]}WARNING!{BOLD[0]} Could not write the test history to {history.path}: {e}")
     if results_filepath:
         write_results(test_results, results_filepath, runtime)
 
+    if rpc_stats:
+        rpc_stats.report(test_results)
+
     if coverage:
         coverage_passed = coverage.report_rpc_coverage()
     else:
@@ -707,15 +854,33 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
 
     all_passed = all_passed and coverage_passed
 
-    # Clean up dangling processes if any. This may only happen with --failfast option.
-    # Killing the process group will also terminate the current process but that is
-    # not an issue
-    if not os.getenv("CI_FAILFAST_TEST_LEAVE_DANGLING") and len(job_queue.jobs):
-        os.killpg(os.getpgid(0), signal.SIGKILL)
-
     sys.exit(not all_passed)
 
 
+def teardown_ramdisk(job_queue, ramdisk_dir, tmpdir, failed_testdirs):
+    """Move the test directories left on the ramdisk to tmpdir and remove the
+    ramdisk directory, so that it does not hold on to memory after the run.
+
+    Called at the end of run_tests(), also after an early exit, a failure or
+    an interrupt, once the running tests have been killed. The directories of
+    tests left running (with CI_FAILFAST_TEST_LEAVE_DANGLING) stay on the
+    ramdisk, as their nodes may still write to them."""
+    running_testdirs = job_queue.running_testdirs()
+    # Keep the directories of failed tests, but free the memory
+    for entry in os.listdir(ramdisk_dir):
+        if os.path.join(ramdisk_dir, entry) not in running_testdirs:
+            shutil.move(os.path.join(ramdisk_dir, entry), tmpdir)
+    if running_testdirs:
+        print(f"Test directories of running tests left on the ramdisk {ramdisk_dir}")
+    else:
+        os.rmdir(ramdisk_dir)
+    moved = [testdir for testdir in failed_testdirs if testdir.startswith(ramdisk_dir + os.sep)]
+    if moved:
+        print(f"Test directories of failed tests moved from the ramdisk {ramdisk_dir} to {tmpdir}:")
+        for testdir in moved:
+            print(f"  {os.path.join(tmpdir, os.path.relpath(testdir, ramdisk_dir))}")
+
+
 def print_results(test_results, max_len_name, runtime):
     results = "\n" + BOLD[1] + "%s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "STATUS   ", "DURATION") + BOLD[0]
 
@@ -739,21 +904,90 @@ def print_results(test_results, max_len_name, runtime):
     print(results)
 
 
+def print_heaviest_tests(test_results, max_len_name):
+    """Log the tests with the highest peak memory usage of the test process and its nodes combined."""
+    measured = [r for r in test_results if r.resources is not None]
+    if not measured:
+        return
+    measured.sort(key=lambda r: r.total_usage()["max_rss"], reverse=True)
+    mib = 1024 * 1024
+    lines = [BOLD[1] + "Heaviest tests (peak RSS summed over the test process and its nodes):" + BOLD[0]]
+    lines.append("%s | %14s | %16s | %14s" % ("TEST".ljust(max_len_name), "PEAK RSS (MiB)", "CPU USER+SYS (s)", "DISK I/O (MiB)"))
+    for test_result in measured[:HEAVIEST_TESTS_COUNT]:
+        usage = test_result.total_usage()
+        lines.append("%s | %14.0f | %16.1f | %14.1f" % (
+            test_result.name.ljust(max_len_name),
+            usage["max_rss"] / mib,
+            usage["cpu_user"] + usage["cpu_sys"],
+            (usage["read_bytes"] + usage["write_bytes"]) / mib,
+        ))
+    logging.debug("\n".join(lines) + "\n")
+
+
 def write_results(test_results, filepath, total_runtime):
+    resource_columns = [(process, key) for process in ("python", "bitcoind") for key in USAGE_KEYS]
     with open(filepath, mode="w") as results_file:
         results_writer = csv.writer(results_file)
-        results_writer.writerow(['test', 'status', 'duration(seconds)'])
+        results_writer.writerow(['test', 'status', 'duration(seconds)'] + [f"{process}_{key}({RESOURCE_UNITS[key]})" for process, key in resource_columns])
         all_passed = True
         for test_result in test_results:
             all_passed = all_passed and test_result.was_successful
-            results_writer.writerow([test_result.name, test_result.status, str(test_result.time)])
+            resources = test_result.resources or {}
+            usage_row = [str(resources[process][key]) if resources.get(process) else "" for process, key in resource_columns]
+            results_writer.writerow([test_result.name, test_result.status, str(test_result.time)] + usage_row)
         results_writer.writerow(['ALL', ("Passed" if all_passed else "Failed"), str(total_runtime)])
 
+
+def merge_results(input_paths, output_path):
+    """Combine results files written by write_results(), e.g. by several shards,
+    into one, print the combined results and return whether all tests passed.
+
+    The total runtime is the one of the slowest input, as the inputs are
+    expected to have run in parallel."""
+    if not input_paths:
+        sys.exit("No results files to merge given")
+    header = []
+    rows = []
+    runtime = 0
+    for path in input_paths:
+        with open(path, newline="") as results_file:
+            reader = csv.DictReader(results_file)
+            header += [column for column in reader.fieldnames if column not in header]
+            for row in reader:
+                if row["test"] == "ALL":
+                    runtime = max(runtime, int(row["duration(seconds)"]))
+                else:
+                    rows.append(row)
+    all_passed = all(row["status"] != "Failed" for row in rows)
+    with open(output_path, mode="w", newline="") as results_file:
+        results_writer = csv.writer(results_file)
+        results_writer.writerow(header)
+        for row in rows:
+            results_writer.writerow([row.get(column) or "" for column in header])
+        results_writer.writerow(['ALL', ("Passed" if all_passed else "Failed"), str(runtime)])
+    test_results = [TestResult(row["test"], row["status"], int(row["duration(seconds)"])) for row in rows]
+    print_results(test_results, max((len(row["test"]) for row in rows), default=0), runtime)
+    return all_passed
+
+
+def read_test_resources(filename):
+    """Read the resource usage written by a test process and return it as
+    ({"python": usage, "bitcoind": usage of all nodes combined}, size of the
+    test directory), or (None, None) if the test did not write it."""
+    try:
+        python_usage, nodes_usage, disk_usage = read_usage(filename)
+    except (OSError, ValueError, KeyError):
+        return None, None
+    bitcoind_usage = new_usage()
+    for usage in nodes_usage.values():
+        add_usage(bitcoind_usage, usage)
+    return {"python": python_usage, "bitcoind": bitcoind_usage}, disk_usage
+
 class TestHandler:
     """
     Trigger the test scripts passed in via the list.
     """
-    def __init__(self, *, num_tests_parallel, tests_dir, tmpdir, test_list, flags, use_term_control):
+    def __init__(self, *, num_tests_parallel, tests_dir, tmpdir, test_list, flags, use_term_control, rpc_stats=None, resource_dir=None, limits=None, placement=None):
         assert num_tests_parallel >= 1
         self.executor = futures.ThreadPoolExecutor(max_workers=num_tests_parallel)
         self.num_jobs = num_tests_parallel
@@ -762,42 +996,19 @@ class TestHandler:
         self.test_list = test_list
         self.flags = flags
         self.jobs = {}
+        self.start_times = {}
+        self.tasks = {}
         self.use_term_control = use_term_control
+        self.rpc_stats = rpc_stats
+        self.resource_dir = resource_dir
+        self.limits = limits
+        self.placement = placement
 
     def done(self):
         return not (self.jobs or self.test_list)
 
     def get_next(self):
-        while len(self.jobs) < self.num_jobs and self.test_list:
-            # Add tests
-            test = self.test_list.popleft()
-            portseed = len(self.test_list)
-            portseed_arg = ["--portseed={}".format(portseed)]
-            log_stdout = tempfile.SpooledTemporaryFile(max_size=2**16)
-            log_stderr = tempfile.SpooledTemporaryFile(max_size=2**16)
-            test_argv = test.split()
-            testdir = "{}/{}_{}".format(self.tmpdir, re.sub(".py$", "", test_argv[0]), portseed)
-            tmpdir_arg = ["--tmpdir={}".format(testdir)]
-
-            def proc_wait(task):
-                task[2].wait()
-                return task
-
-            task = [
-                test,
-                time.time(),
-                subprocess.Popen(
-                    [sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
-                    text=True,
-                    stdout=log_stdout,
-                    stderr=log_stderr,
-                ),
-                testdir,
-                log_stdout,
-                log_stderr,
-            ]
-            fut = self.executor.submit(proc_wait, task)
-            self.jobs[fut] = test
+        self._start_tests()
         assert self.jobs  # Must not be empty here
 
         # Print remaining running jobs when all jobs have been started.
@@ -809,9 +1020,11 @@ class TestHandler:
             # Return all procs that have finished, if any. Otherwise sleep until there is one.
             procs = futures.wait(self.jobs.keys(), timeout=.5, return_when=futures.FIRST_COMPLETED)
             self.jobs = {fut: self.jobs[fut] for fut in procs.not_done}
+            self.start_times = {fut: self.start_times[fut] for fut in procs.not_done}
+            self.tasks = {fut: self.tasks[fut] for fut in procs.not_done}
             ret = []
             for job in procs.done:
-                (name, start_time, proc, testdir, log_out, log_err) = job.result()
+                (name, start_time, proc, testdir, log_out, log_err, resource_file) = job.result()
 
                 log_out.seek(0), log_err.seek(0)
                 [stdout, stderr] = [log_file.read().decode('utf-8') for log_file in (log_out, log_err)]
@@ -829,21 +1042,223 @@ class TestHandler:
                     clearline = '\r' + (' ' * dot_count) + '\r'
                     print(clearline, end='', flush=True)
                 dot_count = 0
-                ret.append((TestResult(name, status, int(time.time() - start_time)), testdir, stdout, stderr, proc.returncode, skip_reason))
+                resources, disk_usage = read_test_resources(resource_file) if resource_file else (None, None)
+                if self.placement:
+                    self.placement.release(name)
+                ret.append((TestResult(name, status, int(time.time() - start_time), resources, disk_usage), testdir, stdout, stderr, proc.returncode, skip_reason))
             if ret:
                 return ret
+            if self.limits is not None:
+                # The load may have gone down since the last check. Start one
+                # test at a time, as the load average reacts with a delay.
+                self._start_tests(max_new=1)
             if self.use_term_control:
                 print('.', end='', flush=True)
             dot_count += 1
 
+    def _start_tests(self, max_new=None):
+        """Start queued tests until all job slots are busy or, with adaptive
+        limits, no queued test fits into the current resource budget."""
+        started = 0
+        while len(self.jobs) < self.num_jobs and self.test_list and started != max_new:
+            started += 1
+            # Add tests
+            if self.limits is None:
+                test = self.test_list.popleft()
+            else:
+                index = self.limits.next_test_index(self.test_list, list(self.jobs.values()))
+                if index is None:
+                    break
+                test = self.test_list[index]
+                del self.test_list[index]
+            portseed = len(self.test_list)
+            portseed_arg = ["--portseed={}".format(portseed)]
+            log_stdout = tempfile.SpooledTemporaryFile(max_size=2**16)
+            log_stderr = tempfile.SpooledTemporaryFile(max_size=2**16)
+            test_argv = test.split()
+            basedir = self.placement.place(test) if self.placement else self.tmpdir
+            testdir = "{}/{}_{}".format(basedir, re.sub(".py$", "", test_argv[0]), portseed)
+            tmpdir_arg = ["--tmpdir={}".format(testdir)]
+            rpc_stats_arg = [self.rpc_stats.flag(test)] if self.rpc_stats else []
+            resource_file = os.path.join(self.resource_dir, f"{portseed}.json") if self.resource_dir else None
+            resource_arg = [f"--resourceusagefile={resource_file}"] if resource_file else []
+
+            def proc_wait(task):
+                task[2].wait()
+                return task
+
+            task = [
+                test,
+                time.time(),
+                subprocess.Popen(
+                    [sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg + rpc_stats_arg + resource_arg,
+                    text=True,
+                    stdout=log_stdout,
+                    stderr=log_stderr,
+                    # Run each test in its own process group, so that its nodes can be killed with it
+                    start_new_session=True,
+                ),
+                testdir,
+                log_stdout,
+                log_stderr,
+                resource_file,
+            ]
+            fut = self.executor.submit(proc_wait, task)
+            self.jobs[fut] = test
+            self.start_times[fut] = task[1]
+            self.tasks[fut] = task
+
+    def kill_jobs(self):
+        """Kill the running tests, including the nodes they started, and wait
+        until the test processes exited."""
+        for task in self.tasks.values():
+            if platform.system() == 'Windows':  # No process groups on Windows
+                task[2].kill()
+                continue
+            try:
+                os.killpg(task[2].pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for task in self.tasks.values():
+            task[2].wait()
+
+    def running_testdirs(self):
+        """Return the test directories of the tests that are still running."""
+        return {task[3] for task in self.tasks.values() if task[2].poll() is None}
+
+    def eta_str(self, history):
+        """Return the expected remaining time of the run for the progress output, or an empty string if unknown."""
+        now = time.time()
+        running = [(test, now - self.start_times[fut]) for fut, test in self.jobs.items()]
+        remaining = history.estimate_remaining(running, self.test_list, self.num_jobs)
+        if remaining is None:
+            return ""
+        return ", ETA: %s s" % int(remaining)
+
+
+def available_memory():
+    """Return the memory available for new processes in bytes, or None if unknown."""
+    try:
+        with open("/proc/meminfo", encoding="utf8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class AdaptiveLimits:
+    """Decide whether another test can be started, based on the current CPU
+    load, available memory and free space in tmpdir, and on the recorded
+    peak memory usage of the running tests."""
+
+    def __init__(self, *, tmpdir, history):
+        self.tmpdir = tmpdir
+        self.history = history
+        self.cpu_count = os.cpu_count() or 1
+        memory = available_memory()
+        self.memory_budget = None if memory is None else memory * MEMORY_BUDGET_FRACTION
+        known = sorted(entry["max_rss"] for entry in history.tests.values() if "max_rss" in entry)
+        self.default_memory = known[len(known) // 2] if known else DEFAULT_TEST_MEMORY
+
+    def expected_memory(self, test):
+        max_rss = self.history.expected_max_rss(test)
+        return self.default_memory if max_rss is None else max_rss
+
+    def next_test_index(self, test_list, running):
+        """Return the index of the first test in test_list that can be started
+        next to the running tests, or None if none can be started now.
+
+        A test is always started if nothing else is running."""
+        if not running:
+            return 0
+        if hasattr(os, "getloadavg") and os.getloadavg()[0] > MAX_LOAD_PER_CPU * self.cpu_count:
+            return None
+        memory = available_memory()
+        if memory is not None and memory < MIN_AVAILABLE_MEMORY:
+            return None
+        if shutil.disk_usage(self.tmpdir).free < MIN_FREE_SPACE + len(running) * ADDITIONAL_SPACE_PER_JOB:
+            return None
+        if self.memory_budget is None:
+            return 0
+        # Skip tests whose expected peak does not fit into the budget next to the
+        # running tests, so that memory-heavy tests do not run concurrently.
+        committed = sum(self.expected_memory(test) for test in running)
+        for index, test in enumerate(test_list):
+            if committed + self.expected_memory(test) <= self.memory_budget:
+                return index
+        return None
+
+
+class RamdiskPlacement:
+    """Decide for each test whether its test directory goes to the ramdisk or
+    to tmpdir on disk.
+
+    A test goes to the ramdisk if its expected disk usage fits into the budget
+    next to the expected usage of the tests already running there, and into
+    the space actually free. Tests without recorded usage are assumed to need
+    as much as the median known test, except for DISK_HEAVY_TESTS."""
+
+    def __init__(self, *, ramdisk_dir, budget, tmpdir, history):
+        self.ramdisk_dir = ramdisk_dir
+        self.budget = budget
+        self.tmpdir = tmpdir
+        self.history = history
+        known = sorted(entry["disk_usage"] for entry in history.tests.values() if "disk_usage" in entry)
+        self.default_usage = known[len(known) // 2] if known else DEFAULT_TEST_DISK_USAGE
+        # Expected usage of the tests running on the ramdisk
+        self.reserved = {}
+        self.on_ramdisk = set()
+
+    def expected_disk_usage(self, test):
+        usage = self.history.expected_disk_usage(test)
+        if usage is not None:
+            return usage
+        if test.split()[0] in DISK_HEAVY_TESTS:
+            return None
+        return self.default_usage
+
+    def place(self, test):
+        """Return the directory to create the test directory of test in."""
+        usage = self.expected_disk_usage(test)
+        committed = sum(self.reserved.values())
+        if (usage is None or committed + usage > self.budget or
+                shutil.disk_usage(self.ramdisk_dir).free < usage + ADDITIONAL_SPACE_PER_JOB):
+            return self.tmpdir
+        self.reserved[test] = usage
+        self.on_ramdisk.add(test)
+        return self.ramdisk_dir
+
+    def release(self, test):
+        self.reserved.pop(test, None)
+
+    def print_summary(self, test_results):
+        """Log how many tests ran on the ramdisk and how much data they kept there instead of on disk."""
+        ramdisk_results = [result for result in test_results if result.name in self.on_ramdisk]
+        ramdisk_usage = sum(result.disk_usage or 0 for result in ramdisk_results)
+        logging.debug(f"Ramdisk: {len(ramdisk_results)} tests ran on the ramdisk, {len(test_results) - len(ramdisk_results)} on disk. "
+                      f"The tests on the ramdisk left {ramdisk_usage // (1024 * 1024)} MiB of test directories behind at their end.")
+
 
 class TestResult():
-    def __init__(self, name, status, time):
+    def __init__(self, name, status, time, resources=None, disk_usage=None):
         self.name = name
         self.status = status
         self.time = time
+        # {"python": usage, "bitcoind": usage}, see test_framework/resource_usage.py
+        self.resources = resources
+        # Size of the test directory at the end of the test in bytes
+        self.disk_usage = disk_usage
         self.padding = 0
 
+    def total_usage(self):
+        usage = new_usage()
+        for process_usage in self.resources.values():
+            if process_usage:
+                add_usage(usage, process_usage)
+        return usage
+
     def sort_key(self):
         if self.status == "Passed":
             return 0, self.name.lower()
@@ -896,6 +1311,87 @@ def check_script_list(*, src_dir, fail_on_warn):
             sys.exit(1)
 
 
+class RPCStatsReport():
+    """
+    Suite-wide RPC statistics for test_runner.
+
+    Each test script writes the per-node, per-method RPC statistics recorded
+    by its TestNodes into a file in a temporary directory (see
+    test/functional/test_framework/rpc_stats.py). After all tests complete,
+    the files are aggregated into a report of the slowest RPC methods and of
+    the tests that spend the most wall time waiting on RPC.
+
+    """
+    # Number of rows printed in each table of the report
+    TOP_N = 15
+
+    def __init__(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix="rpcstats")
+        self.dir = self.temp_dir.name
+
+    def _filename(self, test):
+        # Argument variants of a test must end up in different files
+        return os.path.join(self.dir, re.sub(r"[^\w.-]", "_", test) + ".json")
+
+    def flag(self, test):
+        return f"--rpcstatsfile={self._filename(test)}"
+
+    def report(self, test_results):
+        """
+        Print the slowest RPC methods across all tests and the tests with the
+        most time spent waiting on RPC.
+
+        """
+        methods = {}
+        tests = []
+        for test_result in test_results:
+            filename = self._filename(test_result.name)
+            if not os.path.isfile(filename):
+                continue
+            test_rpc_time = 0.0
+            for node_methods in read_stats(filename).values():
+                for method, stats in node_methods.items():
+                    merge_method_stats(methods.setdefault(method, new_method_stats()), stats)
+                    test_rpc_time += stats["time"]
+            tests.append((test_result.name, test_rpc_time, test_result.time))
+
+        if not methods:
+            print("No RPC statistics were recorded.")
+            return
+
+        def fmt_ms(seconds):
+            if seconds is None:
+                return "-"
+            if seconds == float("inf"):
+                return ">%d" % LATENCY_BUCKETS_MS[-1]
+            return "%.1f" % (seconds * 1000)
+
+        max_len_method = max(len(method) for method in methods)
+        print(BOLD[1] + "Slowest RPC methods (by accumulated time):" + BOLD[0])
+        print("%s | %9s | %6s | %9s | %8s | %8s | %9s | %10s | %11s" % (
+            "METHOD".ljust(max_len_method), "CALLS", "ERRORS", "TOTAL s", "MEAN ms", "P50 ms", "P95 ms", "MAX ms", "KB REQ/RESP"))
+        for method, stats in sorted(methods.items(), key=lambda m: m[1]["time"], reverse=True)[:self.TOP_N]:
+            print("%s | %9d | %6d | %9.2f | %8.2f | %8s | %9s | %10.1f | %11s" % (
+                method.ljust(max_len_method),
+                stats["count"],
+                stats["errors"],
+                stats["time"],
+                stats["time"] / stats["count"] * 1000,
+                fmt_ms(histogram_percentile(stats["histogram"], 0.5)),
+                fmt_ms(histogram_percentile(stats["histogram"], 0.95)),
+                stats["max_time"] * 1000,
+                "%d/%d" % (stats["request_bytes"] // 1024, stats["response_bytes"] // 1024),
+            ))
+
+        max_len_name = max(len(name) for name, _, _ in tests)
+        print("\n" + BOLD[1] + "Tests spending the most time waiting on RPC:" + BOLD[0])
+        print("%s | %9s | %9s | %6s" % ("TEST".ljust(max_len_name), "RPC s", "TOTAL s", "SHARE"))
+        for name, test_rpc_time, test_time in sorted(tests, key=lambda t: t[1], reverse=True)[:self.TOP_N]:
+            share = "%5.1f%%" % (100 * test_rpc_time / test_time) if test_time else "-"
+            print("%s | %9.2f | %9d | %6s" % (name.ljust(max_len_name), test_rpc_time, test_time, share))
+        print()
+
+
 class RPCCoverage():
     """
     Coverage reporting utilities for test_runner.
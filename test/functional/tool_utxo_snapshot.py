@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the UTXO snapshot hash and diff tool"""
+from decimal import Decimal
+import os
+import subprocess
+import sys
+
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import (
+    assert_equal,
+)
+from test_framework.wallet import MiniWallet
+
+
+class UtxoSnapshotTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 1
+
+    def run_tool(self, *args, check=True):
+        tool_path = os.path.join(self.config["environment"]["SRCDIR"], "contrib", "utxo-tools", "utxo_snapshot.py")
+        return subprocess.run([sys.executable, tool_path, *args], check=check, stdout=subprocess.PIPE, text=True)
+
+    def test_merge_join_key_order(self):
+        self.log.info('Check that the diff follows the order of the coins database')
+        sys.path.insert(0, os.path.join(self.config["environment"]["SRCDIR"], "contrib", "utxo-tools"))
+        from utxo_snapshot import merge_join
+        txid = bytes(32)
+        # VARINT(16512) is 808000 and VARINT(16513) is 808001, both sort before VARINT(16511), which is ff7f
+        old_coins = [(txid, 1, 1, False, 1, b"\x51"), (txid, 16512, 2, False, 1, b"\x51"), (txid, 16511, 3, False, 1, b"\x51")]
+        new_coins = [(txid, 16512, 2, False, 1, b"\x51"), (txid, 16513, 4, False, 1, b"\x51"), (txid, 16511, 3, False, 1, b"\x51")]
+        changes = list(merge_join(iter(old_coins), iter(new_coins)))
+        assert_equal(changes, [("spent", old_coins[0]), ("created", new_coins[1])])
+
+    def run_test(self):
+        node = self.nodes[0]
+        wallet = MiniWallet(node)
+
+        self.log.info('Dump the UTXO set before and after a block spending and creating coins')
+        old_filename = os.path.join(self.options.tmpdir, "old_utxos.dat")
+        new_filename = os.path.join(self.options.tmpdir, "new_utxos.dat")
+        node.dumptxoutset(old_filename, "latest")
+        old_info = node.gettxoutsetinfo('muhash')
+        wallet.send_self_transfer(from_node=node)
+        self.generate(wallet, 1)
+        new_dump = node.dumptxoutset(new_filename, "latest")
+        new_info = node.gettxoutsetinfo('muhash')
+
+        self.log.info('Check the commitments computed by the tool')
+        output = self.run_tool('hash', new_filename, '--muhash', f'--expected={new_dump["txoutset_hash"]}').stdout
+        assert f"hash_serialized_3: {new_dump['txoutset_hash']}" in output
+        assert f"muhash: {new_info['muhash']}" in output
+        assert f"txouts: {new_info['txouts']}" in output
+        assert f"total_amount: {new_info['total_amount']:.8f}" in output
+        output = self.run_tool('hash', old_filename, '--muhash', '--jobs=1').stdout
+        assert f"muhash: {old_info['muhash']}" in output
+
+        self.log.info('Check that a mismatching hash_serialized_3 fails')
+        result = self.run_tool('hash', old_filename, f'--expected={new_dump["txoutset_hash"]}', check=False)
+        assert_equal(result.returncode, 1)
+        assert "does not match" in result.stdout
+
+        self.log.info('Check the diff of both snapshots')
+        output = self.run_tool('diff', old_filename, new_filename, '--verbose').stdout
+        # The transaction spends one coin and creates one, the coinbase creates another one
+        assert_equal(len([line for line in output.splitlines() if line.startswith("spent ")]), 1)
+        assert_equal(len([line for line in output.splitlines() if line.startswith("created ")]), 2)
+        totals = output.splitlines()[-1].split()
+        assert_equal(totals[:2], ["TOTAL", "1"])
+        assert_equal(totals[3], "2")
+        assert_equal(Decimal(totals[5]), new_info['total_amount'] - old_info['total_amount'])
+
+        self.test_merge_join_key_order()
+
+
+if __name__ == "__main__":
+    UtxoSnapshotTest(__file__).main()
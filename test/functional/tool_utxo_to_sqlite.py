@@ -15,6 +15,7 @@ import sys
 
 from test_framework.key import ECKey
 from test_framework.messages import (
+    COIN,
     COutPoint,
     CTxOut,
     uint256_from_str,
@@ -23,6 +24,14 @@ from test_framework.crypto.muhash import MuHash3072
 from test_framework.script import (
     CScript,
     CScriptOp,
+    OP_0,
+    OP_1,
+    OP_2,
+    OP_3,
+    OP_16,
+    OP_CHECKMULTISIG,
+    OP_CHECKSIG,
+    OP_PUSHDATA1,
 )
 from test_framework.script_util import (
     PAY_TO_ANCHOR,
@@ -73,6 +82,16 @@ def calculate_muhash_from_sqlite_utxos(filename, txid_format, spk_format):
     return muhash.digest()[::-1].hex()
 
 
+def calculate_muhash_from_utxo_columns(utxos):
+    muhash = MuHash3072()
+    for i in range(len(utxos)):
+        utxo_ser = COutPoint(uint256_from_str(bytes(utxos.txid[i])), int(utxos.vout[i])).serialize()
+        utxo_ser += (int(utxos.height[i]) * 2 + int(utxos.coinbase[i])).to_bytes(4, 'little')
+        utxo_ser += CTxOut(int(utxos.amount[i]), utxos.script(i)).serialize()
+        muhash.insert(utxo_ser)
+    return muhash.digest()[::-1].hex()
+
+
 class UtxoToSqliteTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 1
@@ -82,6 +101,41 @@ class UtxoToSqliteTest(BitcoinTestFramework):
     def skip_test_if_missing_module(self):
         self.skip_if_no_py_sqlite3()
 
+    def test_script_types(self, pubkey, uncompressed_pubkey):
+        self.log.info('Check that utxo_to_columns classifies output scripts like the node')
+        from utxo_to_columns import SCRIPT_TYPES, script_type
+        hybrid_pubkey = bytes([6]) + uncompressed_pubkey[1:]
+        invalid_pubkey = bytes([5]) + pubkey[1:]
+        for output_script, expected_type in (
+            (CScript([pubkey, OP_CHECKSIG]), "pubkey"),
+            (CScript([uncompressed_pubkey, OP_CHECKSIG]), "pubkey"),
+            (CScript([hybrid_pubkey, OP_CHECKSIG]), "pubkey"),
+            (CScript([invalid_pubkey, OP_CHECKSIG]), "nonstandard"),
+            (CScript([bytes([4]) + pubkey[1:], OP_CHECKSIG]), "nonstandard"),
+            (CScript([OP_0, bytes(20)]), "witness_v0_keyhash"),
+            (CScript([OP_0, bytes(32)]), "witness_v0_scripthash"),
+            (CScript([OP_0, bytes(25)]), "nonstandard"),
+            (CScript([OP_0, bytes(40)]), "nonstandard"),
+            (CScript([OP_1, bytes(32)]), "witness_v1_taproot"),
+            (CScript([OP_1, bytes(20)]), "witness_unknown"),
+            (CScript([OP_2, bytes(2)]), "witness_unknown"),
+            (CScript([OP_16, bytes(40)]), "witness_unknown"),
+            (CScript([OP_16, bytes(41)]), "nonstandard"),
+            (PAY_TO_ANCHOR, "anchor"),
+            (CScript([OP_1, pubkey, uncompressed_pubkey, OP_2, OP_CHECKMULTISIG]), "multisig"),
+            (CScript([17] + [pubkey] * 20 + [20, OP_CHECKMULTISIG]), "multisig"),
+            (CScript(bytes([OP_1, OP_PUSHDATA1, len(pubkey)]) + pubkey + bytes([OP_1, OP_CHECKMULTISIG])), "multisig"),
+            (CScript([OP_2, pubkey, OP_1, OP_CHECKMULTISIG]), "nonstandard"),
+            (CScript([OP_1, pubkey, pubkey, OP_3, OP_CHECKMULTISIG]), "nonstandard"),
+            (CScript([OP_1, pubkey, invalid_pubkey, OP_2, OP_CHECKMULTISIG]), "nonstandard"),
+            (CScript([OP_1, OP_1, OP_CHECKMULTISIG]), "nonstandard"),
+            (CScript([OP_1, pubkey, OP_1, OP_1, OP_CHECKMULTISIG]), "nonstandard"),
+            (CScript([OP_1, bytes(40), OP_1, OP_CHECKMULTISIG]), "nonstandard"),
+            (CScript([OP_CHECKMULTISIG]), "nonstandard"),
+        ):
+            assert_equal(SCRIPT_TYPES[script_type(bytes(output_script))], expected_type)
+            assert_equal(self.nodes[0].decodescript(output_script.hex())['type'], expected_type)
+
     def run_test(self):
         node = self.nodes[0]
         wallet = MiniWallet(node)
@@ -136,6 +190,32 @@ class UtxoToSqliteTest(BitcoinTestFramework):
             assert_equal(muhash_sqlite, muhash_compact_serialized)
             self.log.info('')
 
+        self.log.info('Convert UTXO set to columnar format')
+        utxo_tools_dir = os.path.dirname(utxo_to_sqlite_path)
+        sys.path.insert(0, utxo_tools_dir)
+        columns_dirname = os.path.join(self.options.tmpdir, "utxos_columns")
+        subprocess.run([sys.executable, os.path.join(utxo_tools_dir, "utxo_to_columns.py"), input_filename, columns_dirname],
+                       check=True, stderr=subprocess.STDOUT)
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.log.info('-> Skipping the verification of the columnar UTXO set, as NumPy is not available')
+        else:
+            self.log.info('-> Verify the columnar UTXO set by comparing its MuHash and totals')
+            from utxo_to_columns import UtxoColumns
+            utxos = UtxoColumns(columns_dirname)
+            txoutset_info = node.gettxoutsetinfo('muhash')
+            assert_equal(calculate_muhash_from_utxo_columns(utxos), txoutset_info['muhash'])
+            assert_equal(len(utxos), txoutset_info['txouts'])
+            assert_equal(utxos.total_amount(), int(txoutset_info['total_amount'] * COIN))
+            by_type = utxos.amount_by_script_type()
+            for script_type in ("pubkey", "pubkeyhash", "scripthash", "multisig", "witness_v0_keyhash",
+                                "witness_v0_scripthash", "witness_v1_taproot", "anchor", "nonstandard"):
+                assert script_type in by_type, script_type
+            taproot = utxos.select(script_types=["witness_v1_taproot"])
+            assert_equal(utxos.total_amount(taproot), by_type["witness_v1_taproot"][1])
+        self.test_script_types(pubkey, uncompressed_pubkey)
+
         if platform.system() != "Windows":  # FIFOs are not available on Windows
             self.log.info('Convert UTXO set directly (without intermediate dump) via named pipe')
             fifo_filename = os.path.join(self.options.tmpdir, "utxos.fifo")
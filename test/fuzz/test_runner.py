@@ -3,17 +3,47 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Run fuzz test targets.
+
+When running the corpus once, inputs that already passed with the same fuzz
+binary (identified by its GNU build ID, or the hash of its contents) are
+skipped. The cache of passed inputs is kept in --cache_file, together with
+the average runtime per input of each target. The remaining inputs are split
+into chunks of at most --chunk_size inputs, which are run longest first, so
+that large corpora are spread over all workers. A chunk is also cut short
+before its input paths exceed MAX_CHUNK_ARGS_LENGTH, to stay within the
+command-line length limit of the platform.
 """
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import argparse
 import configparser
+import hashlib
+import json
 import logging
+import math
 import os
 import random
+import re
 import subprocess
 import sys
+import tempfile
+import time
+
+CACHE_VERSION = 1
+# Weight of the most recent run in the average runtime per input
+EWMA_ALPHA = 0.3
+# Number of bytes of the input hashes kept in the cache
+INPUT_HASH_BYTES = 16
+# Matches the ELF note holding the GNU build ID (little endian): name size 4,
+# descriptor size, type NT_GNU_BUILD_ID, name "GNU"
+GNU_BUILD_ID_NOTE = re.compile(rb"\x04\x00\x00\x00([\x08-\x40])\x00\x00\x00\x03\x00\x00\x00GNU\x00", re.DOTALL)
+# The build ID note is at the start of the binary
+BUILD_ID_SEARCH_BYTES = 64 * 1024
+# Maximum total length of the input paths passed to one fuzz binary call. Windows
+# limits the whole command line to 32767 characters, the rest is left for the
+# binary and valgrind arguments. Other platforms allow much more (ARG_MAX).
+MAX_CHUNK_ARGS_LENGTH = 24 * 1024
 
 
 def get_fuzz_env(*, target, source_dir):
@@ -78,6 +108,21 @@ def main():
         action="append",
         help="Merge inputs from these directories into the corpus_dir.",
     )
+    parser.add_argument(
+        '--cache_file',
+        help='File keeping the inputs that passed with the current fuzz binary, and the runtime per input of each target. Default: fuzz_cache.json in the build test directory.',
+    )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help='Run every target once over its whole corpus directory, without skipping inputs that passed before.',
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=1000,
+        help='Maximum number of inputs run by one fuzz binary invocation, when using the cache. Chunks are also limited by the length of their command line.',
+    )
     parser.add_argument(
         '-g',
         '--generate',
@@ -189,7 +234,22 @@ def main():
             )
             return
 
-        run_once(
+        if args.no_cache:
+            run_once(
+                fuzz_pool=fuzz_pool,
+                corpus=args.corpus_dir,
+                test_list=test_list_selection,
+                src_dir=config['environment']['SRCDIR'],
+                fuzz_bin=fuzz_bin,
+                using_libfuzzer=using_libfuzzer,
+                use_valgrind=args.valgrind,
+                empty_min_time=args.empty_min_time,
+            )
+            return
+
+        binary_id = fuzz_binary_id(fuzz_bin) + ("-valgrind" if args.valgrind else "")
+        cache_file = args.cache_file or os.path.join(config["environment"]["BUILDDIR"], "test", "fuzz_cache.json")
+        run_once_cached(
             fuzz_pool=fuzz_pool,
             corpus=args.corpus_dir,
             test_list=test_list_selection,
@@ -198,6 +258,8 @@ def main():
             using_libfuzzer=using_libfuzzer,
             use_valgrind=args.valgrind,
             empty_min_time=args.empty_min_time,
+            cache=CorpusCache(cache_file, binary_id),
+            chunk_size=args.chunk_size,
         )
 
 
@@ -388,6 +450,167 @@ def run_once(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, using_libfuzzer
             print(f"{t}{s}")
 
 
+def fuzz_binary_id(fuzz_bin):
+    """Return the GNU build ID of the fuzz binary, or the SHA256 of its contents if it has none."""
+    with open(fuzz_bin, 'rb') as f:
+        head = f.read(BUILD_ID_SEARCH_BYTES)
+        match = GNU_BUILD_ID_NOTE.search(head)
+        if match:
+            start = match.end()
+            return "build-id-" + head[start:start + match.group(1)[0]].hex()
+        f.seek(0)
+        return "sha256-" + file_hash(f)
+
+
+def file_hash(f):
+    hasher = hashlib.sha256()
+    while chunk := f.read(1024 * 1024):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def input_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()[:INPUT_HASH_BYTES].hex()
+
+
+class CorpusCache:
+    """Inputs that passed per target with one fuzz binary, and the average
+    runtime per input of each target, persisted as JSON.
+
+    The passed inputs are dropped when the binary ID changes, the runtimes
+    are kept, as they only change slowly between builds."""
+
+    def __init__(self, path, binary_id):
+        self.path = path
+        self.binary_id = binary_id
+        self.passed = {}
+        self.runtimes = {}
+        try:
+            with open(path, encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            return
+        self.runtimes = data.get("runtimes", {})
+        if data.get("binary_id") == binary_id:
+            self.passed = {t: set(hashes) for t, hashes in data.get("passed", {}).items()}
+
+    def save(self):
+        """Write the cache to self.path, replacing the previous file atomically."""
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf8', dir=dirname, prefix='.fuzz_cache', delete=False) as f:
+            json.dump({
+                "version": CACHE_VERSION,
+                "binary_id": self.binary_id,
+                "passed": {t: sorted(hashes) for t, hashes in self.passed.items()},
+                "runtimes": self.runtimes,
+            }, f)
+        os.replace(f.name, self.path)
+
+    def has_passed(self, target, digest):
+        return digest in self.passed.get(target, ())
+
+    def add_passed(self, target, digests, duration):
+        """Record that the inputs with the given hashes passed, taking duration seconds in total."""
+        self.passed.setdefault(target, set()).update(digests)
+        per_input = duration / len(digests)
+        previous = self.runtimes.get(target)
+        self.runtimes[target] = per_input if previous is None else EWMA_ALPHA * per_input + (1 - EWMA_ALPHA) * previous
+
+    def expected_duration(self, target, num_inputs):
+        """Return the expected seconds to run num_inputs inputs of target, or infinity if unknown."""
+        per_input = self.runtimes.get(target)
+        return math.inf if per_input is None else per_input * num_inputs
+
+
+def split_chunks(inputs, chunk_size, max_length=MAX_CHUNK_ARGS_LENGTH):
+    """Split the list of (path, digest) inputs into chunks of at most chunk_size
+    inputs, whose paths take at most max_length characters on the command line
+    (a chunk always has at least one input)."""
+    chunks = []
+    chunk = []
+    length = 0
+    for path, digest in inputs:
+        # Separating space and possible quotes
+        arg_length = len(str(path)) + 3
+        if chunk and (len(chunk) == chunk_size or length + arg_length > max_length):
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append((path, digest))
+        length += arg_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def run_once_cached(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, using_libfuzzer, use_valgrind, empty_min_time, cache, chunk_size):
+    """Like run_once(), but skip the inputs that already passed with the same
+    fuzz binary and run the others in chunks of at most chunk_size inputs
+    (see split_chunks), longest expected chunk first. Targets with an empty corpus are passed
+    to run_once(). With libFuzzer, the summary reports the final stats of the
+    chunks instead of the DONE line of a corpus run."""
+    empty_targets = [t for t in test_list if not (corpus / t).is_dir() or not any((corpus / t).iterdir())]
+    if empty_targets:
+        run_once(fuzz_pool=fuzz_pool, corpus=corpus, test_list=empty_targets, src_dir=src_dir, fuzz_bin=fuzz_bin,
+                 using_libfuzzer=using_libfuzzer, use_valgrind=use_valgrind, empty_min_time=empty_min_time)
+    test_list = [t for t in test_list if t not in empty_targets]
+
+    def hash_inputs(t):
+        paths = sorted(p for p in (corpus / t).iterdir() if p.is_file())
+        return t, [(p, input_hash(p)) for p in paths]
+
+    stats = {}
+    chunks = []
+    for t, inputs in fuzz_pool.map(hash_inputs, test_list):
+        todo = [(p, digest) for p, digest in inputs if not cache.has_passed(t, digest)]
+        stats[t] = {"run": 0, "cached": len(inputs) - len(todo), "time": 0.0, "slowest_unit_time_sec": 0, "peak_rss_mb": 0}
+        chunks += [(t, chunk) for chunk in split_chunks(todo, chunk_size)]
+    chunks.sort(key=lambda chunk: cache.expected_duration(chunk[0], len(chunk[1])), reverse=True)
+    logging.info(f"Running {sum(len(inputs) for _, inputs in chunks)} inputs in {len(chunks)} chunks, "
+                 f"skipping {sum(s['cached'] for s in stats.values())} inputs that passed before")
+
+    def job(t, inputs):
+        args = [fuzz_bin] + (["-print_final_stats=1"] if using_libfuzzer else []) + [str(p) for p, _ in inputs]
+        if use_valgrind:
+            args = ['valgrind', '--quiet', '--error-exitcode=1'] + args
+        start = time.time()
+        result = subprocess.run(
+            args,
+            env=get_fuzz_env(target=t, source_dir=src_dir),
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        return t, inputs, result, time.time() - start
+
+    jobs = [fuzz_pool.submit(job, t, inputs) for t, inputs in chunks]
+    for future in as_completed(jobs):
+        t, inputs, result, duration = future.result()
+        logging.debug('Run {} with {} inputs\n{}'.format(t, len(inputs), result.stderr))
+        if result.returncode != 0:
+            # Keep the inputs that passed so far
+            cache.save()
+            logging.info(result.stderr)
+            logging.info(f"⚠️ Failure generated from target {t} with exit code {result.returncode} on one of: {' '.join(str(p) for p, _ in inputs)}")
+            sys.exit(1)
+        cache.add_passed(t, [digest for _, digest in inputs], duration)
+        stats[t]["run"] += len(inputs)
+        stats[t]["time"] += duration
+        if using_libfuzzer:
+            for name, value in re.findall(r"^stat::(slowest_unit_time_sec|peak_rss_mb):\s*(\d+)$", result.stderr, re.MULTILINE):
+                stats[t][name] = max(stats[t][name], int(value))
+    cache.save()
+
+    if stats:
+        print("Summary:")
+        max_len = max(len(t) for t in stats)
+        for t, s in sorted(stats.items()):
+            libfuzzer_stats = f", slowest input: {s['slowest_unit_time_sec']} s, rss: {s['peak_rss_mb']} Mb" if using_libfuzzer else ""
+            print(f"{t.ljust(max_len + 1)}{s['run']} inputs run in {s['time']:.1f} s, {s['cached']} skipped{libfuzzer_stats}")
+
+
 def parse_test_list(*, fuzz_bin, source_dir):
     test_list_all = subprocess.run(
         fuzz_bin,